@@ -0,0 +1,21 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'task', 'queue', 'status', 'attempts', 'run_at', 'wait_seconds', 'run_seconds', 'finished_at']
+    list_filter = ['status', 'queue', 'task']
+    search_fields = ['task', 'last_error']
+    readonly_fields = [
+        'attempts', 'locked_by', 'locked_at', 'last_error', 'created_at', 'started_at', 'finished_at',
+        'wait_seconds', 'run_seconds',
+    ]
+    actions = ['run_again']
+
+    @admin.action(description='Run selected jobs again now')
+    def run_again(self, request, queryset):
+        count = queryset.exclude(status='running').update(status='queued', run_at=timezone.now(), attempts=0)
+        self.message_user(request, f'{count} job(s) queued.')
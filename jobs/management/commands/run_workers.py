@@ -0,0 +1,74 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.process import process_main
+from jobs.queue import job_stats
+from jobs.worker import run_threads
+
+
+class Command(BaseCommand):
+    help = ("Run background jobs from the database queue. Safe to start on several machines or "
+            "more than once; each job is claimed by a single worker.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Worker threads per process")
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Worker processes, each with --threads threads, for CPU-bound tasks")
+        parser.add_argument('--queue', action='append', help="Only run jobs from this queue (repeatable)")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when idle")
+        parser.add_argument('--stats', action='store_true', help="Print queue depth and timings per task and exit")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        if options['processes'] <= 1:
+            stop = threading.Event()
+            # Finish the jobs in hand on Ctrl-C or a stop from the process manager
+            signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+            signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+            count = run_threads(options['threads'], options['queue'], options['burst'], options['poll_interval'], stop)
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} job(s)."))
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        children = [
+            multiprocessing.Process(target=process_main, args=(options,), name=f'jobs-process-{i}')
+            for i in range(options['processes'])
+        ]
+
+        def stop_children(signum, frame):
+            # Each child finishes the jobs in hand and exits; wait for them below
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+
+        signal.signal(signal.SIGTERM, stop_children)
+        signal.signal(signal.SIGINT, stop_children)
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+
+    def print_stats(self):
+        stats = job_stats()
+        if not stats:
+            self.stdout.write("No jobs.")
+            return
+        for task, row in stats.items():
+            self.stdout.write(
+                f"{task}: {row['queued']} queued, {row['running']} running, {row['done']} done, "
+                f"{row['failed']} failed, {row['retries'] or 0} retries"
+            )
+            if row['avg_run'] is not None:
+                self.stdout.write(
+                    f"  run {row['avg_run'] * 1000:.1f} ms avg / {row['max_run'] * 1000:.1f} ms max, "
+                    f"wait {row['avg_wait']:.2f} s avg / {row['max_wait']:.2f} s max"
+                )
@@ -0,0 +1,22 @@
+# jobs/process.py
+"""
+Entry point of the worker processes started by `manage.py run_workers
+--processes`. Spawned children import this module before Django is set
+up, so nothing here may import models until process_main() runs.
+"""
+import signal
+import threading
+
+import django
+
+
+def process_main(options):
+    # Spawned children start from scratch; forked ones already have Django set up
+    django.setup()
+    from .worker import run_threads
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    # Ctrl-C reaches the whole process group; the parent passes it on as SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_threads(options['threads'], options['queue'], options['burst'], options['poll_interval'], stop)
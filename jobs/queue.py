@@ -0,0 +1,199 @@
+# jobs/queue.py
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+# Due jobs read per claim attempt; the first one still free is taken
+CLAIM_BATCH = 10
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def task_path(task):
+    """Dotted path of a task given as a function or already as a path"""
+    if isinstance(task, str):
+        return task
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, args=(), kwargs=None, *, queue='default', run_at=None, delay=None, max_attempts=None):
+    """
+    Queue ``task(*args, **kwargs)`` to run in a worker, no earlier than
+    ``run_at`` or ``delay`` seconds from now. Arguments must be JSON
+    serializable, so pass ids rather than model instances.
+
+    The job is a row in the current transaction: it only becomes visible
+    to workers if that commits, and never runs before the data it needs.
+    Tasks may run more than once if a worker dies, so they should be safe
+    to repeat.
+    """
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    return Job.objects.create(
+        queue=queue,
+        task=task_path(task),
+        args=list(args),
+        kwargs=kwargs or {},
+        run_at=run_at,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def _due(now):
+    # Running jobs whose worker hasn't finished them in time are presumed lost
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    return Q(status='queued', run_at__lte=now) | Q(status='running', locked_at__lt=stale)
+
+
+def claim(worker, queues=None, now=None):
+    """
+    Take the oldest due job for ``worker`` and mark it running, or return
+    None if there is nothing to do.
+
+    On PostgreSQL the candidates are read with SELECT ... FOR UPDATE SKIP
+    LOCKED, so concurrent workers pass over each other's rows instead of
+    waiting. SQLite has no row locks, but its transactions here take the
+    write lock up front, so claims queue behind each other. Either way the
+    claim itself is a conditional UPDATE that only succeeds if the job is
+    still due.
+    """
+    now = now or timezone.now()
+    due = Job.objects.filter(_due(now))
+    if queues:
+        due = due.filter(queue__in=queues)
+
+    with transaction.atomic():
+        candidates = due.order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        for pk in list(candidates.values_list('pk', flat=True)[:CLAIM_BATCH]):
+            claimed = due.filter(pk=pk).update(
+                status='running',
+                locked_by=worker,
+                locked_at=now,
+                attempts=F('attempts') + 1,
+                started_at=now,
+                finished_at=None,
+            )
+            if claimed:
+                return Job.objects.get(pk=pk)
+    return None
+
+
+def run_pending(queues=None):
+    """Run every due job in this thread, e.g. from tests or a cron job. Returns how many ran."""
+    name = worker_name()
+    count = 0
+    while (job := claim(name, queues)) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+def retry_delay(attempts):
+    """Seconds before the next try: doubling from JOBS_RETRY_DELAY, capped, with jitter"""
+    delay = min(settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1), settings.JOBS_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(job):
+    """
+    Run a claimed job and record the outcome: done, queued again after a
+    backoff delay, or failed once it has used up its attempts. Returns the
+    new status.
+    """
+    started = time.perf_counter()
+    error = ''
+    if job.attempts > job.max_attempts:
+        error = "Gave up: the job's worker stopped before finishing it too many times"
+    else:
+        try:
+            import_string(job.task)(*job.args, **job.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+    elapsed = time.perf_counter() - started
+
+    now = timezone.now()
+    fields = {
+        'finished_at': now,
+        'run_seconds': elapsed,
+        'wait_seconds': (job.started_at - job.run_at).total_seconds(),
+        'locked_by': '',
+        'locked_at': None,
+        'last_error': error,
+    }
+    if not error:
+        status = 'done'
+    elif job.attempts < job.max_attempts:
+        status = 'queued'
+        fields['run_at'] = now + timedelta(seconds=retry_delay(job.attempts))
+    else:
+        status = 'failed'
+    # Only if it's still ours; a job that overran its lock may have been claimed again
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(status=status, **fields)
+
+    with _stats_lock:
+        _stats[job.task, status] += 1
+        _stats[job.task, 'seconds'] += elapsed
+    return status
+
+
+def get_worker_stats():
+    """Outcomes and run time per task for jobs run by this process"""
+    with _stats_lock:
+        tasks = {task for task, key in _stats}
+        return {
+            task: {key: _stats[task, key] for key in ('done', 'queued', 'failed', 'seconds')}
+            for task in sorted(tasks)
+        }
+
+
+def reset_worker_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def job_stats():
+    """
+    Queue depth and timing per task from the jobs table, in one query:
+    how many jobs are in each state, the oldest queued one, and the mean
+    and worst wait and run times of finished attempts.
+    """
+    rows = Job.objects.values('task').order_by('task').annotate(
+        queued=Count('pk', filter=Q(status='queued')),
+        running=Count('pk', filter=Q(status='running')),
+        done=Count('pk', filter=Q(status='done')),
+        failed=Count('pk', filter=Q(status='failed')),
+        retries=Sum(F('attempts') - 1, filter=Q(attempts__gt=1)),
+        oldest_queued=Min('run_at', filter=Q(status='queued')),
+        avg_wait=Avg('wait_seconds'),
+        max_wait=Max('wait_seconds'),
+        avg_run=Avg('run_seconds'),
+        max_run=Max('run_seconds'),
+    )
+    return {row.pop('task'): row for row in rows}
+
+
+def prune_jobs(days=None):
+    """Delete jobs that finished more than ``days`` ago; failed ones are kept for inspection"""
+    days = settings.JOBS_KEEP_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status='done', finished_at__lt=cutoff).delete()[0]
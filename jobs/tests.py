@@ -0,0 +1,155 @@
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim, enqueue, job_stats, prune_jobs, run_pending
+from .worker import run_threads
+
+calls = []
+calls_lock = threading.Lock()
+
+
+def record(value):
+    with calls_lock:
+        calls.append(value)
+
+
+def flaky(fail_times):
+    job = Job.objects.get(task='jobs.tests.flaky', status='running')
+    if job.attempts <= fail_times:
+        raise RuntimeError(f'attempt {job.attempts} failed')
+
+
+def wait_for_sigterm(options):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    sys.exit(0 if stop.wait(10) else 1)
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_due_jobs_run_in_order(self):
+        enqueue(record, ['later'], delay=60)
+        enqueue(record, ['first'])
+        enqueue('jobs.tests.record', kwargs={'value': 'second'})
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(calls, ['first', 'second'])
+
+        job = Job.objects.filter(status='done').first()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreaterEqual(job.run_seconds, 0)
+        self.assertGreaterEqual(job.wait_seconds, 0)
+        self.assertEqual(Job.objects.get(status='queued').args, ['later'])
+
+    @override_settings(JOBS_MAX_ATTEMPTS=3, JOBS_RETRY_DELAY=10)
+    def test_failures_are_retried_with_backoff(self):
+        job = enqueue(flaky, [5])
+        delays = []
+        with mock.patch('jobs.queue.random.uniform', return_value=1.0):
+            for attempt in range(3):
+                Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+                before = timezone.now()
+                run_pending()
+                job.refresh_from_db()
+                delays.append(round((job.run_at - before).total_seconds()))
+        self.assertEqual(delays[:2], [10, 20])
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 3)
+        self.assertIn('RuntimeError: attempt 3 failed', job.last_error)
+
+        retried = enqueue(flaky, [1])
+        run_pending()
+        Job.objects.filter(pk=retried.pk).update(run_at=timezone.now())
+        run_pending()
+        retried.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts, retried.last_error), ('done', 2, ''))
+
+    def test_claimed_jobs_are_not_claimed_again_until_their_lock_goes_stale(self):
+        enqueue(record, ['once'])
+        job = claim('worker-a')
+        self.assertEqual(job.status, 'running')
+        self.assertIsNone(claim('worker-b'))
+
+        later = timezone.now() + timedelta(hours=1)
+        stolen = claim('worker-b', now=later)
+        self.assertEqual((stolen.pk, stolen.attempts, stolen.locked_by), (job.pk, 2, 'worker-b'))
+
+    def test_queues(self):
+        enqueue(record, ['images'], queue='images')
+        enqueue(record, ['default'])
+        self.assertEqual(run_pending(queues=['images']), 1)
+        self.assertEqual(calls, ['images'])
+
+    def test_stats_and_pruning(self):
+        enqueue(record, ['a'])
+        enqueue(record, ['b'], delay=60)
+        run_pending()
+        stats = job_stats()['jobs.tests.record']
+        self.assertEqual((stats['queued'], stats['done'], stats['failed']), (1, 1, 0))
+        self.assertIsNotNone(stats['avg_run'])
+
+        out = StringIO()
+        call_command('run_workers', stats=True, stdout=out)
+        self.assertIn('jobs.tests.record: 1 queued, 0 running, 1 done', out.getvalue())
+
+        Job.objects.filter(status='done').update(finished_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(prune_jobs(days=7), 1)
+
+
+class WorkerPoolTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_every_job_runs_once_across_threads(self):
+        for i in range(40):
+            enqueue(record, [i])
+        self.assertEqual(run_threads(threads=4, burst=True, poll_interval=0.01), 40)
+        self.assertEqual(sorted(calls), list(range(40)))
+        self.assertEqual(Job.objects.filter(status='done').count(), 40)
+
+    def test_command_in_burst_mode(self):
+        enqueue(record, ['x'])
+        out = StringIO()
+        call_command('run_workers', burst=True, threads=2, stdout=out)
+        self.assertIn('Ran 1 job(s).', out.getvalue())
+
+    def test_process_entry_point_imports_before_setup(self):
+        # What a spawned child does before process_main() sets Django up
+        result = subprocess.run(
+            [sys.executable, '-c', 'import jobs.process'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_sigterm_is_passed_on_to_the_worker_processes(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        children = []
+        real_process = multiprocessing.Process
+
+        def process(**kwargs):
+            child = real_process(**dict(kwargs, target=wait_for_sigterm))
+            children.append(child)
+            return child
+
+        timer = threading.Timer(0.5, os.kill, [os.getpid(), signal.SIGTERM])
+        timer.start()
+        with mock.patch('jobs.management.commands.run_workers.multiprocessing.Process', process):
+            call_command('run_workers', processes=2, stdout=StringIO())
+        timer.join()
+        self.assertEqual([child.exitcode for child in children], [0, 0])
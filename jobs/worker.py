@@ -0,0 +1,67 @@
+# jobs/worker.py
+import logging
+import threading
+import time
+
+from django.db import close_old_connections, connection
+
+from .queue import claim, prune_jobs, run_job, worker_name
+
+logger = logging.getLogger(__name__)
+
+# How often a long-running worker deletes old finished jobs
+PRUNE_INTERVAL = 60 * 60
+
+
+def work(stop, queues=None, burst=False, poll_interval=1.0):
+    """
+    Claim and run jobs until ``stop`` (a threading.Event) is set, or, with
+    ``burst``, until no job is due. Sleeps ``poll_interval`` seconds when
+    the queue is empty. Returns how many jobs were run.
+    """
+    name = worker_name()
+    count = 0
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            job = claim(name, queues)
+            if job is None:
+                if burst:
+                    break
+                stop.wait(poll_interval)
+                continue
+            started = time.perf_counter()
+            status = run_job(job)
+            count += 1
+            logger.info("%s %s #%s %s in %.3fs", name, job.task, job.pk, status, time.perf_counter() - started)
+    finally:
+        connection.close()
+    return count
+
+
+def run_threads(threads=1, queues=None, burst=False, poll_interval=1.0, stop=None):
+    """
+    Run ``threads`` workers side by side in this process and wait for them.
+    Returns the total number of jobs run.
+    """
+    stop = stop or threading.Event()
+    counts = []
+    lock = threading.Lock()
+
+    def target():
+        count = work(stop, queues, burst, poll_interval)
+        with lock:
+            counts.append(count)
+
+    workers = [threading.Thread(target=target, name=f'jobs-worker-{i}', daemon=True) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    last_prune = time.monotonic()
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(timeout=poll_interval)
+        if not burst and time.monotonic() - last_prune > PRUNE_INTERVAL:
+            prune_jobs()
+            connection.close()
+            last_prune = time.monotonic()
+    return sum(counts)
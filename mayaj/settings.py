@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from decouple import config
 
@@ -15,6 +16,10 @@ SECRET_KEY = config('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config('DEBUG', default=False, cast=bool)
 
+# `manage.py test` keeps clear of the shared cache and metrics files of a server running on
+# the same machine, and out of the request log
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = ['*']
 
 
@@ -31,6 +36,7 @@ INSTALLED_APPS = [
     'ckeditor',
     'ckeditor_uploader',
     'store',
+    'jobs',
 ]
 
 # Jazzmin Admin Configuration (optional - can be in settings.py)
@@ -137,6 +143,8 @@ JAZZMIN_UI_TWEAKS = {
 }
 
 MIDDLEWARE = [
+    'store.middleware.LatencyMetricsMiddleware',
+    'store.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -144,13 +152,15 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.middleware.AnonymousPageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'mayaj.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for RequestMetricsMiddleware
+        'BACKEND': 'store.request_metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -158,6 +168,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.site_config',
+                'store.context_processors.page_cache',
             ],
         },
     },
@@ -173,9 +185,39 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # take the write lock up front so concurrent checkouts queue instead of failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # in-memory test databases can't wait on locks, which the concurrency tests need
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+CACHES = {
+    'default': {
+        # LocMemCache, counting hits for RequestMetricsMiddleware (RedisMetricsCache for Redis)
+        'BACKEND': 'store.request_metrics.LocMemMetricsCache',
+        # room for a few thousand cached product cards next to the facet counts
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # versions every process must agree on, such as the page cache's tag versions;
+    # a file cache is shared by the processes of one machine, use Redis across machines
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('SHARED_CACHE_DIR', default=os.path.join(BASE_DIR, 'var', 'shared-cache')),
+        # versions are kept until changed; incr() on a file cache would otherwise reset their expiry
+        'TIMEOUT': None,
+        # only small version keys; culling one could bring back a purged page
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+if TESTING:
+    CACHES['shared'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared', 'TIMEOUT': None}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -233,4 +275,62 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 # cart session id define
-CART_SESSION_ID = 'cart'
\ No newline at end of file
+CART_SESSION_ID = 'cart'
+CART_TOTAL_SESSION_ID = 'cart_total'
+DISCOUNT_CODE_SESSION_ID = 'discount_code'
+
+# how long unpaid mobile-payment orders hold their stock
+STOCK_RESERVATION_TTL_MINUTES = 30
+
+# how long the "N products" label on the product list may be stale; 0 hides it
+PRODUCT_COUNT_CACHE_SECONDS = 300
+
+# upper bound on how long cached facet counts live; changes normally invalidate them sooner
+FACET_CACHE_SECONDS = 600
+
+# product and combo card markup; keys change with the cards, so this only bounds memory use
+CARD_CACHE_SECONDS = 60 * 60 * 24
+
+# anonymous storefront pages; model changes purge them sooner in every process sharing the 'shared' cache
+PAGE_CACHE_SECONDS = 600
+
+# discounts worked out for a cart; keys change with the cart and the offers, so this only bounds memory use
+CART_DISCOUNT_CACHE_SECONDS = 60 * 60
+
+# live offers and combos are cached until the next one starts or ends or an edit anywhere bumps their version, and at most this long
+PROMOTIONS_CACHE_SECONDS = 600
+
+# background jobs run by `manage.py run_workers`
+JOBS_MAX_ATTEMPTS = 5
+# first retry after this many seconds, doubling each time up to the maximum
+JOBS_RETRY_DELAY = 10
+JOBS_RETRY_MAX_DELAY = 60 * 60
+# a running job not finished after this long is presumed lost with its worker and run again
+JOBS_LOCK_TIMEOUT = 10 * 60
+# finished jobs are deleted after this many days; failed ones are kept
+JOBS_KEEP_DAYS = 7
+
+# share of requests whose queries, template time and cache hits are measured, from 0 to 1
+REQUEST_METRICS_SAMPLE_RATE = config('REQUEST_METRICS_SAMPLE_RATE', default=0.01, cast=float)
+# also send the measurements to the browser in a Server-Timing header; it shows query counts, so off in production
+REQUEST_METRICS_SERVER_TIMING = config('REQUEST_METRICS_SERVER_TIMING', default=DEBUG, cast=bool)
+
+# each process writes its /metrics counters here to be added up with the others'; empty keeps them per process.
+# One directory per deployment and machine; tests keep theirs per process
+METRICS_DIR = '' if TESTING else config('METRICS_DIR', default=os.path.join(BASE_DIR, 'var', 'metrics'))
+# how often each process writes them
+METRICS_FLUSH_SECONDS = 5
+# /metrics asks for an "Authorization: Bearer <token>" header; with no token it is only served when DEBUG is on
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# measured requests are logged as JSON lines on 'store.requests'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'store.requests': {'handlers': [] if TESTING else ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -1,5 +1,10 @@
 from django.contrib import admin
+from django.utils.html import format_html
 from .models import *
+from .order_utils import mark_orders_paid
+from .page_cache import purge_page_tags
+from .ratings import recompute_ratings
+from .renditions import rendition
 
 
 @admin.register(SiteSettings)
@@ -29,7 +34,15 @@ class CategoryAdmin(admin.ModelAdmin):
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1
-    fields = ['image', 'alt_text', 'is_primary', 'order']
+    fields = ['thumbnail', 'image', 'alt_text', 'is_primary', 'order']
+    readonly_fields = ['thumbnail']
+
+    @admin.display(description='Preview')
+    def thumbnail(self, obj):
+        name = rendition(obj, 'admin')
+        if not name:
+            return '-'
+        return format_html('<img src="{}" width="80" alt="">', obj.image.storage.url(name))
 
 class ProductSizeInline(admin.TabularInline):
     model = ProductSize
@@ -71,6 +84,26 @@ class ProductReviewAdmin(admin.ModelAdmin):
     list_filter = ['rating', 'is_approved', 'is_featured', 'created_at']
     search_fields = ['customer_name', 'product__name', 'title']
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['approve_reviews', 'unapprove_reviews']
+
+    def _set_approved(self, queryset, approved):
+        changed = queryset.exclude(is_approved=approved)
+        product_ids = set(changed.values_list('product_id', flat=True))
+        count = changed.update(is_approved=approved)
+        # update() skips ProductReview.save(), so refresh the affected totals in one pass
+        recompute_ratings(product_ids)
+        purge_page_tags(f'product:{product_id}' for product_id in product_ids)
+        return count
+
+    @admin.action(description='Approve selected reviews')
+    def approve_reviews(self, request, queryset):
+        count = self._set_approved(queryset, True)
+        self.message_user(request, f"{count} review(s) approved.")
+
+    @admin.action(description='Unapprove selected reviews')
+    def unapprove_reviews(self, request, queryset):
+        count = self._set_approved(queryset, False)
+        self.message_user(request, f"{count} review(s) unapproved.")
 
 @admin.register(Offer)
 class OfferAdmin(admin.ModelAdmin):
@@ -88,13 +121,14 @@ class ComboProductInline(admin.TabularInline):
 
 @admin.register(ComboOffer)
 class ComboOfferAdmin(admin.ModelAdmin):
-    list_display = ['name', 'original_price', 'discount_price', 'discount_percentage', 'is_active', 'is_featured', 'start_date', 'end_date']
+    list_display = ['name', 'original_price', 'discount_price', 'discount_percentage', 'stock_quantity', 'is_active', 'is_featured', 'start_date', 'end_date']
     list_editable = ['is_active', 'is_featured']
     list_filter = ['is_active', 'is_featured', 'start_date', 'end_date']
     search_fields = ['name', 'slug']
     prepopulated_fields = {'slug': ('name',)}
     inlines = [ComboProductInline]
-    readonly_fields = ['created_at', 'updated_at']
+    # Worked out from the combo's products
+    readonly_fields = ['original_price', 'discount_percentage', 'savings_badge_text', 'stock_quantity', 'created_at', 'updated_at']
 
 @admin.register(RotatingShowcaseProduct)
 class RotatingShowcaseProductAdmin(admin.ModelAdmin):
@@ -227,8 +261,23 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'customer_name', 'created_at', 'get_order_total']
     list_filter = ['created_at', 'status']
     search_fields = ['order_number', 'shipping_full_name', 'shipping_email']  # Fixed search fields
-    readonly_fields = ['created_at', 'updated_at', 'get_order_total']
+    readonly_fields = ['created_at', 'updated_at', 'get_order_total', 'reservation_expires_at', 'stock_released']
     inlines = [OrderItemInline]
+    actions = ['cancel_orders', 'mark_paid']
+
+    @admin.action(description='Cancel selected orders and release their stock')
+    def cancel_orders(self, request, queryset):
+        orders = queryset.exclude(status='cancelled')
+        count = 0
+        for order in orders:
+            order.cancel()
+            count += 1
+        self.message_user(request, f"{count} order(s) cancelled.")
+
+    @admin.action(description='Mark selected orders as paid')
+    def mark_paid(self, request, queryset):
+        count = mark_orders_paid(queryset)
+        self.message_user(request, f"{count} order(s) marked as paid.")
 
     # Fixed customer_name method
     def customer_name(self, obj):
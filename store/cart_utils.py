@@ -1,6 +1,22 @@
 # store/cart_utils.py
+import hashlib
+from decimal import Decimal, ROUND_HALF_UP
+
 from django.conf import settings
 
+from .metrics import inc
+
+
+def to_poisha(amount):
+    """Convert a taka amount to integer poisha"""
+    return int((Decimal(amount) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_poisha(poisha):
+    """Convert integer poisha back to an exact two-place taka Decimal"""
+    return Decimal(poisha).scaleb(-2)
+
+
 class Cart:
     def __init__(self, request):
         self.session = request.session
@@ -8,55 +24,145 @@ class Cart:
         if not cart:
             cart = self.session[settings.CART_SESSION_ID] = {}
         self.cart = cart
-    
+        self._lines = None
+
+        total = self.session.get(settings.CART_TOTAL_SESSION_ID)
+        if total is None:
+            # Carts saved before prices were stored in poisha
+            for item in self.cart.values():
+                item['price'] = to_poisha(item['price'])
+            total = sum(item['price'] * item['quantity'] for item in self.cart.values())
+            self.session[settings.CART_TOTAL_SESSION_ID] = total
+        self.total = total
+
     def add(self, product, quantity=1, size=None, update_quantity=False):
         product_id = str(product.id)
         size_key = size or 'no_size'
         item_key = f"{product_id}_{size_key}"
-        
+
         if item_key not in self.cart:
             self.cart[item_key] = {
                 'quantity': 0,
-                'price': str(product.discount_price or product.price),
+                'price': to_poisha(product.discount_price or product.price),
                 'size': size,
                 'product_id': product_id,
             }
-        
+
+        item = self.cart[item_key]
         if update_quantity:
-            self.cart[item_key]['quantity'] = quantity
+            self._set_quantity(item, quantity)
         else:
-            self.cart[item_key]['quantity'] += quantity
-        
+            self._set_quantity(item, item['quantity'] + quantity)
+
+        self.save()
+        inc('store_cart_changes_total', action='add')
+
+    def update(self, product_id, quantity, size=None):
+        """Set the quantity of an existing line, returning its key or None"""
+        size_key = size or 'no_size'
+        item_key = f"{product_id}_{size_key}"
+
+        if item_key not in self.cart:
+            return None
+        self._set_quantity(self.cart[item_key], quantity)
         self.save()
-    
+        return item_key
+
     def remove(self, product_id, size=None):
         size_key = size or 'no_size'
         item_key = f"{product_id}_{size_key}"
-        
+
         if item_key in self.cart:
+            self._set_quantity(self.cart[item_key], 0)
             del self.cart[item_key]
             self.save()
-    
+            inc('store_cart_changes_total', action='remove')
+
+    def _set_quantity(self, item, quantity):
+        # Keep the running total in step with every quantity change
+        self.total += item['price'] * (quantity - item['quantity'])
+        item['quantity'] = quantity
+
     def save(self):
+        self.session[settings.CART_TOTAL_SESSION_ID] = self.total
         self.session.modified = True
-    
-    def __iter__(self):
-        from .models import Product
-        product_ids = [item['product_id'] for item in self.cart.values()]
-        products = Product.objects.filter(id__in=product_ids)
-        
-        for product in products:
+        # Any change to the session data invalidates the materialized snapshot
+        self._lines = None
+
+    @property
+    def version(self):
+        """Changes with any line's quantity or price, for caching what's worked out from the cart"""
+        items = sorted((key, item['quantity'], item['price']) for key, item in self.cart.items())
+        return hashlib.md5(repr(items).encode(), usedforsecurity=False).hexdigest()
+
+    def get_lines(self):
+        """
+        Materialize the cart once per request: products with their primary image
+        and sizes are fetched in one batched pass and line totals are computed here.
+        Lines whose product has been deleted are dropped from the session, so
+        the running total and count match the lines an order would be placed for.
+        """
+        if self._lines is None:
+            from .models import Product
+            product_ids = {int(item['product_id']) for item in self.cart.values()}
+            products = Product.objects.for_cards().in_bulk(product_ids)
+
+            lines = []
+            missing = []
             for item_key, item in self.cart.items():
-                if item['product_id'] == str(product.id):
-                    item['product'] = product
-                    yield item_key, item
-    
+                product = products.get(int(item['product_id']))
+                if product is None:
+                    missing.append(item_key)
+                    continue
+                quantity = item['quantity']
+                lines.append((item_key, {
+                    'product': product,
+                    'product_id': item['product_id'],
+                    'size': item['size'],
+                    'quantity': quantity,
+                    'price': from_poisha(item['price']),
+                    'total_price': from_poisha(item['price'] * quantity),
+                    'original_total_price': product.price * quantity,
+                    'image_url': product.primary_image_url,
+                    'stock': self._get_stock(product, item['size']),
+                }))
+            for item_key in missing:
+                self._set_quantity(self.cart[item_key], 0)
+                del self.cart[item_key]
+            if missing:
+                self.save()
+            self._lines = lines
+        return self._lines
+
+    @staticmethod
+    def _get_stock(product, size):
+        # Sizes come from the prefetch done by for_cards(), so this never queries
+        if size:
+            for product_size in product.sizes.all():
+                if product_size.size == size:
+                    return product_size.stock_quantity
+        return product.stock_quantity
+
+    def get_item_total(self, item_key):
+        item = self.cart[item_key]
+        return from_poisha(item['price'] * item['quantity'])
+
+    def __iter__(self):
+        return iter(self.get_lines())
+
     def __len__(self):
         return sum(item['quantity'] for item in self.cart.values())
-    
+
     def get_total_price(self):
-        return sum(float(item['price']) * item['quantity'] for item in self.cart.values())
-    
+        # Drops lines for deleted products first; free where the lines are shown anyway
+        self.get_lines()
+        return from_poisha(self.total)
+
     def clear(self):
         del self.session[settings.CART_SESSION_ID]
-        self.save()
\ No newline at end of file
+        self.session.pop(settings.CART_TOTAL_SESSION_ID, None)
+        self.session.pop(settings.DISCOUNT_CODE_SESSION_ID, None)
+        self.cart = {}
+        self.total = 0
+        self.session.modified = True
+        self._lines = None
@@ -0,0 +1,238 @@
+# store/catalog.py
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db.models import Count, Q
+from django.db.models.functions import Coalesce
+
+from .metrics import count_cache
+from .models import Category, Product, ProductSize
+
+ACTIVE_PRODUCT_COUNT_KEY = 'store:active_product_count'
+
+
+def get_active_product_count():
+    """
+    Approximate number of active products for the "N products" label.
+
+    Counting is a full scan, so the figure is cached for
+    PRODUCT_COUNT_CACHE_SECONDS and may lag behind the catalogue by that
+    much. Returns None when the cache time is 0, which hides the label.
+    """
+    timeout = settings.PRODUCT_COUNT_CACHE_SECONDS
+    if not timeout:
+        return None
+    return cache.get_or_set(
+        ACTIVE_PRODUCT_COUNT_KEY,
+        lambda: Product.objects.filter(is_active=True).count(),
+        timeout,
+    )
+
+
+# Facets --------------------------------------------------------------------
+
+CATALOG_VERSION_KEY = 'store:catalog_version'
+
+# (key, label, lower bound, upper bound) on the price actually charged
+PRICE_BANDS = [
+    ('under-1000', 'Under ৳1,000', None, 1000),
+    ('1000-2500', '৳1,000 - ৳2,500', 1000, 2500),
+    ('2500-5000', '৳2,500 - ৳5,000', 2500, 5000),
+    ('5000-plus', '৳5,000 and above', 5000, None),
+]
+
+
+def effective_price(prefix=''):
+    """The price a product sells at: its discount price when it has one"""
+    return Coalesce(f'{prefix}discount_price', f'{prefix}price')
+
+
+def get_catalog_version():
+    """
+    Counter bumped on every catalogue change; part of every facet cache key.
+    Kept in the 'shared' cache like the promotions version, so bulk changes
+    made by commands and workers reach every process.
+    """
+    shared = caches['shared']
+    version = shared.get(CATALOG_VERSION_KEY)
+    if version is None:
+        shared.add(CATALOG_VERSION_KEY, int(time.time()), None)
+        version = shared.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    shared = caches['shared']
+    try:
+        shared.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        shared.add(CATALOG_VERSION_KEY, int(time.time()), None)
+
+
+def _price_band_q(key):
+    for band_key, label, low, high in PRICE_BANDS:
+        if band_key == key:
+            q = Q()
+            if low is not None:
+                q &= Q(effective_price__gte=low)
+            if high is not None:
+                q &= Q(effective_price__lt=high)
+            return q
+    return None
+
+
+class CatalogFilters:
+    """
+    Facet selections read from the query string.
+
+    Values within a family are OR'ed (two categories show both) and the
+    families are AND'ed together.
+    """
+
+    def __init__(self, data):
+        self.categories = sorted(set(data.getlist('category')))
+        self.genders = sorted(set(data.getlist('gender')) & {code for code, label in Product.GENDER_CHOICES})
+        self.prices = sorted(set(data.getlist('price')) & {band[0] for band in PRICE_BANDS})
+        self.sizes = sorted(set(data.getlist('size')))
+        self.is_new = data.get('new') == '1'
+        self.discounted = data.get('discount') == '1'
+
+    def __bool__(self):
+        return bool(self.categories or self.genders or self.prices or self.sizes or self.is_new or self.discounted)
+
+    def _conditions(self, prefix=''):
+        """
+        Filter for each family, keyed by family name. ``prefix`` is the path
+        to the product, e.g. 'product__' when filtering ProductSize rows.
+        """
+        conditions = {}
+        if self.categories:
+            conditions['category'] = Q(**{f'{prefix}category__slug__in': self.categories})
+        if self.genders:
+            conditions['gender'] = Q(**{f'{prefix}gender__in': self.genders})
+        if self.prices:
+            q = Q()
+            for key in self.prices:
+                q |= _price_band_q(key)
+            conditions['price'] = q
+        if self.sizes:
+            # An uncorrelated IN is evaluated once, not once per product
+            conditions['size'] = Q(**{f'{prefix}pk__in': ProductSize.objects.filter(
+                size__in=self.sizes, stock_quantity__gt=0,
+            ).values('product_id')})
+        if self.is_new:
+            conditions['new'] = Q(**{f'{prefix}is_new': True})
+        if self.discounted:
+            conditions['discount'] = Q(**{f'{prefix}discount_price__isnull': False})
+        return conditions
+
+    def apply(self, queryset, exclude=(), prefix=''):
+        """Filter ``queryset`` by every family except those in ``exclude``"""
+        conditions = self._conditions(prefix)
+        if 'price' in conditions and 'price' not in exclude:
+            queryset = queryset.annotate(effective_price=effective_price(prefix))
+        for family, condition in conditions.items():
+            if family not in exclude:
+                queryset = queryset.filter(condition)
+        return queryset
+
+    def querystring(self):
+        """The selections as query string parameters, for pagination links"""
+        params = [('category', value) for value in self.categories]
+        params += [('gender', value) for value in self.genders]
+        params += [('price', value) for value in self.prices]
+        params += [('size', value) for value in self.sizes]
+        if self.is_new:
+            params.append(('new', '1'))
+        if self.discounted:
+            params.append(('discount', '1'))
+        return urlencode(params)
+
+
+def compute_facets(filters):
+    """
+    Counts for every facet value: one grouped aggregate query per family,
+    plus a lookup of the category names.
+
+    Each family is counted with the other families' filters applied but not
+    its own, so ticking a category still shows how many products the other
+    categories would add.
+    """
+    products = Product.objects.filter(is_active=True).order_by()
+
+    category_counts = dict(
+        filters.apply(products, exclude={'category'}).values_list('category_id').annotate(count=Count('id'))
+    )
+    # Names come separately so empty categories still show up with a zero
+    categories = Category.objects.filter(is_active=True).values_list('id', 'slug', 'name').order_by('order', 'name')
+
+    gender_counts = dict(
+        filters.apply(products, exclude={'gender'}).values_list('gender').annotate(count=Count('id'))
+    )
+
+    price_counts = filters.apply(products, exclude={'price'}).annotate(effective_price=effective_price()).aggregate(**{
+        key: Count('id', filter=_price_band_q(key)) for key, label, low, high in PRICE_BANDS
+    })
+
+    # Joined straight to the product rather than through an IN subquery
+    sizes = filters.apply(
+        ProductSize.objects.filter(stock_quantity__gt=0, product__is_active=True),
+        exclude={'size'}, prefix='product__',
+    )
+    size_counts = dict(sizes.order_by().values_list('size').annotate(count=Count('product_id')))
+    # Keep ticked sizes on screen even when nothing is left, so they can be unticked
+    for size in filters.sizes:
+        size_counts.setdefault(size, 0)
+
+    # is_new and discount are counted in one query, each without its own filter
+    flags = filters.apply(products, exclude={'new', 'discount'}).aggregate(
+        new=Count('id', filter=Q(is_new=True) & (Q(discount_price__isnull=False) if filters.discounted else Q())),
+        discount=Count('id', filter=Q(discount_price__isnull=False) & (Q(is_new=True) if filters.is_new else Q())),
+    )
+
+    return {
+        'category': [
+            {'value': slug, 'label': name, 'count': category_counts.get(pk, 0), 'selected': slug in filters.categories}
+            for pk, slug, name in categories
+        ],
+        'gender': [
+            {'value': code, 'label': label, 'count': gender_counts.get(code, 0), 'selected': code in filters.genders}
+            for code, label in Product.GENDER_CHOICES
+        ],
+        'price': [
+            {'value': key, 'label': label, 'count': price_counts[key], 'selected': key in filters.prices}
+            for key, label, low, high in PRICE_BANDS
+        ],
+        'size': [
+            {'value': size, 'label': size, 'count': count, 'selected': size in filters.sizes}
+            for size, count in sorted(size_counts.items(), key=lambda row: _size_sort_key(row[0]))
+        ],
+        'new': {'count': flags['new'], 'selected': filters.is_new},
+        'discount': {'count': flags['discount'], 'selected': filters.discounted},
+    }
+
+
+def _size_sort_key(size):
+    # Numeric sizes in number order, then letter sizes alphabetically
+    return (0, float(size), size) if size.replace('.', '', 1).isdigit() else (1, 0, size)
+
+
+def get_facets(filters):
+    """
+    Facet counts for ``filters``, cached until the catalogue changes.
+
+    The key holds the catalogue version, which product, size and stock
+    changes bump, so stale counts are never read again; they just expire.
+    The version lives in the 'shared' cache, so a bump made by any process,
+    command or worker reaches every process's facet cache. FACET_CACHE_SECONDS
+    only bounds changes that bypass the signals, such as raw SQL.
+    """
+    key = f'store:facets:{get_catalog_version()}:{filters.querystring()}'
+    facets = cache.get(key)
+    count_cache('facets', hits=facets is not None, misses=facets is None)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, settings.FACET_CACHE_SECONDS)
+    return facets
@@ -0,0 +1,83 @@
+# store/combos.py
+from decimal import Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Min, PositiveIntegerField, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ComboOffer, ComboProduct
+from .page_cache import purge_page_tags
+from .promotions import bump_promotions_version
+
+COMBO_FIELDS = ['original_price', 'discount_percentage', 'savings_badge_text', 'stock_quantity']
+
+
+def combo_totals(parts):
+    """
+    Price and stock of each combo's products, from one aggregate query over
+    ``parts`` (ComboProduct rows): what the products cost bought separately,
+    and how many complete sets their stock makes. An inactive product
+    leaves the combo with no stock.
+    """
+    return {
+        row.pop('combo_offer_id'): row
+        for row in parts.values('combo_offer_id').order_by().annotate(
+            original_price=Sum(
+                Coalesce('product__discount_price', 'product__price') * F('quantity'),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+            # Integer division of two integer columns
+            stock_quantity=Min(Case(
+                When(product__is_active=True, then=F('product__stock_quantity') / F('quantity')),
+                default=0,
+                output_field=PositiveIntegerField(),
+            )),
+        )
+    }
+
+
+def savings_percentage(original_price, discount_price):
+    if original_price <= 0:
+        return 0
+    return max(0, min(100, round((original_price - discount_price) * 100 / original_price)))
+
+
+def refresh_combos(combo_ids=None, product_ids=None):
+    """
+    Recompute original_price, discount_percentage, savings_badge_text and
+    stock_quantity of the combos in ``combo_ids``, the combos containing any
+    of ``product_ids``, or every combo, and save the ones that changed with
+    one bulk_update. Combos without products are left alone. Returns how
+    many combos changed.
+    """
+    parts = ComboProduct.objects.all()
+    if combo_ids is not None:
+        parts = parts.filter(combo_offer_id__in=combo_ids)
+    if product_ids is not None:
+        parts = parts.filter(combo_offer__in=ComboProduct.objects.filter(product_id__in=product_ids).values('combo_offer'))
+
+    totals = combo_totals(parts)
+    if not totals:
+        return 0
+
+    now = timezone.now()
+    changed = []
+    for combo in ComboOffer.objects.filter(pk__in=totals).only('pk', 'discount_price', *COMBO_FIELDS):
+        values = totals[combo.pk]
+        values['original_price'] = values['original_price'].quantize(Decimal('0.01'))
+        percentage = savings_percentage(values['original_price'], combo.discount_price)
+        values.update(discount_percentage=percentage, savings_badge_text=f'SAVE {percentage}%')
+        if any(getattr(combo, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(combo, field, value)
+            combo.updated_at = now
+            changed.append(combo)
+
+    if changed:
+        # bulk_update sends no signals, so do what saving the combos would have
+        ComboOffer.objects.bulk_update(changed, [*COMBO_FIELDS, 'updated_at'])
+        transaction.on_commit(bump_promotions_version)
+        transaction.on_commit(partial(purge_page_tags, ['combooffer']))
+    return len(changed)
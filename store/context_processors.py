@@ -0,0 +1,18 @@
+# store/context_processors.py
+from .page_cache import CSRF_PLACEHOLDER, is_capturing
+from .singletons import get_singletons
+
+
+def site_config(request):
+    """Expose the cached page-config singletons to every template."""
+    return get_singletons()
+
+
+def page_cache(request):
+    """
+    Keep per-visitor values out of pages rendered for the anonymous page
+    cache; AnonymousPageCacheMiddleware fills them in afterwards.
+    """
+    if is_capturing(request):
+        return {'csrf_token': CSRF_PLACEHOLDER, 'messages': ()}
+    return {}
@@ -0,0 +1,149 @@
+# store/discounts.py
+import hashlib
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cart_utils import from_poisha, to_poisha
+from .promotions import get_active_promotions, get_promotions_version
+
+
+class CartDiscount:
+    """What the live promotions take off a cart, in poisha"""
+
+    def __init__(self, amount=0, free_shipping=False, code='', code_error='', applied=()):
+        self.amount = amount
+        self.free_shipping = free_shipping
+        self.code = code
+        self.code_error = code_error
+        self.applied = list(applied)
+
+    @property
+    def total(self):
+        return from_poisha(self.amount)
+
+    def shipping(self, cost):
+        return 0 if self.free_shipping else cost
+
+    def as_dict(self):
+        return {
+            'amount': self.amount,
+            'free_shipping': self.free_shipping,
+            'code': self.code,
+            'code_error': self.code_error,
+            'applied': self.applied,
+        }
+
+
+def normalize_code(code):
+    return (code or '').strip().casefold()
+
+
+def _percent_of(poisha, percentage):
+    return int((Decimal(poisha) * percentage / 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _combo_savings(combos, items):
+    """
+    Savings from complete combo sets in the cart. ``items`` maps product id
+    to [quantity, lowest unit price in poisha]; quantities used by one combo
+    aren't counted again for the next.
+    """
+    quantities = {product_id: item[0] for product_id, item in items.items()}
+    offers = []
+    for combo in combos:
+        parts = [(part.product_id, part.quantity) for part in combo.comboproduct_set.all()]
+        if not parts or any(product_id not in items for product_id, quantity in parts):
+            continue
+        regular = sum(items[product_id][1] * quantity for product_id, quantity in parts)
+        saving = regular - to_poisha(combo.discount_price)
+        if saving > 0:
+            offers.append((saving, combo, parts))
+
+    total, applied = 0, []
+    # Biggest saving per set first
+    for saving, combo, parts in sorted(offers, key=lambda offer: offer[0], reverse=True):
+        sets = min(quantities[product_id] // quantity for product_id, quantity in parts)
+        sets = min(sets, combo.stock_quantity)
+        if sets:
+            for product_id, quantity in parts:
+                quantities[product_id] -= quantity * sets
+            total += saving * sets
+            applied.append(combo.name if sets == 1 else f'{combo.name} ×{sets}')
+    return total, applied
+
+
+def evaluate_cart(cart_items, code='', promotions=None):
+    """
+    Work out a cart's discount against the live offers and combos in one
+    pass over the session data, without queries.
+
+    Complete combo sets are priced at the combo price. On what's left, the
+    best percentage offer the cart qualifies for applies: those with a
+    discount code only when it was entered, the others automatically. A
+    free shipping offer waives shipping once the subtotal reaches its
+    minimum. Offers don't stack with each other.
+    """
+    promotions = promotions or get_active_promotions()
+    items = {}
+    subtotal = 0
+    for item in cart_items:
+        product_id = int(item['product_id'])
+        subtotal += item['price'] * item['quantity']
+        quantity, price = items.get(product_id, (0, item['price']))
+        items[product_id] = [quantity + item['quantity'], min(price, item['price'])]
+
+    amount, applied = _combo_savings(promotions.combos, items)
+
+    code = normalize_code(code)
+    code_offer = promotions.codes.get(code) if code else None
+    code_error = ''
+    if code and code_offer is None:
+        code_error = 'This code is not valid.'
+
+    best, free_shipping = None, False
+    for offer in promotions.offers:
+        if offer.discount_code.strip() and offer is not code_offer:
+            continue
+        minimum = to_poisha(offer.min_order_amount or 0)
+        if subtotal < minimum:
+            if offer is code_offer:
+                code_error = f'This code needs an order of at least ৳{offer.min_order_amount}.'
+            continue
+        if offer.offer_type == 'free_shipping':
+            free_shipping = True
+            applied.append(offer.title)
+        elif offer.discount_percentage:
+            saving = _percent_of(subtotal - amount, offer.discount_percentage)
+            if best is None or saving > best[0]:
+                best = (saving, offer)
+    if best:
+        amount += best[0]
+        applied.append(best[1].title)
+    return CartDiscount(amount, free_shipping, code, code_error, applied)
+
+
+def get_cart_discount(request, cart):
+    """
+    The discount for ``cart``, evaluated once per version of the cart, code
+    and live promotions, so the cart and checkout pages don't work it out
+    again on every render. Results are cached rather than kept in the
+    session, which would then be written on every change.
+    """
+    code = request.session.get(settings.DISCOUNT_CODE_SESSION_ID, '')
+    promotions = get_active_promotions()
+    version = repr((cart.version, code, get_promotions_version(), promotions.valid_until))
+    key = 'store:cart-discount:' + hashlib.md5(version.encode(), usedforsecurity=False).hexdigest()
+
+    memo = cache.get(key)
+    if memo is not None:
+        return CartDiscount(**memo)
+
+    discount = evaluate_cart(cart.cart.values(), code, promotions)
+    cache.set(key, discount.as_dict(), settings.CART_DISCOUNT_CACHE_SECONDS)
+    return discount
+
+
+def set_discount_code(request, code):
+    request.session[settings.DISCOUNT_CODE_SESSION_ID] = normalize_code(code)
@@ -0,0 +1,112 @@
+# store/fragments.py
+import hashlib
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .metrics import count_cache
+
+CARD_TEMPLATES = {
+    'product': 'store/include/product_card.html',
+    'combo': 'store/include/combo_card.html',
+}
+
+# Cards are shared between visitors, so they are rendered with this in place
+# of the CSRF token and the visitor's own token is put back afterwards
+CSRF_PLACEHOLDER = 'csrf-token-placeholder'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _version(*parts):
+    return hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def product_card_version(product):
+    """
+    Everything a product card shows: the product row itself through
+    updated_at, plus the image and its renditions, sizes and first in-stock
+    size loaded by ProductQuerySet.for_cards(), which change without
+    touching the product.
+    """
+    return _version(
+        product.updated_at,
+        getattr(product, 'primary_image_name', None),
+        getattr(product, 'primary_image_alt', None),
+        getattr(product, 'primary_image_renditions', None),
+        getattr(product, 'first_available_size', None),
+        [size.size for size in product.sizes.all()],
+    )
+
+
+def combo_card_version(combo):
+    """The combo row and the prefetched products and images its card shows"""
+    products = []
+    for combo_product in combo.comboproduct_set.all():
+        image = next(iter(combo_product.product.images.all()), None)
+        products.append((
+            combo_product.product_id,
+            combo_product.product.updated_at,
+            image and (image.image.name, image.alt_text, image.renditions),
+        ))
+    return _version(combo.updated_at, combo.stock_quantity, products)
+
+
+CARD_VERSIONS = {
+    'product': product_card_version,
+    'combo': combo_card_version,
+}
+
+
+def card_cache_key(kind, obj):
+    return f'store:card:{kind}:{obj.pk}:{CARD_VERSIONS[kind](obj)}'
+
+
+def render_cards(kind, objects, csrf_token=None):
+    """
+    Markup for a list of product or combo cards.
+
+    Cards are cached under a key that changes whenever anything on them
+    does, so nothing needs invalidating and one rendering is reused on every
+    page and for every visitor. All of a list's cards are fetched with one
+    get_many, and only the missing ones are rendered.
+    """
+    cards = [(card_cache_key(kind, obj), obj) for obj in objects]
+    cached = cache.get_many([key for key, obj in cards])
+
+    template = get_template(CARD_TEMPLATES[kind])
+    rendered = {}
+    parts = []
+    for key, obj in cards:
+        html = cached.get(key) or rendered.get(key)
+        if html is None:
+            html = rendered[key] = template.render({kind: obj, 'csrf_token': CSRF_PLACEHOLDER})
+        parts.append(html)
+    if rendered:
+        cache.set_many(rendered, settings.CARD_CACHE_SECONDS)
+
+    with _stats_lock:
+        _stats[kind, 'hits'] += len(cards) - len(rendered)
+        _stats[kind, 'misses'] += len(rendered)
+    count_cache('card', hits=len(cards) - len(rendered), misses=len(rendered))
+
+    return mark_safe(''.join(parts).replace(CSRF_PLACEHOLDER, str(csrf_token or '')))
+
+
+def get_card_stats():
+    """Hit and miss counts per card type since this process started"""
+    with _stats_lock:
+        return {
+            kind: {'hits': _stats[kind, 'hits'], 'misses': _stats[kind, 'misses']}
+            for kind in CARD_TEMPLATES
+        }
+
+
+def reset_card_stats():
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,82 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import QueryDict
+
+from store.catalog import CatalogFilters, compute_facets, get_facets
+from store.models import Category, Product, ProductSize
+
+SIZES = ['38', '39', '40', '41', '42', '43', '44', '45']
+FILTERS = [
+    '',
+    'category=cat-1',
+    'gender=M&size=42',
+    'price=1000-2500&new=1',
+    'category=cat-2&category=cat-5&discount=1&size=40&size=41',
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Time facet count computation over a synthetic catalogue. "
+            "Runs inside a transaction that is rolled back, so nothing is kept.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=65)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options['products'], random.Random(options['seed']))
+                self.measure(options['rounds'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def seed(self, count, rng):
+        started = time.perf_counter()
+        categories = Category.objects.bulk_create([
+            Category(name=f'Category {i}', slug=f'cat-{i}') for i in range(12)
+        ])
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Synthetic shoe {i}', slug=f'synthetic-shoe-{i}', description='<p>Synthetic</p>',
+                category=rng.choice(categories), gender=rng.choice('MFU'),
+                price=Decimal(rng.randrange(500, 9000)),
+                discount_price=Decimal(rng.randrange(300, 500)) if rng.random() < 0.2 else None,
+                is_new=rng.random() < 0.1, stock_quantity=rng.randrange(0, 50),
+            )
+            for i in range(count)
+        ], batch_size=2000)
+        ProductSize.objects.bulk_create([
+            ProductSize(product=product, size=size, stock_quantity=rng.choice([0, 0, 3, 10]))
+            for product in products
+            for size in rng.sample(SIZES, 4)
+        ], batch_size=5000)
+        self.stdout.write(f"Seeded {count} products in {time.perf_counter() - started:.1f}s")
+
+    def measure(self, rounds):
+        for query in FILTERS:
+            filters = CatalogFilters(QueryDict(query))
+            timings = []
+            for i in range(rounds):
+                started = time.perf_counter()
+                compute_facets(filters)
+                timings.append((time.perf_counter() - started) * 1000)
+            get_facets(filters)
+            started = time.perf_counter()
+            get_facets(filters)
+            cached = (time.perf_counter() - started) * 1000
+            self.stdout.write(
+                f"{query or '(no filters)':<60} median {statistics.median(timings):8.1f} ms, "
+                f"max {max(timings):8.1f} ms, cached {cached:.2f} ms"
+            )
@@ -0,0 +1,225 @@
+import json
+import logging
+import math
+import re
+import statistics
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from store import metrics
+from store.models import ComboOffer, Offer, Order, Product, ProductReview, ProductSize
+from store.seeding import catalog_seeded, seed_catalog
+
+CHECKOUT_DATA = {
+    'shipping_full_name': 'Load Test',
+    'shipping_email': 'load-test@example.com',
+    'shipping_phone': '01700000000',
+    'shipping_address': 'House 1, Road 2',
+    'shipping_city': 'Dhaka',
+    'delivery_area': 'inside',
+    'payment_method': 'cash_on_delivery',
+}
+
+# Filled in by RequestMetricsMiddleware, which every request is sampled by here
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+class _Rollback(Exception):
+    pass
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Drive the storefront pages and the cart and checkout flow through the test client and report "
+            "p50/p99 latency, queries per request and throughput per view. Runs inside a transaction that is "
+            "rolled back, so orders placed and catalogues seeded with --seed-products are not kept. The "
+            "on-commit work of each request (cache purges, index updates) runs right after it and is timed "
+            "with it, but its queries aren't counted. store/benchmarks/baseline.json was made with "
+            "--seed-products 500 --requests 30 on SQLite; compare against it with the same options.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Timed requests per view")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed requests per view first")
+        parser.add_argument('--seed-products', type=int, default=0,
+                            help="Benchmark a synthetic catalogue of this many products instead of the database's")
+        parser.add_argument('--page-cache', action='store_true',
+                            help="Serve anonymous pages from the page cache, as in production; "
+                                 "off by default so the views themselves are measured")
+        parser.add_argument('--only', nargs='+', metavar='VIEW', help="Only these views")
+        parser.add_argument('--save', metavar='PATH', help="Write the results to this JSON file, e.g. as a baseline")
+        parser.add_argument('--compare', metavar='PATH', help="Fail if slower or doing more queries than this baseline")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="How much slower than the baseline p50 a view may be (default 0.25, i.e. 25%%)")
+
+    def handle(self, *args, **options):
+        logger = logging.getLogger('store.requests')
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            # The requests made up here stay out of /metrics
+            with metrics.paused(), transaction.atomic(), override_settings(
+                REQUEST_METRICS_SAMPLE_RATE=1, REQUEST_METRICS_SERVER_TIMING=True,
+                **({} if options['page_cache'] else {'PAGE_CACHE_SECONDS': 0}),
+            ):
+                if options['seed_products']:
+                    seed_catalog(products=options['seed_products'], orders=options['seed_products'], prefix='bench')
+                    catalog_seeded()
+                results = self.run(options)
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            logger.setLevel(level)
+            if options['seed_products']:
+                # The rolled-back catalogue may be in a shared cache
+                catalog_seeded()
+
+        self.report(results)
+        if options['save']:
+            path = Path(options['save'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2) + '\n')
+            self.stdout.write(f"Saved to {path}")
+        if options['compare']:
+            self.compare(results, json.loads(Path(options['compare']).read_text()), options['tolerance'])
+
+    def fixtures(self, requests):
+        size = (
+            ProductSize.objects.filter(product__is_active=True, stock_quantity__gt=0)
+            .select_related('product__category').order_by('-product__rating_count', 'pk').first()
+        )
+        if size is None:
+            raise CommandError("No product in stock to benchmark; run seed_catalog or pass --seed-products.")
+        # Every checkout reserves one, and the transaction is rolled back afterwards
+        ProductSize.objects.filter(pk=size.pk).update(stock_quantity=requests * 10)
+        Product.objects.filter(pk=size.product_id).update(stock_quantity=requests * 10)
+        return size.product, size.size
+
+    def views(self, product, size):
+        """(name, method, url or function of the previous response, data) for one pass over the store"""
+        word = product.name.split()[0]
+        return [
+            ('home', 'get', reverse('home'), None),
+            ('products', 'get', reverse('products'), None),
+            ('products_filtered', 'get', f"{reverse('products')}?category={product.category.slug}&size={size}", None),
+            ('product_detail', 'get', reverse('product-desc', args=[product.slug]), None),
+            ('product_reviews', 'get', reverse('product_reviews', args=[product.slug]), None),
+            ('search', 'get', f"{reverse('search')}?q={word}", None),
+            ('search_suggest', 'get', f"{reverse('search_suggest')}?q={word[:3]}", None),
+            ('offers', 'get', reverse('offers'), None),
+            ('about', 'get', reverse('about'), None),
+            ('contact', 'get', reverse('contact'), None),
+            ('return', 'get', reverse('return'), None),
+            # A shopper's way through the cart and checkout, in a fresh session each pass
+            ('cart_add', 'post', reverse('add_to_cart', args=[product.id]), {'quantity': 1, 'size': size}),
+            ('cart', 'get', reverse('cart_detail'), None),
+            ('checkout', 'get', reverse('checkout'), None),
+            ('place_order', 'post', reverse('checkout'), CHECKOUT_DATA),
+            ('order_success', 'get', lambda previous: previous.url, None),
+        ]
+
+    def run(self, options):
+        product, size = self.fixtures(options['warmup'] + options['requests'])
+        views = self.views(product, size)
+        names = [name for name, method, url, data in views]
+        measured = set(options['only'] or names)
+        if measured - set(names):
+            raise CommandError(f"Unknown view(s): {', '.join(sorted(measured - set(names)))}")
+        # A checkout step needs the ones before it in the same session
+        flow = names[names.index('cart_add'):]
+        selected = [flow.index(name) for name in measured if name in flow]
+        needed = measured | set(flow[:max(selected) + 1] if selected else [])
+
+        timings = {name: [] for name, method, url, data in views}
+        for i in range(options['warmup'] + options['requests']):
+            client = Client()
+            previous = None
+            for name, method, url, data in views:
+                if name not in needed:
+                    continue
+                if callable(url):
+                    url = url(previous)
+                started = time.perf_counter()
+                # Nothing commits inside the benchmark's transaction, so run what a commit would
+                with TestCase.captureOnCommitCallbacks(execute=True):
+                    previous = getattr(client, method)(url, data)
+                elapsed = time.perf_counter() - started
+                if previous.status_code >= 400:
+                    raise CommandError(f"{name}: {method.upper()} {url} returned {previous.status_code}")
+                if i >= options['warmup'] and name in measured:
+                    db = SERVER_TIMING_DB.search(previous['Server-Timing'])
+                    timings[name].append((elapsed, int(db.group(2)), float(db.group(1)) / 1000))
+        busy = sum(elapsed for samples in timings.values() for elapsed, queries, db in samples)
+
+        return {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'page_cache': options['page_cache'],
+            'catalog': {
+                'products': Product.objects.count(),
+                'reviews': ProductReview.objects.count(),
+                'offers': Offer.objects.count(),
+                'combos': ComboOffer.objects.count(),
+                'orders': Order.objects.count(),
+            },
+            'requests': sum(len(samples) for samples in timings.values()),
+            'seconds': round(busy, 3),
+            'views': {
+                name: self.summarize(samples) for name, samples in timings.items() if samples
+            },
+        }
+
+    def summarize(self, samples):
+        latencies = sorted(elapsed * 1000 for elapsed, queries, db in samples)
+        queries = [queries for elapsed, queries, db in samples]
+        return {
+            'requests': len(samples),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'mean_ms': round(statistics.mean(latencies), 2),
+            'db_ms': round(statistics.mean(db * 1000 for elapsed, queries, db in samples), 2),
+            'queries': round(statistics.mean(queries), 2),
+            'max_queries': max(queries),
+            # One client at a time, so this is what a single worker can serve
+            'throughput_rps': round(len(samples) / (sum(latencies) / 1000), 1),
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'view':<20} {'p50 ms':>8} {'p99 ms':>8} {'db ms':>8} {'queries':>8} {'req/s':>8}"
+        )
+        for name, view in results['views'].items():
+            self.stdout.write(
+                f"{name:<20} {view['p50_ms']:>8.1f} {view['p99_ms']:>8.1f} {view['db_ms']:>8.1f} "
+                f"{view['queries']:>8g} {view['throughput_rps']:>8.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{results['requests']} requests in {results['seconds']:.1f}s, "
+            f"{results['requests'] / results['seconds']:.1f} req/s overall."
+        ))
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for name, view in results['views'].items():
+            before = baseline['views'].get(name)
+            if before is None:
+                continue
+            if view['queries'] > before['queries']:
+                regressions.append(f"{name}: {view['queries']:g} queries per request, was {before['queries']:g}")
+            if view['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+                regressions.append(f"{name}: p50 {view['p50_ms']:.1f} ms, was {before['p50_ms']:.1f} ms")
+        for line in regressions:
+            self.stdout.write(self.style.ERROR(line))
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) against the baseline.")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
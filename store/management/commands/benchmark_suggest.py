@@ -0,0 +1,56 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.suggest import SuggestIndex
+
+BRANDS = ['Bata', 'Apex', 'Lotto', 'Walkar', 'Nike', 'Adidas', 'Puma', 'Reebok', 'Skechers', 'Fila']
+STYLES = ['Runner', 'Loafer', 'Sandal', 'Sneaker', 'Oxford', 'Moccasin', 'Slipper', 'Chappal',
+          'Juta', 'Nagra', 'Khussa', 'Boot', 'Derby', 'Brogue', 'Espadrille', 'Kolhapuri']
+COLOURS = ['Black', 'Brown', 'Tan', 'White', 'Navy', 'Maroon', 'Olive', 'Grey', 'Beige', 'Red']
+EXTRAS = ['Classic', 'Pro', 'Lite', 'Max', 'Comfort', 'Premium', 'Leather', 'Canvas', 'Mesh', 'Suede']
+QUERIES = ['ru', 'runn', 'loafer bl', 'chapal', 'jutta', 'nagra tan', 'skechers max', 'snekar',
+           'kolhapri', 'brown oxf', 'bata', 'pre', 'mocassin', 'espadril', 'suede derby']
+
+
+class Command(BaseCommand):
+    help = "Time autocomplete suggestions over a synthetic catalogue (no database needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--rounds', type=int, default=200, help="Times each sample query is run")
+        parser.add_argument('--seed', type=int, default=65)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        index = SuggestIndex()
+
+        started = time.perf_counter()
+        for pk in range(options['products']):
+            name = ' '.join([rng.choice(BRANDS), rng.choice(EXTRAS), rng.choice(STYLES), rng.choice(COLOURS)])
+            index.add(('product', pk), name, f"{name.lower().replace(' ', '-')}-{pk}", weight=int(rng.random() < 0.05))
+        for pk, style in enumerate(STYLES):
+            index.add(('category', pk), f"{style}s", f"{style.lower()}s", weight=2)
+        build_seconds = time.perf_counter() - started
+
+        timings = []
+        for i in range(options['rounds']):
+            for query in QUERIES:
+                started = time.perf_counter()
+                index.suggest(query)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+        self.stdout.write(f"Indexed {len(index)} entries in {build_seconds:.2f}s")
+        self.stdout.write(
+            f"{len(timings)} suggestions: mean {statistics.mean(timings):.3f} ms, "
+            f"p50 {percentile(0.5):.3f} ms, p99 {percentile(0.99):.3f} ms, max {timings[-1]:.3f} ms"
+        )
+        for query in QUERIES:
+            labels = [entry['label'] for key, entry in index.suggest(query, limit=3)]
+            self.stdout.write(f"  {query!r}: {', '.join(labels)}")
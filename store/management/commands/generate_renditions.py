@@ -0,0 +1,95 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.models import ProductImage
+from store.page_cache import purge_page_tags
+from store.promotions import bump_promotions_version
+from store.renditions import render_renditions, save_renditions
+
+# Product cards on one page of the product list
+CARDS_PER_PAGE = 8
+
+
+def _render(job):
+    pk, data = job
+    try:
+        return pk, render_renditions(data), None
+    except Exception as exc:
+        return pk, None, f'{type(exc).__name__}: {exc}'
+
+
+class Command(BaseCommand):
+    help = ("Make the resized WebP and JPEG copies of product images that don't have them yet. "
+            "Images are resized in a pool of worker processes; files are read and written here.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Redo images that already have renditions")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=32, help="Images read into memory at a time")
+
+    def handle(self, *args, **options):
+        images = [
+            image for image in ProductImage.objects.exclude(image='').order_by('pk')
+            if options['all'] or image.renditions.get('source') != image.image.name
+        ]
+        if not images:
+            self.stdout.write("Every product image already has its renditions.")
+            return
+
+        started = time.perf_counter()
+        done, failed = [], 0
+        original_bytes = rendition_bytes = card_bytes = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for start in range(0, len(images), options['batch_size']):
+                batch = {image.pk: image for image in images[start:start + options['batch_size']]}
+                jobs = []
+                for image in batch.values():
+                    try:
+                        with image.image.open('rb') as upload:
+                            jobs.append((image.pk, upload.read()))
+                    except OSError as exc:
+                        failed += 1
+                        self.stderr.write(f"{image.image.name}: {exc}")
+
+                now = timezone.now()
+                finished = []
+                for pk, rendered, error in pool.map(_render, jobs):
+                    image = batch[pk]
+                    if error:
+                        failed += 1
+                        self.stderr.write(f"{image.image.name}: {error}")
+                        continue
+                    image.renditions = save_renditions(image.image.name, rendered, image.image.storage)
+                    image.updated_at = now
+                    finished.append(image)
+                    original_bytes += image.image.size
+                    rendition_bytes += sum(len(data) for _, _, files in rendered.values() for data in files.values())
+                    card_bytes += len(rendered['card'][2]['webp'])
+                ProductImage.objects.bulk_update(finished, ['renditions', 'updated_at'])
+                done += finished
+
+        if done:
+            # bulk_update sends no signals, so drop the pages and cards that show these images;
+            # both go through the 'shared' cache, so running web processes see it
+            purge_page_tags(['productimage', *{f'product:{image.product_id}' for image in done}])
+            bump_promotions_version()
+        self.report(len(done), failed, original_bytes, rendition_bytes, card_bytes, time.perf_counter() - started)
+
+    def report(self, done, failed, original_bytes, rendition_bytes, card_bytes, elapsed):
+        self.stdout.write(self.style.SUCCESS(
+            f"Made renditions for {done} image(s) in {elapsed:.1f}s" + (f", {failed} failed." if failed else ".")
+        ))
+        if not done:
+            return
+        original = original_bytes / done
+        card = card_bytes / done
+        self.stdout.write(f"  storage: {original_bytes / 1024:.0f} KiB of uploads, "
+                          f"{rendition_bytes / 1024:.0f} KiB of renditions added")
+        self.stdout.write(f"  per card image: {original / 1024:.1f} KiB upload -> {card / 1024:.1f} KiB WebP card "
+                          f"({100 - 100 * card / original:.0f}% less)")
+        self.stdout.write(f"  product list page of {CARDS_PER_PAGE} cards: "
+                          f"{CARDS_PER_PAGE * original / 1024:.0f} KiB -> {CARDS_PER_PAGE * card / 1024:.0f} KiB of images")
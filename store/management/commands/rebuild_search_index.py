@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.search import rebuild_index, uses_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index from the products table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Products indexed per batch")
+
+    def handle(self, *args, **options):
+        if not uses_index():
+            self.stdout.write("This database searches products directly; there is no index to rebuild.")
+            return
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} product(s)."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every product's rating totals from its approved reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int, help="Only these products (default: all)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = recompute_ratings(options['product_ids'] or None, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Updated ratings for {count} product(s)."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.stock import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Cancel unpaid mobile-payment orders whose stock reservation has expired"
+
+    def handle(self, *args, **options):
+        count = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f"Released stock for {count} expired order(s)."))
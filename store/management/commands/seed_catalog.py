@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from store.seeding import clear_seeded, seed_catalog
+
+
+class Command(BaseCommand):
+    help = ("Write a synthetic catalogue (categories, products, images, sizes, reviews, offers, combos and "
+            "orders) with bulk inserts, for benchmarks and load tests. Its slugs start with --prefix.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--reviews', type=int, default=8, help="Mean number of reviews per product")
+        parser.add_argument('--offers', type=int, default=6)
+        parser.add_argument('--combos', type=int, default=20)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--seed', type=int, default=65, help="Random seed, for the same catalogue every time")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true', help="Delete a catalogue seeded with --prefix first")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['clear']:
+            deleted = clear_seeded(prefix)
+            self.stdout.write(f"Deleted {deleted} row(s) seeded with prefix '{prefix}'.")
+        if options['categories'] < 1 and options['products']:
+            raise CommandError("Products need at least one category.")
+
+        started = time.perf_counter()
+        try:
+            counts = seed_catalog(
+                categories=options['categories'], products=options['products'], reviews=options['reviews'],
+                offers=options['offers'], combos=options['combos'], orders=options['orders'],
+                prefix=prefix, seed=options['seed'], batch_size=options['batch_size'],
+            )
+        except IntegrityError:
+            raise CommandError(f"A catalogue with prefix '{prefix}' already exists; pass --clear or another --prefix.")
+        summary = ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Seeded {summary} in {time.perf_counter() - started:.1f}s."))
@@ -0,0 +1,283 @@
+# store/metrics.py
+"""
+Counters and latency histograms served in the Prometheus text format by
+the /metrics view.
+
+Each process counts in memory, so recording costs a lock and a dict
+update. A background thread writes the process's totals to its own file
+in METRICS_DIR every METRICS_FLUSH_SECONDS, and /metrics adds up the
+files of every process, so the gunicorn workers are reported together
+whichever one is scraped. Files left by processes that have exited are
+folded into one retired.json on the next scrape, so their counts are kept
+without the directory growing. METRICS_DIR belongs to one deployment on
+one machine, since files are matched to processes by pid; like any
+counters, totals start again from zero when it is emptied. Without fcntl
+(Windows) scrapes can't lock each other out, so no files are retired.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import cache
+from pathlib import Path
+
+from django.conf import settings
+
+# Upper bounds, in seconds, of the request latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'store_request_duration_seconds': ('histogram', 'Time taken to respond, by URL name from store/urls.py'),
+    'store_orders_created_total': ('counter', 'Orders placed, by payment method'),
+    'store_cart_changes_total': ('counter', 'Products added to and removed from carts'),
+    'store_search_queries_total': ('counter', 'Search result pages and search-as-you-type suggestions served'),
+    'store_cache_requests_total': ('counter', 'Cache lookups by cache and result'),
+    'store_cache_hit_ratio': ('gauge', 'Share of cache lookups that were hits, by cache'),
+}
+
+
+# Totals of the processes that have exited
+RETIRED_FILE = 'retired.json'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _lock_exclusively(lock_file):
+    """Take an exclusive lock on ``lock_file``; False where there is no fcntl"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return True
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for data in snapshots:
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def _write_json(directory, name, data):
+    # Written aside and renamed, so a scrape never reads half a file
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, os.path.join(directory, name))
+
+
+def _retire(directory, retired):
+    counters, histograms = _merge(data for path, data in retired)
+    _write_json(directory, RETIRED_FILE, {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+    })
+    for path, data in retired:
+        if path.name != RETIRED_FILE:
+            path.unlink(missing_ok=True)
+
+
+class MetricsStore:
+    def __init__(self):
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        # A forked worker starts from zero, under its own file name. The lock
+        # is new too: the parent may have held it while forking.
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.dirty = False
+        self.flusher = None
+        self.name = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+
+    def inc(self, name, amount=1, labels=()):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            self._changed()
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # One count per bucket, the last for values above them all, then the sum
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[-1] += value
+            self._changed()
+
+    def _changed(self):
+        self.dirty = True
+        if self.flusher is None and settings.METRICS_DIR:
+            self.flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self.flusher.start()
+
+    def _flush_loop(self):
+        me = threading.current_thread()
+        while self.flusher is me:
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+            if self.dirty:
+                self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            self.dirty = False
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self):
+        """Write this process's totals to its file in METRICS_DIR, if they changed"""
+        directory = settings.METRICS_DIR
+        if not directory or not self.dirty:
+            return
+        data = self.snapshot()
+        os.makedirs(directory, exist_ok=True)
+        _write_json(directory, self.name, data)
+
+    def collect(self):
+        """The totals of every process, as ({(name, labels): value}, {(name, labels): histogram})"""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return _merge([self.snapshot()])
+        self.flush()
+        os.makedirs(directory, exist_ok=True)
+        # One scrape at a time, so the files of exited processes are retired once
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            locked = _lock_exclusively(lock)
+            snapshots, retired = [], []
+            for path in sorted(Path(directory).glob('*.json')):
+                try:
+                    data = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+                pid = path.name.split('-', 1)[0]
+                if path.name == RETIRED_FILE or (locked and pid.isdigit() and not _pid_alive(int(pid))):
+                    retired.append((path, data))
+                else:
+                    snapshots.append(data)
+            if locked and (len(retired) > 1 or (retired and retired[0][0].name != RETIRED_FILE)):
+                _retire(directory, retired)
+            snapshots += [data for path, data in retired]
+        return _merge(snapshots)
+
+
+_store = MetricsStore()
+_paused = False
+
+
+def inc(name, amount=1, **labels):
+    if not _paused:
+        _store.inc(name, amount, tuple(sorted(labels.items())))
+
+
+def observe(name, value, **labels):
+    if not _paused:
+        _store.observe(name, value, tuple(sorted(labels.items())))
+
+
+@contextmanager
+def paused():
+    """Record nothing inside the block, e.g. while benchmark_store makes up traffic"""
+    global _paused
+    _paused = True
+    try:
+        yield
+    finally:
+        _paused = False
+
+
+def count_cache(cache_name, hits=0, misses=0):
+    if hits:
+        inc('store_cache_requests_total', hits, cache=cache_name, result='hit')
+    if misses:
+        inc('store_cache_requests_total', misses, cache=cache_name, result='miss')
+
+
+@cache
+def store_url_names():
+    from .urls import urlpatterns
+    return frozenset(pattern.name for pattern in urlpatterns if pattern.name)
+
+
+def url_label(request):
+    """The URL name from store/urls.py for the request, so that label values stay few"""
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    if match.namespace or match.url_name not in store_url_names():
+        return 'other'
+    return match.url_name
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{key}="{_escape(label)}"' for key, label in labels) + '}'
+    return f'{name} {value:g}' if isinstance(value, float) else f'{name} {value}'
+
+
+def render_metrics():
+    """Every process's metrics in the Prometheus text exposition format"""
+    counters, histograms = _store.collect()
+
+    caches = {}
+    for (name, labels), value in counters.items():
+        if name == 'store_cache_requests_total':
+            labels = dict(labels)
+            caches.setdefault(labels['cache'], {'hit': 0, 'miss': 0})[labels['result']] += value
+    gauges = {
+        ('store_cache_hit_ratio', (('cache', cache_name),)): counts['hit'] / (counts['hit'] + counts['miss'])
+        for cache_name, counts in caches.items()
+    }
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'histogram':
+            for (series_name, labels), values in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(_series(f'{name}_bucket', labels + (('le', bound),), cumulative))
+                lines.append(_series(f'{name}_sum', labels, float(values[-1])))
+                lines.append(_series(f'{name}_count', labels, cumulative))
+        else:
+            values = gauges if kind == 'gauge' else counters
+            lines += [
+                _series(name, labels, value)
+                for (series_name, labels), value in sorted(values.items()) if series_name == name
+            ]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,118 @@
+# store/middleware.py
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import count_cache, observe, url_label
+from .page_cache import PageCapture, cached_response, fill_holes, get_cached_page, page_cache_key, store_page
+from .request_metrics import record_request
+
+metrics_logger = logging.getLogger('store.requests')
+
+
+class AnonymousPageCacheMiddleware(MiddlewareMixin):
+    """
+    Serve views marked with @cache_anonymous_page from the cache to
+    visitors who aren't logged in, without running the view.
+
+    Pages are cached with placeholders for the CSRF token and markers for
+    the per-visitor fragments (messages, cart count), which are filled in on
+    the way out for every visitor, the first one included. Entries are
+    dropped when one of their tags is purged by a model change and expire at
+    the next offer start or end. Pages that also use @conditional_page
+    keep their validators, so a visitor's conditional GET for a cached page
+    gets a 304 without a query. Must come after the auth and messages
+    middleware.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        tags = getattr(view_func, 'page_cache_tags', None)
+        if tags is None or request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return None
+        if not settings.PAGE_CACHE_SECONDS:
+            return None
+
+        key = page_cache_key(request, getattr(view_func, 'page_cache_query_params', ()))
+        entry = get_cached_page(key)
+        if entry is not None:
+            count_cache('page', hits=1)
+            return cached_response(entry, request)
+        count_cache('page', misses=1)
+        request.page_capture = PageCapture(key, tags)
+        return None
+
+    def process_response(self, request, response):
+        capture = getattr(request, 'page_capture', None)
+        if capture is None or response.streaming:
+            return response
+
+        # Don't share a page that set cookies or asked not to be cached
+        private = response.cookies or 'private' in response.get('Cache-Control', '')
+        if request.method == 'GET' and response.status_code == 200 and not private:
+            store_page(capture, response, getattr(request, 'page_fingerprint', None))
+        if response.status_code != 304:
+            response.content = fill_holes(response.content.decode(response.charset), request)
+        response['X-Page-Cache'] = 'miss'
+        return response
+
+
+class RequestMetricsMiddleware:
+    """
+    For a sample of requests (REQUEST_METRICS_SAMPLE_RATE, 0 to 1), count
+    the SQL queries and their time, the template rendering time and the
+    cache hits, and report them in a Server-Timing header and as one JSON
+    line on the 'store.requests' logger. Template and cache figures need
+    the TimedDjangoTemplates backend and a *MetricsCache backend from
+    store.request_metrics. Requests left out of the sample pay for a single
+    random() call. Goes first, so that the time and queries of the other
+    middleware (sessions, auth, the page cache) are counted too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        with record_request() as metrics, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+
+        if settings.REQUEST_METRICS_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing()
+        match = request.resolver_match
+        metrics_logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'page_cache': response.get('X-Page-Cache'),
+            **metrics.as_dict(),
+        }))
+        return response
+
+
+class LatencyMetricsMiddleware:
+    """
+    Record how long each response took in the
+    store_request_duration_seconds histogram served by /metrics, labelled
+    with the URL name from store/urls.py. Goes first.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        observe('store_request_duration_seconds', time.perf_counter() - started, view=url_label(request))
+        return response
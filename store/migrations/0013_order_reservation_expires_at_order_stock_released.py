@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_remove_orderitem_product_sku_remove_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reservation_expires_at',
+            field=models.DateTimeField(blank=True, help_text='Unpaid mobile-payment orders release their stock after this time', null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stock_released',
+            field=models.BooleanField(default=False, help_text='Reserved stock has been returned to inventory'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:10
+
+from django.db import migrations, models
+
+
+def create_order_number_sequence(apps, schema_editor):
+    # Only PostgreSQL has native sequences; other databases use the Sequence table
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE SEQUENCE IF NOT EXISTS store_order_number_seq")
+    else:
+        Sequence = apps.get_model('store', 'Sequence')
+        Sequence.objects.using(schema_editor.connection.alias).get_or_create(name='order_number')
+
+
+def drop_order_number_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP SEQUENCE IF EXISTS store_order_number_seq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_order_reservation_expires_at_order_stock_released'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_order_number_sequence, drop_order_number_sequence),
+    ]
@@ -0,0 +1,43 @@
+import html
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+
+def create_search_index(apps, schema_editor):
+    # Full-text search uses FTS5 on SQLite; PostgreSQL searches the table directly
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_search USING fts5("
+        "name, short_description, description, category, tokenize='unicode61 remove_diacritics 2')"
+    )
+    Product = apps.get_model('store', 'Product')
+    rows = [
+        (product.pk, product.name, product.short_description,
+         html.unescape(strip_tags(product.description or '')), product.category.name)
+        for product in Product.objects.using(schema_editor.connection.alias)
+        .filter(is_active=True).select_related('category')
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO store_product_search (rowid, name, short_description, description, category) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            rows,
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS store_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_ratings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', 'is_approved', 'created_at', 'id'], name='review_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_product_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'category', 'gender', 'is_new', 'price', 'discount_price'], name='product_facet_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsize',
+            index=models.Index(fields=['size', 'stock_quantity', 'product'], name='size_stock_idx'),
+        ),
+    ]
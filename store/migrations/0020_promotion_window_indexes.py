@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='combooffer',
+            index=models.Index(fields=['is_active', 'start_date', 'end_date'], name='combo_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['is_active', 'start_date', 'end_date'], name='offer_window_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:48
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, Min, PositiveIntegerField, Sum, When
+from django.db.models.functions import Coalesce
+
+
+def fill_combo_fields(apps, schema_editor):
+    # Same arithmetic as store.combos.refresh_combos(), on the historical models
+    ComboOffer = apps.get_model('store', 'ComboOffer')
+    ComboProduct = apps.get_model('store', 'ComboProduct')
+    db = schema_editor.connection.alias
+    totals = ComboProduct.objects.using(db).values('combo_offer_id').order_by().annotate(
+        original_price=Sum(
+            Coalesce('product__discount_price', 'product__price') * F('quantity'),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        stock_quantity=Min(Case(
+            When(product__is_active=True, then=F('product__stock_quantity') / F('quantity')),
+            default=0,
+            output_field=PositiveIntegerField(),
+        )),
+    )
+    totals = {row.pop('combo_offer_id'): row for row in totals}
+    combos = list(ComboOffer.objects.using(db).filter(pk__in=totals))
+    for combo in combos:
+        combo.original_price = totals[combo.pk]['original_price']
+        combo.stock_quantity = totals[combo.pk]['stock_quantity']
+        percentage = 0
+        if combo.original_price > 0:
+            percentage = round((combo.original_price - combo.discount_price) * 100 / combo.original_price)
+        combo.discount_percentage = max(0, min(100, percentage))
+        combo.savings_badge_text = f'SAVE {combo.discount_percentage}%'
+    ComboOffer.objects.using(db).bulk_update(
+        combos, ['original_price', 'discount_percentage', 'savings_badge_text', 'stock_quantity'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_promotion_window_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='combooffer',
+            name='discount_percentage',
+            field=models.PositiveIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AlterField(
+            model_name='combooffer',
+            name='original_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(fill_combo_fields, migrations.RunPython.noop),
+    ]
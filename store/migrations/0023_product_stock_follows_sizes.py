@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:20
+
+from django.db import migrations, models
+from django.db.models import Case, Exists, F, Min, OuterRef, PositiveIntegerField, Subquery, Sum, When
+
+
+def sync_stock(apps, schema_editor):
+    # Same as store.stock.sync_product_stock() and the stock part of refresh_combos()
+    Product = apps.get_model('store', 'Product')
+    ProductSize = apps.get_model('store', 'ProductSize')
+    ComboOffer = apps.get_model('store', 'ComboOffer')
+    ComboProduct = apps.get_model('store', 'ComboProduct')
+    db = schema_editor.connection.alias
+
+    sizes = ProductSize.objects.using(db).filter(product=OuterRef('pk'))
+    total = sizes.order_by().values('product').annotate(total=Sum('stock_quantity')).values('total')
+    Product.objects.using(db).filter(Exists(sizes)).update(stock_quantity=Subquery(total))
+
+    totals = ComboProduct.objects.using(db).values('combo_offer_id').order_by().annotate(
+        stock_quantity=Min(Case(
+            When(product__is_active=True, then=F('product__stock_quantity') / F('quantity')),
+            default=0,
+            output_field=PositiveIntegerField(),
+        )),
+    )
+    for row in totals:
+        ComboOffer.objects.using(db).filter(pk=row['combo_offer_id']).update(stock_quantity=row['stock_quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_productimage_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='stock_quantity',
+            field=models.PositiveIntegerField(default=0, help_text="For products sold in sizes, kept equal to the sum of the sizes' stock"),
+        ),
+        migrations.RunPython(sync_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+import html
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+
+def create_search_index(apps, schema_editor):
+    # PostgreSQL keeps a weighted tsvector per product, built from the same
+    # text as the FTS5 index of migration 0015, with a GIN index over it
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE TABLE IF NOT EXISTS store_product_search (rowid integer PRIMARY KEY, document tsvector NOT NULL)"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS store_product_search_document ON store_product_search USING GIN (document)"
+    )
+    Product = apps.get_model('store', 'Product')
+    rows = [
+        (product.pk, product.name, product.short_description,
+         html.unescape(strip_tags(product.description or '')), product.category.name)
+        for product in Product.objects.using(schema_editor.connection.alias)
+        .filter(is_active=True).select_related('category')
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO store_product_search (rowid, document) VALUES (%s, "
+            "setweight(to_tsvector(%s), 'A') || setweight(to_tsvector(%s), 'B') || "
+            "setweight(to_tsvector(%s), 'C') || setweight(to_tsvector(%s), 'B'))",
+            rows,
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS store_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_product_stock_follows_sizes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,9 +1,11 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from ckeditor.fields import RichTextField
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.core.validators import EmailValidator
-from django.db.models import Q
+from django.db.models import Q, OuterRef, Subquery, Prefetch, Case, When, FloatField
+from django.db.models.functions import Cast
 from django.urls import reverse
 from django.conf import settings
 
@@ -66,6 +68,20 @@ class Category(TimeStampedModel):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def for_cards(self):
+        """Load everything a product card renders in a fixed number of queries."""
+        images = ProductImage.objects.filter(product=OuterRef('pk')).order_by('-is_primary', 'created_at')
+        available_sizes = ProductSize.objects.filter(product=OuterRef('pk'), stock_quantity__gt=0).in_size_order()
+        return self.annotate(
+            primary_image_name=Subquery(images.values('image')[:1]),
+            primary_image_alt=Subquery(images.values('alt_text')[:1]),
+            primary_image_renditions=Subquery(images.values('renditions')[:1]),
+            first_available_size=Subquery(available_sizes.values('size')[:1]),
+        ).prefetch_related(
+            Prefetch('sizes', queryset=ProductSize.objects.in_size_order()),
+        )
+
 class Product(TimeStampedModel):
     GENDER_CHOICES = [
         ('M', 'Men'),
@@ -84,14 +100,72 @@ class Product(TimeStampedModel):
     is_featured = models.BooleanField(default=False)
     is_new = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
-    stock_quantity = models.PositiveIntegerField(default=0)
+    stock_quantity = models.PositiveIntegerField(
+        default=0, help_text="For products sold in sizes, kept equal to the sum of the sizes' stock",
+    )
+    
+    # Approved review totals, kept up to date by store.ratings
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False, db_index=True)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ProductQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Cursor pagination of the active catalogue
+            models.Index(fields=['is_active', 'created_at', 'id'], name='product_listing_idx'),
+            # Covers every product column the facet counts read
+            models.Index(
+                fields=['is_active', 'category', 'gender', 'is_new', 'price', 'discount_price'],
+                name='product_facet_idx',
+            ),
+        ]
+
+    # Written only by store.ratings, with F() updates
+    RATING_FIELDS = (
+        'rating_count', 'rating_sum', 'average_rating',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+    )
 
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        # An existing product is saved without its rating totals, so a review
+        # approved after it was loaded, e.g. while it was open in the admin,
+        # isn't undone by the stale values
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname in self.__dict__ and field.name not in self.RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
+    
+    @property
+    def primary_image_url(self):
+        """URL of the card image annotated by ProductQuerySet.for_cards()"""
+        if getattr(self, 'primary_image_name', None):
+            return ProductImage._meta.get_field('image').storage.url(self.primary_image_name)
+        return ''
+    
+    @property
+    def primary_image(self):
+        """The card image annotated by ProductQuerySet.for_cards(), as an unsaved ProductImage"""
+        if getattr(self, 'primary_image_name', None):
+            return ProductImage(
+                image=self.primary_image_name,
+                alt_text=self.primary_image_alt or '',
+                renditions=self.primary_image_renditions or {},
+            )
+        return None
+    
     def get_absolute_url(self):
         return reverse('product_detail', kwargs={'slug': self.slug})
     
@@ -106,11 +180,12 @@ class Product(TimeStampedModel):
         return 0
 
     def get_average_rating(self):
-        approved_reviews = self.reviews.filter(is_approved=True)
-        if approved_reviews.exists():
-            total_rating = sum(review.rating for review in approved_reviews)
-            return round(total_rating / approved_reviews.count(), 1)
-        return 0
+        return round(self.average_rating, 1)
+    
+    @property
+    def rating_histogram(self):
+        """Approved review counts by star, five stars first"""
+        return {stars: getattr(self, f'rating_{stars}_count') for stars in range(5, 0, -1)}
 
 class ProductImage(TimeStampedModel):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
@@ -118,6 +193,8 @@ class ProductImage(TimeStampedModel):
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
+    # Resized copies made by store.renditions, by preset
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         ordering = ['-is_primary', 'created_at']
@@ -125,14 +202,29 @@ class ProductImage(TimeStampedModel):
     def __str__(self):
         return f"Image for {self.product.name}"
 
+class ProductSizeQuerySet(models.QuerySet):
+    def in_size_order(self):
+        """Numeric sizes in number order ('9' before '10'), then letter sizes alphabetically."""
+        number = Case(
+            When(size__regex=r'^[0-9]+(\.[0-9]+)?$', then=Cast('size', FloatField())),
+            default=None,
+        )
+        return self.order_by(number.asc(nulls_last=True), 'size')
+
 class ProductSize(models.Model):
     product = models.ForeignKey(Product, related_name='sizes', on_delete=models.CASCADE)
     size = models.CharField(max_length=10)
     stock_quantity = models.PositiveIntegerField(default=0)
     
+    objects = ProductSizeQuerySet.as_manager()
+    
     class Meta:
         unique_together = ['product', 'size']
         ordering = ['size']
+        indexes = [
+            # In-stock sizes for the size facet and filter, without touching the table
+            models.Index(fields=['size', 'stock_quantity', 'product'], name='size_stock_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product.name} - {self.size}"
@@ -156,9 +248,44 @@ class ProductReview(TimeStampedModel):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a product's approved reviews
+            models.Index(fields=['product', 'is_approved', 'created_at', 'id'], name='review_feed_idx'),
+        ]
     
     def __str__(self):
         return f"Review for {self.product.name} by {self.customer_name}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._original = instance._rating_state()
+        return instance
+    
+    def _rating_state(self):
+        """What this review contributes to its product's ratings"""
+        return (self.product_id, self.rating) if self.is_approved else None
+    
+    def save(self, *args, **kwargs):
+        from .ratings import apply_rating_change
+        
+        original = getattr(self, '_original', None)
+        if self.pk and not hasattr(self, '_original'):
+            # Not loaded through the ORM; read what's stored
+            stored = ProductReview.objects.filter(pk=self.pk).first()
+            original = stored._original if stored else None
+        
+        current = self._rating_state()
+        if original == current:
+            super().save(*args, **kwargs)
+        else:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if original:
+                    apply_rating_change(*original, -1)
+                if current:
+                    apply_rating_change(*current, 1)
+        self._original = current
 
 
 class Offer(TimeStampedModel):
@@ -189,6 +316,9 @@ class Offer(TimeStampedModel):
     
     class Meta:
         ordering = ['-start_date']
+        indexes = [
+            models.Index(fields=['is_active', 'start_date', 'end_date'], name='offer_window_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -204,9 +334,12 @@ class Offer(TimeStampedModel):
         }
         return gradients.get(self.offer_type, 'from-purple-600 via-indigo-600 to-blue-600')
     
-    @property
+    @cached_property
     def badge_text(self):
-        days_remaining = (self.end_date - timezone.now()).days
+        return self.get_badge_text()
+    
+    def get_badge_text(self, now=None):
+        days_remaining = (self.end_date - (now or timezone.now())).days
         if days_remaining <= 3:
             return "Ending Soon"
         elif self.offer_type == 'welcome_offer':
@@ -227,8 +360,8 @@ class Offer(TimeStampedModel):
         }
         return icons.get(self.offer_type, 'fas fa-percent')
     
-    def is_currently_active(self):
-        now = timezone.now()
+    def is_currently_active(self, now=None):
+        now = now or timezone.now()
         return self.start_date <= now <= self.end_date and self.is_active
 
 class ComboOffer(TimeStampedModel):
@@ -236,9 +369,11 @@ class ComboOffer(TimeStampedModel):
     slug = models.SlugField(unique=True)
     description = RichTextField()
     products = models.ManyToManyField(Product, through='ComboProduct')
-    original_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # original_price, discount_percentage, savings_badge_text and stock_quantity
+    # are worked out from the products by store.combos.refresh_combos()
+    original_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2)
-    discount_percentage = models.PositiveIntegerField(validators=[MaxValueValidator(100)])
+    discount_percentage = models.PositiveIntegerField(default=0, validators=[MaxValueValidator(100)])
     stock_quantity = models.PositiveIntegerField(default=0)
     badge_text = models.CharField(max_length=50, default="POPULAR")
     savings_badge_text = models.CharField(max_length=50, default="SAVE 25%")
@@ -249,6 +384,9 @@ class ComboOffer(TimeStampedModel):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', 'start_date', 'end_date'], name='combo_window_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -257,9 +395,12 @@ class ComboOffer(TimeStampedModel):
     def savings_amount(self):
         return self.original_price - self.discount_price
     
-    @property
+    @cached_property
     def is_active_now(self):
-        now = timezone.now()
+        return self.is_currently_active()
+    
+    def is_currently_active(self, now=None):
+        now = now or timezone.now()
         return self.start_date <= now <= self.end_date and self.is_active and self.stock_quantity > 0
     
 class ComboProduct(models.Model):
@@ -599,6 +740,14 @@ class BusinessHours(TimeStampedModel):
             return f"{self.get_day_display()}: Closed"
         return f"{self.get_day_display()}: {self.opening_time.strftime('%I:%M %p')} - {self.closing_time.strftime('%I:%M %p')}"
     
+class Sequence(models.Model):
+    """Named counter for numbers that must never repeat, such as order numbers"""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+    
 class Order(models.Model):
     ORDER_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -665,33 +814,75 @@ class Order(models.Model):
     tracking_number = models.CharField(max_length=100, blank=True, null=True)
     shipping_carrier = models.CharField(max_length=100, blank=True, null=True)
     
+    # Stock Reservation
+    reservation_expires_at = models.DateTimeField(null=True, blank=True, help_text="Unpaid mobile-payment orders release their stock after this time")
+    stock_released = models.BooleanField(default=False, help_text="Reserved stock has been returned to inventory")
+    
     class Meta:
         ordering = ['-created_at']
     
+    # Fields whose loaded values are remembered so save() can spot transitions
+    TRACKED_FIELDS = ('status', 'payment_status')
+    
     def __str__(self):
         return f"Order #{self.order_number}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+    
+    def _snapshot_tracked_fields(self):
+        # Deferred fields aren't in __dict__ and are left out of the snapshot
+        self._original = {
+            field: self.__dict__[field] for field in self.TRACKED_FIELDS if field in self.__dict__
+        }
+    
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        # The reloaded values are what's stored now
+        original = getattr(self, '_original', {})
+        for field in self.TRACKED_FIELDS:
+            if field in self.__dict__ and (fields is None or field in fields):
+                original[field] = self.__dict__[field]
+        self._original = original
+    
+    def get_original(self, field):
+        """Value of a tracked field as it was loaded or last saved"""
+        original = getattr(self, '_original', {})
+        if field not in original and self.pk:
+            # Built by hand or loaded with the field deferred
+            original[field] = Order.objects.filter(pk=self.pk).values_list(field, flat=True).first()
+            self._original = original
+        return original.get(field)
+    
     def save(self, *args, **kwargs):
         if not self.order_number:
             self.order_number = self.generate_order_number()
         
         # Update paid_at timestamp when payment status changes to paid
+        cancelled = False
         if self.pk:
-            original = Order.objects.get(pk=self.pk)
-            if original.payment_status != 'paid' and self.payment_status == 'paid':
+            if self.get_original('payment_status') != 'paid' and self.payment_status == 'paid':
                 self.paid_at = timezone.now()
+                self.reservation_expires_at = None
+            cancelled = self.get_original('status') != 'cancelled' and self.status == 'cancelled'
         elif self.payment_status == 'paid' and not self.paid_at:
             self.paid_at = timezone.now()
             
         super().save(*args, **kwargs)
+        self._snapshot_tracked_fields()
+        
+        # Return reserved stock when an order is cancelled, e.g. from the admin
+        if cancelled and not self.stock_released:
+            from .stock import release_stock
+            release_stock(self)
     
     def generate_order_number(self):
-        """Generate a unique order number"""
-        from datetime import datetime
-        import random
-        timestamp = datetime.now().strftime('%Y%m%d%H%M')
-        random_str = str(random.randint(100, 999))
-        return f"ORD{timestamp}{random_str}"
+        """Generate a unique, increasing order number"""
+        from .order_utils import next_order_number
+        return next_order_number()
     
     @property
     def customer_name(self):
@@ -712,6 +903,7 @@ class Order(models.Model):
         """Mark order as paid with transaction details"""
         self.payment_status = 'paid'
         self.paid_at = timezone.now()
+        self.reservation_expires_at = None
         
         if transaction_id:
             self.transaction_id = transaction_id
@@ -720,6 +912,11 @@ class Order(models.Model):
             
         self.save()
     
+    def cancel(self):
+        """Cancel the order and return its reserved stock"""
+        self.status = 'cancelled'
+        self.save()
+    
     def get_payment_method_display_name(self):
         """Get formatted payment method name"""
         method_map = {
@@ -761,8 +958,10 @@ class OrderItem(models.Model):
             self.product_name = self.product.name
         
         
-        if self.product and not self.product_image and self.product.images.first():
-            self.product_image = self.product.images.first().image
+        if self.product and not self.product_image:
+            first_image = self.product.images.first()
+            if first_image:
+                self.product_image = first_image.image
             
         super().save(*args, **kwargs)    
         
\ No newline at end of file
@@ -0,0 +1,123 @@
+# store/order_utils.py
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from jobs.queue import enqueue
+
+from .metrics import inc
+from .models import Order, OrderItem, Sequence
+from .stock import get_reservation_expiry, release_expired_reservations, reserve_stock
+
+
+ORDER_NUMBER_SEQUENCE = 'order_number'
+# PostgreSQL sequence created by migration 0014
+ORDER_NUMBER_PG_SEQUENCE = 'store_order_number_seq'
+
+
+def next_order_number():
+    """
+    Return the next order number: ORD, the date, then a zero-padded counter.
+
+    The counter comes from the database, so numbers never collide and keep
+    increasing across processes, which keeps the unique index append-only.
+    PostgreSQL uses a real sequence, which is not rolled back and never
+    blocks other checkouts. Elsewhere a Sequence row, created on first use,
+    is bumped in its own atomic block; SQLite only has one writer at a time
+    anyway.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [ORDER_NUMBER_PG_SEQUENCE])
+            value = cursor.fetchone()[0]
+    else:
+        with transaction.atomic():
+            counter = Sequence.objects.filter(name=ORDER_NUMBER_SEQUENCE)
+            if not counter.update(last_value=F('last_value') + 1):
+                Sequence.objects.get_or_create(name=ORDER_NUMBER_SEQUENCE)
+                counter.update(last_value=F('last_value') + 1)
+            value = Sequence.objects.values_list('last_value', flat=True).get(name=ORDER_NUMBER_SEQUENCE)
+    return f"ORD{timezone.localdate():%Y%m%d}{value:08d}"
+
+
+def next_order_numbers(count):
+    """``count`` order numbers at once, for orders written with bulk_create"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", [ORDER_NUMBER_PG_SEQUENCE, count])
+            values = [row[0] for row in cursor.fetchall()]
+    else:
+        with transaction.atomic():
+            counter = Sequence.objects.filter(name=ORDER_NUMBER_SEQUENCE)
+            if not counter.update(last_value=F('last_value') + count):
+                Sequence.objects.get_or_create(name=ORDER_NUMBER_SEQUENCE)
+                counter.update(last_value=F('last_value') + count)
+            last = Sequence.objects.values_list('last_value', flat=True).get(name=ORDER_NUMBER_SEQUENCE)
+            values = range(last - count + 1, last + 1)
+    today = timezone.localdate()
+    return [f"ORD{today:%Y%m%d}{value:08d}" for value in values]
+
+
+def place_order(cart, shipping_cost, discount=Decimal('0'), **order_fields):
+    """
+    Create an order and all of its items from the cart in one transaction.
+
+    Products and their primary image come from the cart snapshot, which loads
+    them in a single batched pass, and the items are written with one
+    bulk_create, so the number of queries doesn't depend on the cart size.
+    Stock is reserved in the same transaction; OutOfStock is raised, and
+    nothing is written, if any line can't be fulfilled. A reservation is
+    released by a job queued to run when it expires.
+    """
+    lines = cart.get_lines()
+    subtotal = sum((item['total_price'] for item_key, item in lines), Decimal('0'))
+
+    with transaction.atomic():
+        reserve_stock(lines)
+        order = Order.objects.create(
+            subtotal=subtotal,
+            discount=discount,
+            shipping_cost=shipping_cost,
+            total=subtotal - discount + shipping_cost,
+            reservation_expires_at=get_reservation_expiry(order_fields.get('payment_method', 'cash_on_delivery')),
+            **order_fields
+        )
+        # bulk_create skips OrderItem.save(), so snapshot the product details here
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item['product'],
+                product_name=item['product'].name,
+                size=item['size'],
+                quantity=item['quantity'],
+                price=item['price'],
+                product_image=item['product'].primary_image_name or '',
+            )
+            for item_key, item in lines
+        ])
+        if order.reservation_expires_at:
+            enqueue(release_expired_reservations, run_at=order.reservation_expires_at + timedelta(seconds=1))
+        transaction.on_commit(lambda: inc('store_orders_created_total', payment_method=order.payment_method))
+    return order
+
+
+def mark_orders_paid(queryset):
+    """
+    Mark every unpaid order in ``queryset`` as paid with a single UPDATE.
+
+    For reconciliation batches: like Order.mark_as_paid() it stamps paid_at
+    and ends any stock reservation, but it skips save() and signals.
+    Cancelled orders, and any whose reserved stock has already gone back to
+    inventory, are left alone. Returns the number of orders updated.
+    """
+    now = timezone.now()
+    unpaid = queryset.exclude(payment_status='paid').exclude(status='cancelled').exclude(stock_released=True)
+    return unpaid.update(
+        payment_status='paid',
+        paid_at=now,
+        reservation_expires_at=None,
+        updated_at=now,
+    )
@@ -0,0 +1,170 @@
+# store/page_cache.py
+import hashlib
+import json
+import re
+import time
+
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .conditional import conditional_response, page_validators
+from .promotions import get_active_promotions
+
+# Pages are rendered for the cache with these in place of per-visitor parts
+CSRF_PLACEHOLDER = 'page-csrf-token-placeholder'
+_HOLE_RE = re.compile(r'<!--page-hole (.*?)-->')
+
+# Tags every cached page depends on through the navbar and footer
+SITE_TAGS = ('sitesettings',)
+
+
+class PageCapture:
+    """A cacheable page being rendered for the first time"""
+
+    def __init__(self, key, tags):
+        self.key = key
+        self.tags = set(tags) | set(SITE_TAGS)
+        self.started = time.time()
+
+
+def cache_anonymous_page(*tags, query_params=()):
+    """
+    Mark a view as cacheable for anonymous visitors by
+    AnonymousPageCacheMiddleware. ``tags`` name what the page shows, e.g.
+    'offer' for any offer; a view can add per-object tags such as
+    'product:42' with add_page_tags(). Only the ``query_params`` the view
+    reads are part of the cache key, so tracking and junk parameters share
+    one entry instead of filling the cache.
+    """
+    def decorator(view):
+        view.page_cache_tags = tags
+        view.page_cache_query_params = query_params
+        return view
+    return decorator
+
+
+def add_page_tags(request, *tags):
+    capture = getattr(request, 'page_capture', None)
+    if capture is not None:
+        capture.tags.update(tags)
+
+
+def is_capturing(request):
+    return getattr(request, 'page_capture', None) is not None
+
+
+def page_cache_key(request, query_params=()):
+    url = request.build_absolute_uri(request.path)
+    query = sorted((name, value) for name in query_params for value in request.GET.getlist(name))
+    if query:
+        url += '?' + urlencode(query)
+    return 'store:page:' + hashlib.md5(url.encode(), usedforsecurity=False).hexdigest()
+
+
+def _tag_key(tag):
+    return f'store:page-tag:{tag}'
+
+
+def get_tag_versions(tags):
+    # Tag versions live in the 'shared' cache so a purge reaches every process;
+    # the pages themselves stay in each process's own cache
+    found = caches['shared'].get_many([_tag_key(tag) for tag in tags])
+    return {tag: found.get(_tag_key(tag), 0) for tag in tags}
+
+
+def purge_page_tags(tags):
+    """Drop every cached page tagged with any of ``tags``, in every process"""
+    now = time.time()
+    caches['shared'].set_many({_tag_key(tag): now for tag in tags}, None)
+
+
+def purge_product_pages(product_ids):
+    """After stock changes made with update(), which send no signals"""
+    purge_page_tags(['productsize', *(f'product:{product_id}' for product_id in product_ids)])
+
+
+def page_tags_for(instance):
+    """Tags to purge when ``instance`` is saved or deleted"""
+    tags = {instance._meta.model_name}
+    product_id = getattr(instance, 'product_id', None)
+    if instance._meta.model_name == 'product':
+        product_id = instance.pk
+    if product_id:
+        tags.add(f'product:{product_id}')
+    if instance._meta.model_name == 'category':
+        tags.add(f'category:{instance.pk}')
+    return tags
+
+
+def hole(template_name, **kwargs):
+    """Marker for a per-visitor fragment, filled in by fill_holes()"""
+    return mark_safe(f'<!--page-hole {json.dumps([template_name, kwargs])}-->')
+
+
+def fill_holes(content, request):
+    """Put the visitor's CSRF token, messages and cart back into a cached page"""
+    def render_hole(match):
+        template_name, kwargs = json.loads(match.group(1))
+        return render_to_string(template_name, dict(kwargs, request=request, messages=get_messages(request)))
+
+    content = _HOLE_RE.sub(render_hole, content)
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+    return content
+
+
+def get_cached_page(key):
+    """The stored page for ``key`` if none of its tags were purged since, else None"""
+    entry = cache.get(key)
+    if entry is None or entry['expires_at'] <= time.time():
+        return None
+    if get_tag_versions(entry['tags']) != entry['tags']:
+        return None
+    return entry
+
+
+def store_page(capture, response, fingerprint=None):
+    """
+    Save a freshly rendered page. It is dropped rather than stored if one of
+    its tags was purged while it was being rendered, since it may show the
+    data from before the change.
+    """
+    versions = get_tag_versions(capture.tags)
+    if any(version >= capture.started for version in versions.values()):
+        return
+
+    expires_at = capture.started + settings.PAGE_CACHE_SECONDS
+    if capture.tags & {'offer', 'combooffer'}:
+        change = get_active_promotions().valid_until
+        if change:
+            expires_at = min(expires_at, change.timestamp())
+    timeout = expires_at - time.time()
+    if timeout > 0:
+        cache.set(capture.key, {
+            'content': response.content.decode(response.charset),
+            'content_type': response['Content-Type'],
+            'tags': versions,
+            'expires_at': expires_at,
+            'fingerprint': fingerprint,
+        }, timeout)
+
+
+def cached_response(entry, request):
+    """The stored page, or a 304 if the visitor already has it"""
+    def render():
+        return HttpResponse(fill_holes(entry['content'], request), content_type=entry['content_type'])
+
+    if entry['fingerprint'] is None:
+        response = render()
+    else:
+        etag = page_validators(entry['fingerprint'], request)
+        response = conditional_response(request, etag, render)
+    response['X-Page-Cache'] = 'hit'
+    return response
@@ -0,0 +1,148 @@
+# store/pagination.py
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*values):
+    """Opaque, URL-safe token for a position in a listing"""
+    value = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+
+class CursorPage:
+    """A page of results with tokens for its neighbours instead of page numbers"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def _created_cursor(obj):
+    return encode_cursor(obj.created_at.isoformat(), obj.pk)
+
+
+def _decode_created_cursor(cursor):
+    created_at, pk = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def paginate_by_created(queryset, size, after=None, before=None):
+    """
+    Page through ``queryset`` newest first, keyed on (created_at, id).
+
+    ``after`` continues past the last row of a page and ``before`` goes back
+    from the first one. Each page is a range scan that stops after size + 1
+    rows, so deep pages cost the same as the first and no COUNT is needed.
+    Raises InvalidCursor for a token that wasn't produced here.
+    """
+    newest_first = queryset.order_by('-created_at', '-id')
+
+    if before:
+        created_at, pk = _decode_created_cursor(before)
+        newer = newest_first.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+        rows = list(newer.order_by('created_at', 'id')[:size + 1])
+        if rows:
+            more_newer = len(rows) > size
+            rows = rows[:size][::-1]
+            return CursorPage(
+                rows,
+                next_cursor=_created_cursor(rows[-1]),
+                previous_cursor=_created_cursor(rows[0]) if more_newer else None,
+            )
+        # Nothing newer any more; show the first page
+        after = None
+
+    if after:
+        created_at, pk = _decode_created_cursor(after)
+        newest_first = newest_first.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    rows = list(newest_first[:size + 1])
+    more_older = len(rows) > size
+    rows = rows[:size]
+    return CursorPage(
+        rows,
+        next_cursor=_created_cursor(rows[-1]) if more_older else None,
+        previous_cursor=_created_cursor(rows[0]) if after and rows else None,
+    )
+
+
+def _decode_ranked_cursor(cursor):
+    score, pk = decode_cursor(cursor, 2)
+    try:
+        return float(score), int(pk)
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def paginate_ranked(fetch, size, after=None, before=None):
+    """
+    Page through ranked results, such as search results, keyed on (score, id).
+
+    ``fetch(limit, after=None, before=None)`` returns up to ``limit``
+    (score, id) pairs, best first, that follow the ``after`` key or, nearest
+    first, precede the ``before`` key. Like paginate_by_created() each page
+    reads size + 1 rows and the tokens hold the key at the page edge, so a
+    page stays put if results shift between requests. The page holds ids.
+    Raises InvalidCursor for a token that wasn't produced here.
+    """
+    if before:
+        rows = fetch(size + 1, before=_decode_ranked_cursor(before))
+        if rows:
+            more_better = len(rows) > size
+            rows = rows[:size][::-1]
+            return CursorPage(
+                [pk for score, pk in rows],
+                next_cursor=encode_cursor(*rows[-1]),
+                previous_cursor=encode_cursor(*rows[0]) if more_better else None,
+            )
+        # Nothing ranked higher any more; show the first page
+        after = None
+
+    rows = fetch(size + 1, after=_decode_ranked_cursor(after) if after else None)
+    more_worse = len(rows) > size
+    rows = rows[:size]
+    return CursorPage(
+        [pk for score, pk in rows],
+        next_cursor=encode_cursor(*rows[-1]) if more_worse else None,
+        previous_cursor=encode_cursor(*rows[0]) if after and rows else None,
+    )
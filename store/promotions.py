@@ -0,0 +1,129 @@
+# store/promotions.py
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .metrics import count_cache
+from .models import ComboOffer, Offer
+
+# Offer.badge_text switches to "Ending Soon" when fewer than this many days are left
+ENDING_SOON = timedelta(days=4)
+
+PROMOTIONS_VERSION_KEY = 'store:promotions_version'
+
+
+def live_offers(now=None):
+    now = now or timezone.now()
+    return Offer.objects.filter(is_active=True, start_date__lte=now, end_date__gte=now)
+
+
+def live_combos(now=None):
+    """Combos on sale now; sold-out ones are left out"""
+    now = now or timezone.now()
+    return ComboOffer.objects.filter(is_active=True, start_date__lte=now, end_date__gte=now, stock_quantity__gt=0)
+
+
+def next_promotion_change(now=None):
+    """
+    When the set of live offers and combos next changes on its own: the
+    earliest upcoming start or end of an active offer or combo, or an
+    offer's "Ending Soon" badge appearing. None if nothing is scheduled.
+    """
+    now = now or timezone.now()
+    # Offers are live up to and including end_date, so an end at ``now``
+    # is still to come
+    offers = Offer.objects.filter(is_active=True).aggregate(
+        start=Min('start_date', filter=Q(start_date__gt=now)),
+        end=Min('end_date', filter=Q(end_date__gte=now)),
+        ending_soon=Min('end_date', filter=Q(end_date__gte=now + ENDING_SOON)),
+    )
+    combos = ComboOffer.objects.filter(is_active=True).aggregate(
+        start=Min('start_date', filter=Q(start_date__gt=now)),
+        end=Min('end_date', filter=Q(end_date__gte=now)),
+    )
+    if offers['ending_soon']:
+        offers['ending_soon'] -= ENDING_SOON
+    changes = [moment for moment in (*offers.values(), *combos.values()) if moment]
+    return min(changes, default=None)
+
+
+class ActivePromotions:
+    """The live offers and combos, best first, and the moment that set next changes"""
+
+    def __init__(self, offers, combos, valid_until):
+        self.offers = offers
+        self.combos = combos
+        self.valid_until = valid_until
+        # Discount codes of the live offers, for lookups without a query
+        self.codes = {
+            offer.discount_code.strip().casefold(): offer for offer in offers if offer.discount_code.strip()
+        }
+
+    def is_current(self, now):
+        return self.valid_until is None or now < self.valid_until
+
+
+def load_active_promotions(now=None):
+    now = now or timezone.now()
+    offers = list(live_offers(now).order_by('-is_featured', '-start_date'))
+    for offer in offers:
+        # Badges change at a boundary, so one reading of the clock holds until then
+        offer.badge_text = offer.get_badge_text(now)
+    combos = list(
+        live_combos(now)
+        .order_by('-is_featured', '-discount_percentage', '-created_at')
+        .prefetch_related('comboproduct_set__product__images')
+    )
+    for combo in combos:
+        # Live by construction until valid_until, which includes every combo's end
+        combo.is_active_now = True
+    return ActivePromotions(offers, combos, next_promotion_change(now))
+
+
+def get_promotions_version():
+    """
+    Counter bumped on every promotions change. It lives in the 'shared'
+    cache, so a bump from a worker or a command reaches every web process.
+    A lost counter restarts from the clock rather than from 1, so it can't
+    land on a version whose promotions are still cached.
+    """
+    shared = caches['shared']
+    version = shared.get(PROMOTIONS_VERSION_KEY)
+    if version is None:
+        shared.add(PROMOTIONS_VERSION_KEY, int(time.time()), None)
+        version = shared.get(PROMOTIONS_VERSION_KEY, 1)
+    return version
+
+
+def bump_promotions_version():
+    shared = caches['shared']
+    try:
+        shared.incr(PROMOTIONS_VERSION_KEY)
+    except ValueError:
+        shared.add(PROMOTIONS_VERSION_KEY, int(time.time()), None)
+
+
+def get_active_promotions():
+    """
+    ActivePromotions for right now, shared by every request until the next
+    offer or combo starts or ends, or until an edit bumps the promotions
+    version. Each process keeps its own copy; PROMOTIONS_CACHE_SECONDS
+    bounds its life regardless.
+    """
+    key = f'store:promotions:{get_promotions_version()}'
+    now = timezone.now()
+    promotions = cache.get(key)
+    fresh = promotions is not None and promotions.is_current(now)
+    count_cache('promotions', hits=fresh, misses=not fresh)
+    if not fresh:
+        promotions = load_active_promotions(now)
+        timeout = settings.PROMOTIONS_CACHE_SECONDS
+        if promotions.valid_until is not None:
+            timeout = min(timeout, math.ceil((promotions.valid_until - now).total_seconds()))
+        cache.set(key, promotions, max(timeout, 1))
+    return promotions
@@ -0,0 +1,71 @@
+# store/ratings.py
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import Product, ProductReview
+
+RATING_COUNT_FIELDS = {stars: f'rating_{stars}_count' for stars in range(1, 6)}
+
+
+def apply_rating_change(product_id, rating, delta):
+    """
+    Add (delta=1) or take away (delta=-1) one approved review of ``rating``
+    stars from a product's totals.
+
+    One UPDATE computed from F() expressions, so concurrent approvals don't
+    overwrite each other. Every right-hand side sees the row as it was
+    before the update, which is why the average repeats the arithmetic.
+    """
+    new_count = F('rating_count') + delta
+    new_sum = F('rating_sum') + delta * rating
+    Product.objects.filter(pk=product_id).update(
+        rating_count=new_count,
+        rating_sum=new_sum,
+        average_rating=Case(
+            When(rating_count=-delta, then=Value(0)),
+            default=Cast(new_sum, FloatField()) / new_count,
+            output_field=DecimalField(max_digits=3, decimal_places=2),
+        ),
+        **{RATING_COUNT_FIELDS[rating]: F(RATING_COUNT_FIELDS[rating]) + delta},
+    )
+
+
+def recompute_ratings(product_ids=None, batch_size=1000):
+    """
+    Rebuild rating totals from the approved reviews, for ``product_ids`` or
+    every product. Used after bulk updates that skip ProductReview.save().
+    Returns how many products were updated.
+    """
+    reviews = ProductReview.objects.filter(is_approved=True)
+    products = Product.objects.order_by('pk')
+    if product_ids is not None:
+        reviews = reviews.filter(product_id__in=product_ids)
+        products = products.filter(pk__in=product_ids)
+
+    totals = {
+        row.pop('product_id'): row
+        for row in reviews.values('product_id').order_by().annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            **{field: Count('id', filter=Q(rating=stars)) for stars, field in RATING_COUNT_FIELDS.items()},
+        )
+    }
+
+    fields = ['rating_count', 'rating_sum', 'average_rating', *RATING_COUNT_FIELDS.values()]
+    empty = dict.fromkeys(fields, 0)
+    updated = 0
+    with transaction.atomic():
+        batch = []
+        for product in products.only('pk').iterator(chunk_size=batch_size):
+            row = totals.get(product.pk, empty)
+            for field in fields:
+                setattr(product, field, row.get(field, 0))
+            if row['rating_count']:
+                product.average_rating = round(row['rating_sum'] / row['rating_count'], 2)
+            batch.append(product)
+            if len(batch) == batch_size:
+                updated += Product.objects.bulk_update(batch, fields)
+                batch = []
+        updated += Product.objects.bulk_update(batch, fields)
+    return updated
@@ -0,0 +1,120 @@
+# store/renditions.py
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Widths each product image is resized to; never wider than the upload
+RENDITION_WIDTHS = {
+    'admin': 160,
+    'card': 480,
+    'detail': 960,
+    'zoom': 1600,
+}
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+RENDITION_DIR = 'renditions'
+
+
+def render_renditions(data):
+    """
+    Every rendition of an image, from its bytes: {preset: (width, height,
+    {format: bytes})}. Needs nothing but Pillow, so it can run in a worker
+    process without Django.
+    """
+    with Image.open(BytesIO(data)) as source:
+        # Camera photos are often stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(source)
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, 'white')
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+
+        rendered = {}
+        for preset, width in sorted(RENDITION_WIDTHS.items(), key=lambda item: item[1]):
+            width = min(width, image.width)
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+            files = {}
+            for extension, (fmt, options) in RENDITION_FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, fmt, **options)
+                files[extension] = buffer.getvalue()
+            rendered[preset] = (width, height, files)
+        return rendered
+
+
+def rendition_name(source_name, width, data, extension):
+    """Storage name for a rendition; it changes with the content, so URLs can be cached forever"""
+    stem = posixpath.splitext(posixpath.basename(source_name))[0]
+    digest = hashlib.sha1(data, usedforsecurity=False).hexdigest()[:12]
+    return f'{RENDITION_DIR}/{stem}-{width}w-{digest}.{extension}'
+
+
+def save_renditions(source_name, rendered, storage):
+    """
+    Write rendered files to ``storage`` and return what ProductImage.renditions
+    keeps. Names are content hashes, so files already there are left alone.
+    """
+    presets = {}
+    for preset, (width, height, files) in rendered.items():
+        entry = presets[preset] = {'width': width, 'height': height}
+        for extension, data in files.items():
+            name = rendition_name(source_name, width, data, extension)
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(data))
+            entry[extension] = name
+    return {'source': source_name, 'presets': presets}
+
+
+def needs_renditions(product_image):
+    return bool(product_image.image) and product_image.renditions.get('source') != product_image.image.name
+
+
+def generate_renditions(product_image):
+    """
+    Render and store ``product_image``'s renditions and record them on the
+    row. A missing upload is skipped and one Pillow can't read is logged.
+    Saved with update(), so page caches must be purged by the caller unless
+    this runs from a save that purges them anyway.
+    """
+    if not product_image.image.storage.exists(product_image.image.name):
+        return False
+    try:
+        with product_image.image.open('rb') as upload:
+            rendered = render_renditions(upload.read())
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("Could not make renditions of %s", product_image.image.name, exc_info=True)
+        return False
+
+    product_image.renditions = save_renditions(product_image.image.name, rendered, product_image.image.storage)
+    product_image.updated_at = timezone.now()
+    type(product_image).objects.filter(pk=product_image.pk).update(
+        renditions=product_image.renditions, updated_at=product_image.updated_at,
+    )
+    return True
+
+
+def rendition(product_image, preset, extension='jpeg'):
+    """Storage name of one rendition, or None"""
+    entry = (product_image.renditions or {}).get('presets', {}).get(preset)
+    return entry and entry.get(extension)
+
+
+def srcset(product_image, extension):
+    """``url width`` pairs for every rendition in ``extension``, narrowest first"""
+    storage = product_image.image.storage
+    seen = {}
+    for entry in (product_image.renditions or {}).get('presets', {}).values():
+        if extension in entry:
+            seen[entry['width']] = storage.url(entry[extension])
+    return ', '.join(f'{url} {width}w' for width, url in sorted(seen.items()))
@@ -0,0 +1,155 @@
+# store/request_metrics.py
+"""
+Per-request counters for RequestMetricsMiddleware: SQL queries and their
+time, template rendering time and cache hits. Nothing is recorded outside
+a sampled request, so the hooks below cost one context variable lookup.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = (
+        'started', 'queries', 'db_seconds', 'template_seconds', '_template_depth',
+        'cache_hits', 'cache_misses', '_in_get_many',
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self._template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._in_get_many = False
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper, see connection.execute_wrapper()"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self):
+        """Value for the Server-Timing response header"""
+        return ', '.join([
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_seconds * 1000:.1f};desc="templates"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={self.total_seconds * 1000:.1f}',
+        ])
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_seconds * 1000, 2),
+            'template_ms': round(self.template_seconds * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'total_ms': round(self.total_seconds * 1000, 2),
+        }
+
+
+def get_request_metrics():
+    """The metrics being recorded for the current request, or None"""
+    return _current.get()
+
+
+@contextmanager
+def record_request():
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def _timed_render(metrics):
+    # Card and fragment templates are rendered inside the page; count the outer render only
+    metrics._template_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._template_depth -= 1
+        if not metrics._template_depth:
+            metrics.template_seconds += time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        with _timed_render(metrics):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for sampled requests"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class CacheMetricsMixin:
+    """Counts get() and get_many() hits and misses for sampled requests"""
+
+    _missing = object()
+
+    def get(self, key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics._in_get_many:
+            return super().get(key, default, version)
+        value = super().get(key, self._missing, version)
+        if value is self._missing:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+    def get_many(self, keys, version=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().get_many(keys, version)
+        keys = list(keys)
+        # The base get_many() calls get() for each key
+        metrics._in_get_many = True
+        try:
+            values = super().get_many(keys, version)
+        finally:
+            metrics._in_get_many = False
+        metrics.cache_hits += len(values)
+        metrics.cache_misses += len(keys) - len(values)
+        return values
+
+
+class LocMemMetricsCache(CacheMetricsMixin, LocMemCache):
+    pass
+
+
+class RedisMetricsCache(CacheMetricsMixin, RedisCache):
+    pass
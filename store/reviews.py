@@ -0,0 +1,20 @@
+# store/reviews.py
+from .pagination import paginate_by_created
+
+REVIEWS_PAGE_SIZE = 10
+
+
+def get_review_page(product_id, cursor=None, size=REVIEWS_PAGE_SIZE):
+    """
+    One page of a product's approved reviews, newest first, and the cursor
+    for the next page (None on the last page).
+
+    Pages are keyed on (created_at, id) rather than an OFFSET, so every page
+    is a short range scan of the (product, is_approved, created_at, id)
+    index however deep the customer scrolls.
+    """
+    from .models import ProductReview
+
+    reviews = ProductReview.objects.filter(product_id=product_id, is_approved=True)
+    page = paginate_by_created(reviews, size, after=cursor)
+    return page.object_list, page.next_cursor
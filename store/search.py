@@ -0,0 +1,211 @@
+# store/search.py
+import html
+import re
+from functools import partial
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import strip_tags
+
+from .models import Product
+from .pagination import paginate_ranked
+
+# FTS5 table created by migration 0015 (0024 on PostgreSQL); rowid is the product id
+SEARCH_TABLE = 'store_product_search'
+SEARCH_COLUMNS = ('name', 'short_description', 'description', 'category')
+# bm25() weights, in SEARCH_COLUMNS order: a hit in the name counts most
+SEARCH_WEIGHTS = (10.0, 4.0, 1.0, 5.0)
+# The same for PostgreSQL, where the table created by migration 0024 holds a
+# stored, GIN-indexed tsvector
+SEARCH_PG_WEIGHTS = ('A', 'B', 'C', 'B')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def uses_index():
+    """Whether products are searched through SEARCH_TABLE: FTS5 on SQLite, a tsvector table on PostgreSQL"""
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def search_document(product):
+    """The text indexed for a product, with the CKEditor markup stripped"""
+    return (
+        product.name,
+        product.short_description,
+        html.unescape(strip_tags(product.description or '')),
+        product.category.name,
+    )
+
+
+def index_products(products):
+    """Add or refresh products in the index. Inactive products are removed."""
+    if not uses_index():
+        return
+    products = list(products)
+    if not products:
+        return
+    if uses_fts():
+        insert = f"INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)"
+    else:
+        document = ' || '.join(f"setweight(to_tsvector(%s), '{weight}')" for weight in SEARCH_PG_WEIGHTS)
+        insert = f"INSERT INTO {SEARCH_TABLE} (rowid, document) VALUES (%s, {document})"
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+            [(product.pk,) for product in products],
+        )
+        cursor.executemany(
+            insert,
+            [(product.pk, *search_document(product)) for product in products if product.is_active],
+        )
+
+
+def unindex_product(product_id):
+    if not uses_index():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild_index(batch_size=500):
+    """Rebuild the whole index from the products table. Returns how many products were indexed."""
+    if not uses_index():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    count = 0
+    batch = []
+    for product in Product.objects.filter(is_active=True).select_related('category').iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) == batch_size:
+            index_products(batch)
+            count += len(batch)
+            batch = []
+    index_products(batch)
+    return count + len(batch)
+
+
+def match_expression(query):
+    """
+    Turn free text into a safe FTS5 MATCH expression.
+
+    Every word must match, and the last one is treated as a prefix so
+    results show up while the customer is still typing.
+    """
+    tokens = _TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return ''
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _matches(query):
+    """SQL for the (score, rowid) of every match, higher scores first, and its parameters"""
+    if uses_fts():
+        expression = match_expression(query)
+        if not expression:
+            return None, []
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        # bm25() is lower for better matches
+        return (
+            f"SELECT -bm25({SEARCH_TABLE}, {weights}) AS score, rowid FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s",
+            [expression],
+        )
+    # ts_rank() is a real; as a double it survives the round trip through a cursor unchanged
+    return (
+        f"SELECT ts_rank(document, websearch_to_tsquery(%s))::float8 AS score, rowid FROM {SEARCH_TABLE} "
+        f"WHERE document @@ websearch_to_tsquery(%s)",
+        [query, query],
+    )
+
+
+def _fallback_queryset(query):
+    return Product.objects.filter(
+        Q(name__icontains=query)
+        | Q(short_description__icontains=query)
+        | Q(description__icontains=query)
+        | Q(category__name__icontains=query),
+        is_active=True,
+    ).values_list('id', flat=True).distinct()
+
+
+def ranked_matches(query, limit=None, after=None, before=None):
+    """
+    (score, id) pairs of active products matching ``query``, best match first.
+
+    ``after`` and ``before`` are (score, id) keys to seek from; rows before
+    a key come nearest first. Ranking and the limit both happen in the
+    database, so only the rows asked for are read back. Without an index
+    every match scores 0 and ids keep their order.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    if not uses_index():
+        ids = _fallback_queryset(query).order_by('id')
+        if after:
+            ids = ids.filter(pk__gt=after[1])
+        elif before:
+            ids = ids.filter(pk__lt=before[1]).order_by('-id')
+        return [(0.0, pk) for pk in (ids[:limit] if limit else ids)]
+
+    matches, params = _matches(query)
+    if not matches:
+        return []
+    sql = f"SELECT score, rowid FROM ({matches}) AS matches"
+    if after:
+        sql += " WHERE score < %s OR (score = %s AND rowid > %s) ORDER BY score DESC, rowid"
+        params += [after[0], after[0], after[1]]
+    elif before:
+        sql += " WHERE score > %s OR (score = %s AND rowid < %s) ORDER BY score, rowid DESC"
+        params += [before[0], before[0], before[1]]
+    else:
+        sql += " ORDER BY score DESC, rowid"
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def count_matches(query):
+    """How many active products match ``query``, without ranking them"""
+    query = query.strip()
+    if not query:
+        return 0
+    if not uses_index():
+        return _fallback_queryset(query).count()
+    if uses_fts():
+        expression = match_expression(query)
+        if not expression:
+            return 0
+        sql, params = f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [expression]
+    else:
+        sql, params = f"SELECT count(*) FROM {SEARCH_TABLE} WHERE document @@ websearch_to_tsquery(%s)", [query]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+
+
+def search_product_ids(query):
+    """Ids of active products matching ``query``, best match first"""
+    return [pk for score, pk in ranked_matches(query)]
+
+
+def search_page(query, size, after=None, before=None):
+    """A CursorPage of the ids of one page of results for ``query``"""
+    return paginate_ranked(partial(ranked_matches, query), size, after=after, before=before)
+
+
+def products_for_ids(ids):
+    """Card-ready products for ``ids``, in the same order"""
+    products = Product.objects.filter(is_active=True).for_cards().in_bulk(ids)
+    return [products[product_id] for product_id in ids if product_id in products]
@@ -0,0 +1,286 @@
+# store/seeding.py
+"""
+A synthetic catalogue for benchmarks and load tests, written with
+bulk_create: categories, products with images and sizes, reviews, offers,
+combos and past orders. Every slug starts with the prefix, and every
+order is addressed to @<prefix>.example.com, so a catalogue can be seeded
+next to real data and removed again with clear_seeded().
+"""
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .combos import refresh_combos
+from .models import (
+    Category, ComboOffer, ComboProduct, Offer, Order, OrderItem, Product, ProductImage, ProductReview, ProductSize,
+)
+from .order_utils import next_order_numbers
+from .page_cache import purge_page_tags
+from .promotions import bump_promotions_version
+from .ratings import RATING_COUNT_FIELDS
+from .search import rebuild_index
+from .suggest import invalidate_index
+
+CATEGORY_NAMES = [
+    'Sneakers', 'Running', 'Boots', 'Sandals', 'Loafers', 'Formal', 'Slippers', 'Sports', 'Kids', 'Heels',
+    'Flats', 'Hiking',
+]
+STYLES = ['Air', 'Trail', 'Street', 'Classic', 'Urban', 'Flex', 'Cloud', 'Storm', 'Metro', 'Breeze', 'Summit', 'Pulse']
+MATERIALS = ['Leather', 'Canvas', 'Suede', 'Mesh', 'Knit', 'Nubuck']
+COLOURS = ['Black', 'White', 'Brown', 'Navy', 'Grey', 'Olive', 'Tan', 'Red']
+SIZES = ['36', '37', '38', '39', '40', '41', '42', '43', '44', '45', '46']
+FIRST_NAMES = ['Rahim', 'Karim', 'Nusrat', 'Farhana', 'Tanvir', 'Sadia', 'Imran', 'Mitu', 'Arif', 'Jannat']
+LAST_NAMES = ['Uddin', 'Hossain', 'Ahmed', 'Islam', 'Khan', 'Chowdhury', 'Rahman', 'Akter']
+
+# (value, weight) pairs for the things picked at random
+GENDERS = [('M', 45), ('F', 35), ('U', 20)]
+# Most shoppers who leave a review are happy
+RATINGS = [(1, 5), (2, 5), (3, 12), (4, 30), (5, 48)]
+ORDER_STATUSES = [('delivered', 55), ('shipped', 10), ('confirmed', 10), ('pending', 15), ('cancelled', 10)]
+PAYMENT_METHODS = [('cash_on_delivery', 55), ('bkash', 30), ('nagad', 10), ('rocket', 5)]
+CITIES = [('Dhaka', 50), ('Chattogram', 20), ('Sylhet', 10), ('Khulna', 10), ('Rajshahi', 10)]
+LINES_PER_ORDER = [(1, 70), (2, 22), (3, 8)]
+
+# Page cache tags of everything seeded
+SEEDED_TAGS = [
+    'category', 'product', 'productimage', 'productsize', 'productreview', 'offer', 'combooffer', 'comboproduct',
+]
+
+
+def _pick(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def _money(value):
+    return Decimal(max(10, round(value, -1))).quantize(Decimal('0.01'))
+
+
+def seed_catalog(*, categories=12, products=1000, reviews=8, offers=6, combos=20, orders=2000,
+                 prefix='seed', seed=65, batch_size=2000):
+    """
+    Write a synthetic catalogue and return how many rows of each kind were
+    created. ``reviews`` is the mean number of reviews per product.
+
+    Popularity follows a Zipf curve, so a few products get most of the
+    orders, and review counts have a long tail. Prices are log-normal, a
+    quarter of products are discounted, and about a third of the sizes are
+    sold out. Offers and combos are mostly live, with some ended or yet to
+    start. Orders are historical: they don't hold stock. The work that
+    signals would do (search index, rating totals, combo totals, cache
+    versions) is done in bulk.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    with transaction.atomic():
+        category_rows = Category.objects.bulk_create([
+            Category(
+                name=f'{CATEGORY_NAMES[i % len(CATEGORY_NAMES)]} {i // len(CATEGORY_NAMES) + 1}',
+                slug=f'{prefix}-category-{i}', order=i,
+            )
+            for i in range(categories)
+        ])
+        # A few big categories and many small ones
+        category_weights = [1 / (i + 1) for i in range(categories)]
+
+        product_rows = []
+        for i in range(products):
+            price = _money(rng.lognormvariate(math.log(2200), 0.5))
+            name = f'{rng.choice(STYLES)} {rng.choice(MATERIALS)} {rng.choice(COLOURS)} {i}'
+            product_rows.append(Product(
+                name=name, slug=f'{prefix}-product-{i}',
+                description=f'<p>{name}, a synthetic shoe for load tests.</p>',
+                category=rng.choices(category_rows, category_weights)[0],
+                gender=_pick(rng, GENDERS),
+                price=price,
+                discount_price=_money(float(price) * rng.uniform(0.6, 0.9)) if rng.random() < 0.25 else None,
+                is_featured=rng.random() < 0.05,
+                is_new=rng.random() < 0.1,
+                is_active=rng.random() < 0.97,
+            ))
+
+        sizes, size_lists, product_reviews = [], [], []
+        for product in product_rows:
+            first = rng.randrange(len(SIZES) - 3)
+            available = SIZES[first:first + rng.randint(3, 8)]
+            stocks = [0 if rng.random() < 0.3 else rng.randint(1, 20) for size in available]
+            product.stock_quantity = sum(stocks)
+            size_lists.append([size for size, stock in zip(available, stocks) if stock])
+            sizes.append((available, stocks))
+
+            # (rating, approved) per review; the totals are written with the product
+            # rather than by recompute_ratings(), which is slow on a large catalogue
+            ratings = [
+                (_pick(rng, RATINGS), rng.random() < 0.9)
+                for i in range(int(rng.expovariate(1 / reviews)) if reviews else 0)
+            ]
+            approved = [rating for rating, is_approved in ratings if is_approved]
+            product.rating_count = len(approved)
+            product.rating_sum = sum(approved)
+            product.average_rating = round(sum(approved) / len(approved), 2) if approved else 0
+            for stars, field in RATING_COUNT_FIELDS.items():
+                setattr(product, field, approved.count(stars))
+            product_reviews.append(ratings)
+        product_rows = Product.objects.bulk_create(product_rows, batch_size=batch_size)
+
+        ProductSize.objects.bulk_create([
+            ProductSize(product=product, size=size, stock_quantity=stock)
+            for product, (available, stocks) in zip(product_rows, sizes)
+            for size, stock in zip(available, stocks)
+        ], batch_size=batch_size)
+
+        image_rows = []
+        for product in product_rows:
+            for position in range(rng.randint(1, 4)):
+                image_rows.append(ProductImage(
+                    product=product, image=f'products/{product.slug}-{position}.jpg',
+                    alt_text=product.name, is_primary=position == 0, order=position,
+                ))
+        ProductImage.objects.bulk_create(image_rows, batch_size=batch_size)
+
+        review_rows = []
+        for product, ratings in zip(product_rows, product_reviews):
+            for rating, is_approved in ratings:
+                review_rows.append(ProductReview(
+                    product=product, customer_name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                    rating=rating, title=f'{rating} stars', comment=f'Synthetic review of {product.name}.',
+                    is_approved=is_approved, is_featured=is_approved and rating == 5 and rng.random() < 0.05,
+                ))
+        ProductReview.objects.bulk_create(review_rows, batch_size=batch_size)
+
+        # Orders and combos favour the popular products, in no particular id order
+        popular = rng.sample(product_rows, len(product_rows))
+        popularity = list(accumulate(1 / (rank + 1) ** 1.1 for rank in range(len(popular))))
+        effective_price = {product.pk: product.discount_price or product.price for product in product_rows}
+        in_stock_sizes = {product.pk: available for product, available in zip(product_rows, size_lists)}
+
+        offer_types = [value for value, label in Offer.OFFER_TYPES]
+        offer_rows = []
+        for i in range(offers):
+            offer_type = offer_types[i % len(offer_types)]
+            # Mostly live, some yet to start and some ended
+            window = rng.choices(['live', 'upcoming', 'ended'], [70, 15, 15])[0]
+            if window == 'live':
+                start = now - timedelta(days=rng.randint(1, 14))
+            elif window == 'upcoming':
+                start = now + timedelta(days=rng.randint(1, 10))
+            else:
+                start = now - timedelta(days=rng.randint(60, 90))
+            offer_rows.append(Offer(
+                title=f'{dict(Offer.OFFER_TYPES)[offer_type]} {i}', slug=f'{prefix}-offer-{i}',
+                offer_type=offer_type,
+                discount_percentage=0 if offer_type == 'free_shipping' else rng.choice([5, 10, 15, 20, 25, 30, 40]),
+                discount_code=f'{prefix}{i}'.upper() if offer_type == 'discount_code' else '',
+                min_order_amount=Decimal(rng.choice([1000, 2000, 3000])) if rng.random() < 0.3 else None,
+                start_date=start, end_date=start + timedelta(days=rng.randint(15, 45)),
+                is_featured=rng.random() < 0.3,
+            ))
+        Offer.objects.bulk_create(offer_rows)
+
+        combo_rows, combo_parts = [], []
+        for i in range(combos):
+            parts = []
+            while len(parts) < min(rng.randint(2, 3), len(popular)):
+                product = rng.choices(popular, cum_weights=popularity)[0]
+                if product not in parts:
+                    parts.append(product)
+            price = sum(effective_price[product.pk] for product in parts)
+            start = now - timedelta(days=rng.randint(1, 30))
+            combo_rows.append(ComboOffer(
+                name=' + '.join(product.name for product in parts), slug=f'{prefix}-combo-{i}',
+                description='<p>Synthetic combo for load tests.</p>',
+                discount_price=_money(float(price) * rng.uniform(0.75, 0.9)),
+                start_date=start, end_date=start + timedelta(days=rng.randint(20, 60) if rng.random() < 0.85 else 1),
+                is_featured=rng.random() < 0.2,
+            ))
+            combo_parts.append(parts)
+        combo_rows = ComboOffer.objects.bulk_create(combo_rows)
+        ComboProduct.objects.bulk_create([
+            ComboProduct(combo_offer=combo, product=product)
+            for combo, parts in zip(combo_rows, combo_parts)
+            for product in parts
+        ])
+
+        order_rows, order_lines = [], []
+        for number in next_order_numbers(orders) if orders else []:
+            lines = []
+            for i in range(_pick(rng, LINES_PER_ORDER)):
+                product = rng.choices(popular, cum_weights=popularity)[0]
+                size = rng.choice(in_stock_sizes[product.pk]) if in_stock_sizes[product.pk] else None
+                lines.append((product, size, 2 if rng.random() < 0.15 else 1))
+            status = _pick(rng, ORDER_STATUSES)
+            method = _pick(rng, PAYMENT_METHODS)
+            paid = status in ('delivered', 'shipped') or (status == 'confirmed' and method != 'cash_on_delivery')
+            if paid:
+                payment_status = 'paid'
+            elif status == 'cancelled' and method != 'cash_on_delivery':
+                payment_status = 'refunded'
+            else:
+                payment_status = 'pending'
+            subtotal = sum(effective_price[product.pk] * quantity for product, size, quantity in lines)
+            shipping = Decimal(rng.choice([60, 120]))
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            order_rows.append(Order(
+                order_number=number, status=status, payment_method=method,
+                payment_status=payment_status,
+                paid_at=now if paid else None,
+                subtotal=subtotal, shipping_cost=shipping, total=subtotal + shipping,
+                shipping_full_name=f'{first} {last}',
+                shipping_email=f'{first.lower()}.{len(order_rows)}@{prefix}.example.com',
+                shipping_phone=f'017{rng.randrange(10 ** 8):08d}',
+                shipping_address=f'House {rng.randint(1, 200)}, Road {rng.randint(1, 40)}',
+                shipping_city=_pick(rng, CITIES),
+                stock_released=status == 'cancelled',
+            ))
+            order_lines.append(lines)
+        order_rows = Order.objects.bulk_create(order_rows, batch_size=batch_size)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order, product=product, product_name=product.name, size=size, quantity=quantity,
+                price=effective_price[product.pk], product_image=f'products/{product.slug}-0.jpg',
+            )
+            for order, lines in zip(order_rows, order_lines)
+            for product, size, quantity in lines
+        ], batch_size=batch_size)
+
+        refresh_combos(combo_ids=[combo.pk for combo in combo_rows])
+        rebuild_index()
+        transaction.on_commit(catalog_seeded)
+
+    return {
+        'categories': len(category_rows),
+        'products': len(product_rows),
+        'sizes': sum(len(available) for available, stocks in sizes),
+        'images': len(image_rows),
+        'reviews': len(review_rows),
+        'offers': len(offer_rows),
+        'combos': len(combo_rows),
+        'orders': len(order_rows),
+        'order_items': sum(len(lines) for lines in order_lines),
+    }
+
+
+def catalog_seeded():
+    """Drop everything cached about the catalogue after a bulk change, in every process"""
+    bump_catalog_version()
+    bump_promotions_version()
+    purge_page_tags(SEEDED_TAGS)
+    invalidate_index()
+
+
+def clear_seeded(prefix='seed'):
+    """Delete a catalogue written by seed_catalog() with ``prefix``. Returns how many rows went."""
+    with transaction.atomic():
+        deleted = Order.objects.filter(shipping_email__endswith=f'@{prefix}.example.com').delete()[0]
+        deleted += ComboOffer.objects.filter(slug__startswith=f'{prefix}-combo-').delete()[0]
+        deleted += Offer.objects.filter(slug__startswith=f'{prefix}-offer-').delete()[0]
+        deleted += Category.objects.filter(slug__startswith=f'{prefix}-category-').delete()[0]
+        transaction.on_commit(catalog_seeded)
+    return deleted
@@ -0,0 +1,166 @@
+# store/signals.py
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from jobs.queue import enqueue
+
+from .catalog import bump_catalog_version
+from .combos import refresh_combos
+from .models import (
+    AboutSection, Category, ComboOffer, ComboProduct, ContactInfo, ContactPageSettings, EligibilityItem,
+    HeroSection, Offer, PolicyPoint, Product, ProductImage, ProductReview, ProductSize, RefundMethod,
+    ReturnReason, ReturnsPageSettings, ReturnStep, RotatingShowcaseProduct, SiteSettings, SocialMedia,
+    TeamMember,
+)
+from .page_cache import page_tags_for, purge_page_tags
+from .promotions import bump_promotions_version
+from .ratings import apply_rating_change
+from .renditions import needs_renditions
+from .search import index_products, unindex_product
+from .singletons import SINGLETON_MODELS, invalidate_singleton
+from .stock import sync_product_stock
+from . import suggest, tasks
+
+
+def invalidate_singleton_cache(sender, **kwargs):
+    # Invalidate after commit so a concurrent request can't re-cache the old row
+    transaction.on_commit(partial(invalidate_singleton, SINGLETON_MODELS[sender]))
+
+
+for model in SINGLETON_MODELS:
+    post_save.connect(invalidate_singleton_cache, sender=model)
+    post_delete.connect(invalidate_singleton_cache, sender=model)
+
+
+# Keep the product search and suggestion indexes in step with the catalogue.
+# The search index is in the same database, so its writes share the save's
+# transaction.
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_products([instance])
+        # The suggestion index is in memory, so only show committed changes
+        transaction.on_commit(partial(suggest.index_product, instance))
+
+
+def unindex_deleted_product(sender, instance, **kwargs):
+    unindex_product(instance.pk)
+    transaction.on_commit(partial(suggest.remove_from_index, 'product', instance.pk))
+
+
+def reindex_category_products(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_products(instance.products.select_related('category'))
+        transaction.on_commit(partial(suggest.index_category, instance))
+
+
+def unindex_deleted_category(sender, instance, **kwargs):
+    transaction.on_commit(partial(suggest.remove_from_index, 'category', instance.pk))
+
+
+post_save.connect(index_saved_product, sender=Product)
+post_delete.connect(unindex_deleted_product, sender=Product)
+post_save.connect(reindex_category_products, sender=Category)
+post_delete.connect(unindex_deleted_category, sender=Category)
+
+
+def remove_deleted_review_rating(sender, instance, **kwargs):
+    # Use the stored state; the instance may have been edited before deletion
+    original = getattr(instance, '_original', instance._rating_state())
+    if original:
+        apply_rating_change(*original, -1)
+
+
+post_delete.connect(remove_deleted_review_rating, sender=ProductReview)
+
+
+# Cached facet counts are keyed on the catalogue version; bump it after any
+# change that can move a product between facets. Stock changes made by
+# checkout bump it from store.stock.
+def catalog_changed(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(bump_catalog_version)
+
+
+for model in (Product, ProductSize, Category):
+    post_save.connect(catalog_changed, sender=model)
+    post_delete.connect(catalog_changed, sender=model)
+
+
+# A product sold in sizes has as much stock as its sizes together, which
+# its combos follow
+def size_stock_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_product_stock([instance.product_id])
+        refresh_combos(product_ids=[instance.product_id])
+
+
+post_save.connect(size_stock_changed, sender=ProductSize)
+post_delete.connect(size_stock_changed, sender=ProductSize)
+
+
+# Resizing a camera photo takes a while, so new uploads are resized by a
+# worker. Pages show the upload until then.
+def queue_renditions(sender, instance, raw=False, **kwargs):
+    if not raw and needs_renditions(instance):
+        enqueue(tasks.make_renditions, [instance.pk])
+
+
+post_save.connect(queue_renditions, sender=ProductImage)
+
+
+# Combo prices and stock follow their products. Refreshed inside the save's
+# transaction so the combo never commits out of step with them.
+def combo_products_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_combos(combo_ids=[instance.combo_offer_id])
+
+
+def combo_changed(sender, instance, raw=False, **kwargs):
+    # The discount price may have changed; the refresh saves without signals
+    if not raw:
+        refresh_combos(combo_ids=[instance.pk])
+
+
+def combo_product_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_combos(product_ids=[instance.pk])
+
+
+post_save.connect(combo_products_changed, sender=ComboProduct)
+post_delete.connect(combo_products_changed, sender=ComboProduct)
+post_save.connect(combo_changed, sender=ComboOffer)
+post_save.connect(combo_product_changed, sender=Product)
+
+
+# The cached live offers and combos carry their products and images, so edits
+# to any of these start a new promotions version
+def promotions_changed(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(bump_promotions_version)
+
+
+for model in (Offer, ComboOffer, ComboProduct, Product, ProductImage):
+    post_save.connect(promotions_changed, sender=model)
+    post_delete.connect(promotions_changed, sender=model)
+
+
+# Purge the cached anonymous pages showing a changed row. Tags are worked out
+# now, while a deleted instance still has its pk.
+PAGE_CACHE_MODELS = (
+    Product, ProductImage, ProductSize, ProductReview, Category, Offer, ComboOffer, ComboProduct,
+    RotatingShowcaseProduct, SiteSettings, HeroSection, AboutSection, TeamMember, ContactPageSettings,
+    ContactInfo, SocialMedia, ReturnsPageSettings, PolicyPoint, ReturnStep, EligibilityItem, RefundMethod,
+    ReturnReason,
+)
+
+
+def purge_cached_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(partial(purge_page_tags, page_tags_for(instance)))
+
+
+for model in PAGE_CACHE_MODELS:
+    post_save.connect(purge_cached_pages, sender=model)
+    post_delete.connect(purge_cached_pages, sender=model)
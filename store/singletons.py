@@ -0,0 +1,90 @@
+# store/singletons.py
+import threading
+import time
+
+from django.core.cache import caches
+
+from .models import (
+    SiteSettings, HeroSection, AboutSection, ReturnsPageSettings, ContactPageSettings,
+)
+
+# Page-config rows that are edited rarely but read on every request.
+# Each entry maps the template context name to its model and loader.
+SINGLETONS = {
+    'sitesettings': (SiteSettings, lambda: SiteSettings.objects.first()),
+    'herosection': (HeroSection, lambda: HeroSection.objects.last()),
+    'about_section': (AboutSection, lambda: AboutSection.objects.filter(is_active=True).first()),
+    'page_settings': (ReturnsPageSettings, lambda: ReturnsPageSettings.objects.first()),
+    'contact_section': (ContactPageSettings, lambda: ContactPageSettings.objects.filter(is_active=True).first()),
+}
+
+SINGLETON_MODELS = {model: name for name, (model, loader) in SINGLETONS.items()}
+
+SINGLETONS_VERSION_KEY = 'store:singletons_version'
+
+_cache = {}
+_generations = {name: 0 for name in SINGLETONS}
+_lock = threading.Lock()
+
+
+def get_singletons_version():
+    """
+    Counter bumped whenever a singleton row changes. It lives in the 'shared'
+    cache, so an edit saved by one process reaches the copies every other
+    process keeps.
+    """
+    shared = caches['shared']
+    version = shared.get(SINGLETONS_VERSION_KEY)
+    if version is None:
+        shared.add(SINGLETONS_VERSION_KEY, int(time.time()), None)
+        version = shared.get(SINGLETONS_VERSION_KEY, 1)
+    return version
+
+
+def bump_singletons_version():
+    shared = caches['shared']
+    try:
+        shared.incr(SINGLETONS_VERSION_KEY)
+    except ValueError:
+        shared.add(SINGLETONS_VERSION_KEY, int(time.time()), None)
+
+
+def _load_singleton(name, version):
+    entry = _cache.get(name)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    model, loader = SINGLETONS[name]
+    generation = _generations[name]
+    value = loader()
+    with _lock:
+        # Don't store a row that was invalidated while we were loading it
+        if _generations[name] == generation:
+            _cache[name] = (version, value)
+    return value
+
+
+def get_singleton(name):
+    """Return the cached row for ``name``, reloading it when the shared version moves."""
+    return _load_singleton(name, get_singletons_version())
+
+
+def get_singletons():
+    version = get_singletons_version()
+    return {name: _load_singleton(name, version) for name in SINGLETONS}
+
+
+def _forget_singleton(name):
+    with _lock:
+        _generations[name] += 1
+        _cache.pop(name, None)
+
+
+def invalidate_singleton(name):
+    _forget_singleton(name)
+    bump_singletons_version()
+
+
+def clear_singletons():
+    for name in SINGLETONS:
+        _forget_singleton(name)
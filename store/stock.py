@@ -0,0 +1,152 @@
+# store/stock.py
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, PositiveIntegerField, Q, Subquery, Sum, When
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .combos import refresh_combos
+from .models import Order, Product, ProductSize
+from .page_cache import purge_product_pages
+
+
+class OutOfStock(Exception):
+    def __init__(self, product, size=None):
+        self.product = product
+        self.size = size
+        if size:
+            message = f"Sorry, {product.name} in size {size} is out of stock."
+        else:
+            message = f"Sorry, {product.name} is out of stock."
+        super().__init__(message)
+
+
+class _Shortage(Exception):
+    pass
+
+
+def sync_product_stock(product_ids):
+    """
+    Set the stock of those of ``product_ids`` sold in sizes to the sum of
+    their sizes. Products without sizes keep the count entered for them.
+    """
+    sizes = ProductSize.objects.filter(product=OuterRef('pk'))
+    total = sizes.order_by().values('product').annotate(total=Sum('stock_quantity')).values('total')
+    Product.objects.filter(Exists(sizes), pk__in=product_ids).update(stock_quantity=Subquery(total))
+
+
+def reserve_stock(lines):
+    """
+    Decrement stock for every cart line: the size's for lines with a size,
+    whose product total then follows the sizes, and the product's otherwise.
+
+    Each table gets one conditional UPDATE whose WHERE clause requires enough
+    stock on every row it touches, with the new value computed from F(), so
+    two buyers of the last unit can't both succeed and the query count doesn't
+    depend on the number of lines. Must run inside the order's transaction.
+    """
+    products = {}
+    size_quantities = {}
+    product_quantities = {}
+    for item_key, item in lines:
+        product = item['product']
+        products[product.id] = product
+        if item['size']:
+            key = (product.id, item['size'])
+            size_quantities[key] = size_quantities.get(key, 0) + item['quantity']
+        else:
+            product_quantities[product.id] = product_quantities.get(product.id, 0) + item['quantity']
+
+    _decrement(ProductSize, size_quantities, products)
+    _decrement(Product, {(product_id, None): quantity for product_id, quantity in product_quantities.items()}, products)
+    sync_product_stock({product_id for product_id, size in size_quantities})
+    refresh_combos(product_ids=list(products))
+    # A size may have sold out, which changes the size facet counts and the product's pages
+    transaction.on_commit(bump_catalog_version)
+    transaction.on_commit(partial(purge_product_pages, list(products)))
+
+
+def _decrement(model, quantities, products):
+    """Take stock from ``model`` rows keyed by (product_id, size); size is None for Product rows"""
+    if not quantities:
+        return
+
+    def row(product_id, size):
+        if model is ProductSize:
+            return Q(product_id=product_id, size=size)
+        return Q(pk=product_id)
+
+    enough_stock = Q()
+    for key, quantity in quantities.items():
+        enough_stock |= row(*key) & Q(stock_quantity__gte=quantity)
+    new_stock = Case(
+        *[When(row(*key), then=F('stock_quantity') - quantity) for key, quantity in quantities.items()],
+        default=F('stock_quantity'),
+        output_field=PositiveIntegerField(),
+    )
+
+    try:
+        # A savepoint lets us undo a partial update before reporting the short line
+        with transaction.atomic():
+            if model.objects.filter(enough_stock).update(stock_quantity=new_stock) != len(quantities):
+                raise _Shortage
+    except _Shortage:
+        for (product_id, size), quantity in quantities.items():
+            if not model.objects.filter(row(product_id, size), stock_quantity__gte=quantity).exists():
+                raise OutOfStock(products[product_id], size)
+        # Stock came back between the update and the check; report the first line
+        product_id, size = next(iter(quantities))
+        raise OutOfStock(products[product_id], size)
+
+
+def get_reservation_expiry(payment_method):
+    """Mobile payments are confirmed manually, so their stock is only held for a while"""
+    if payment_method == 'cash_on_delivery':
+        return None
+    return timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES)
+
+
+def release_stock(order):
+    """Return an order's stock to inventory. Safe to call more than once."""
+    with transaction.atomic():
+        locked = Order.objects.select_for_update().get(pk=order.pk)
+        if locked.stock_released:
+            return False
+
+        items = list(locked.items.all())
+        for item in items:
+            if item.size:
+                ProductSize.objects.filter(product_id=item.product_id, size=item.size).update(
+                    stock_quantity=F('stock_quantity') + item.quantity
+                )
+            else:
+                Product.objects.filter(pk=item.product_id).update(stock_quantity=F('stock_quantity') + item.quantity)
+        sync_product_stock({item.product_id for item in items if item.size})
+
+        Order.objects.filter(pk=order.pk).update(stock_released=True, reservation_expires_at=None)
+        refresh_combos(product_ids=[item.product_id for item in items])
+        transaction.on_commit(bump_catalog_version)
+        transaction.on_commit(partial(purge_product_pages, [item.product_id for item in items]))
+
+    # Keep the caller's instance in step so a later save() doesn't undo the flag
+    order.stock_released = True
+    order.reservation_expires_at = None
+    return True
+
+
+def release_expired_reservations():
+    """Cancel unpaid orders whose reservation has run out. Returns how many were cancelled."""
+    expired = Order.objects.filter(
+        payment_status='pending',
+        stock_released=False,
+        reservation_expires_at__lt=timezone.now(),
+    ).exclude(status='cancelled')
+
+    count = 0
+    for order in expired:
+        order.cancel()
+        count += 1
+    return count
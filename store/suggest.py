@@ -0,0 +1,317 @@
+# store/suggest.py
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.core.cache import caches
+from django.urls import reverse
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Only this much of each word goes into the prefix trie
+MAX_PREFIX = 12
+# Shortest query that gets suggestions; one letter matches half the catalogue
+MIN_QUERY_LENGTH = 2
+# Processes only see their own signals, so rebuild from the database now and then
+MAX_INDEX_AGE = 15 * 60
+# Bumped in the 'shared' cache by invalidate_index() to have every process rebuild
+SUGGEST_VERSION_KEY = 'store:suggest_version'
+
+
+def normalize(text):
+    """Lowercase and drop accents so 'Jutá' and 'juta' look the same"""
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text).replace('_', ' '))
+
+
+def trigrams(words):
+    """Trigrams of each word padded the way pg_trgm pads them"""
+    grams = set()
+    for word in words:
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SuggestIndex:
+    """
+    In-memory autocomplete over product and category names and slugs.
+
+    Words are stored in a prefix trie whose nodes hold the keys of every
+    entry with a word starting there, so a prefix lookup is a walk of a few
+    dicts. Each node also caches its best entries, which keeps short, popular
+    prefixes as cheap as long ones. A query word with no prefix match,
+    usually a typo or a different transliteration, is swapped for the
+    closest known words using a trigram index over the vocabulary.
+    """
+
+    # Best entries cached per trie node, enough for any single-word request
+    TOP_SIZE = 20
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._rank = {}
+        self._words = {}
+        self._trie = {}
+        self._word_entries = {}
+        self._word_grams = {}
+        self.built_at = 0
+        self.version = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, label, slug='', weight=0, **data):
+        """Add or replace an entry; ``key`` is unique per entry, e.g. ('product', 42)"""
+        words = set(tokenize(label)) | set(tokenize(slug.replace('-', ' ')))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = dict(data, label=label, slug=slug)
+            # Higher weight first, then shorter names
+            self._rank[key] = weight * 1000 - len(label)
+            self._words[key] = words
+
+            for word in words:
+                node = self._trie
+                for char in word[:MAX_PREFIX]:
+                    node = node.setdefault(char, {})
+                    node.setdefault(None, set()).add(key)
+                    node.pop('top', None)
+                entries = self._word_entries.get(word)
+                if entries is None:
+                    entries = self._word_entries[word] = set()
+                    for gram in trigrams([word]):
+                        self._word_grams.setdefault(gram, set()).add(word)
+                entries.add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        if key not in self._entries:
+            return
+        for word in self._words.pop(key):
+            node = self._trie
+            for char in word[:MAX_PREFIX]:
+                node = node[char]
+                node[None].discard(key)
+                node.pop('top', None)
+            entries = self._word_entries[word]
+            entries.discard(key)
+            if not entries:
+                # Forget the word so typo matching doesn't offer it any more
+                del self._word_entries[word]
+                for gram in trigrams([word]):
+                    self._word_grams[gram].discard(word)
+        del self._entries[key]
+        del self._rank[key]
+
+    def _prefix_node(self, word):
+        node = self._trie
+        for char in word[:MAX_PREFIX]:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _matches(self, word):
+        """Keys of entries with a word starting with ``word``, or with a word close to it"""
+        node = self._prefix_node(word)
+        if node is not None:
+            matches = node[None]
+            if len(word) > MAX_PREFIX:
+                # The trie stops short of long words; check the rest directly
+                matches = {key for key in matches if any(w.startswith(word) for w in self._words[key])}
+            if matches:
+                return matches
+        matches = set()
+        for similar in self._similar_words(word):
+            matches |= self._word_entries[similar]
+        return matches
+
+    def _similar_words(self, word, threshold=0.25, limit=5):
+        """Known words most like ``word`` by trigram similarity, as pg_trgm measures it"""
+        grams = trigrams([word])
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._word_grams.get(gram, ()))
+        scored = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + len(trigrams([candidate])) - count)
+            if similarity >= threshold:
+                scored.append((similarity, candidate))
+        return [candidate for similarity, candidate in heapq.nlargest(limit, scored)]
+
+    def _top(self, node):
+        top = node.get('top')
+        if top is None:
+            top = node['top'] = heapq.nlargest(self.TOP_SIZE, node[None], key=self._rank.__getitem__)
+        return top
+
+    def suggest(self, query, limit=8):
+        """Best entries for ``query`` as (key, entry) pairs"""
+        words = tokenize(query)
+        if not words or len(''.join(words)) < MIN_QUERY_LENGTH:
+            return []
+
+        with self._lock:
+            if len(words) == 1 and limit <= self.TOP_SIZE and len(words[0]) <= MAX_PREFIX:
+                node = self._prefix_node(words[0])
+                if node is not None and node[None]:
+                    return [(key, self._entries[key]) for key in self._top(node)[:limit]]
+
+            matches = None
+            # Longest words first; they match the fewest entries
+            for word in sorted(words, key=len, reverse=True):
+                found = self._matches(word)
+                matches = found if matches is None else matches & found
+                if not matches:
+                    return []
+            keys = heapq.nlargest(limit, matches, key=self._rank.__getitem__)
+            return [(key, self._entries[key]) for key in keys]
+
+
+_index = None
+# Held while an index is being built, so only one thread builds at a time
+_build_lock = threading.Lock()
+# Changes seen while a build reads the database, replayed onto the new index
+_pending = None
+_pending_lock = threading.Lock()
+
+
+def build_index():
+    """Load every active product and category into a fresh index"""
+    from .models import Category, Product
+
+    index = SuggestIndex()
+    for pk, name, slug in Category.objects.filter(is_active=True).values_list('id', 'name', 'slug'):
+        index.add(('category', pk), name, slug, weight=2)
+    products = Product.objects.filter(is_active=True).values_list('id', 'name', 'slug', 'is_featured')
+    for pk, name, slug, is_featured in products.iterator(chunk_size=2000):
+        index.add(('product', pk), name, slug, weight=int(is_featured))
+    index.built_at = time.monotonic()
+    return index
+
+
+def get_index_version():
+    shared = caches['shared']
+    version = shared.get(SUGGEST_VERSION_KEY)
+    if version is None:
+        shared.add(SUGGEST_VERSION_KEY, int(time.time()), None)
+        version = shared.get(SUGGEST_VERSION_KEY, 1)
+    return version
+
+
+def _rebuild():
+    global _index, _pending
+    with _pending_lock:
+        _pending = []
+    try:
+        version = get_index_version()
+        index = build_index()
+        index.version = version
+        with _pending_lock:
+            for method, args in _pending:
+                getattr(index, method)(*args)
+            _index = index
+    finally:
+        with _pending_lock:
+            _pending = None
+
+
+def _rebuild_in_background():
+    from django.db import connection
+
+    try:
+        _rebuild()
+    finally:
+        connection.close()
+        _build_lock.release()
+
+
+def get_index():
+    """
+    The current index. Only the first call waits for a build; once the
+    index is older than MAX_INDEX_AGE, or invalidate_index() was called in
+    any process, one thread rebuilds it in the background while every
+    request keeps using the old one.
+    """
+    index = _index
+    if index is None:
+        with _build_lock:
+            if _index is None:
+                _rebuild()
+            return _index
+    stale = time.monotonic() - index.built_at > MAX_INDEX_AGE or index.version != get_index_version()
+    if stale and _build_lock.acquire(blocking=False):
+        try:
+            threading.Thread(target=_rebuild_in_background, daemon=True).start()
+        except RuntimeError:
+            _build_lock.release()
+    return index
+
+
+def reset_index():
+    global _index
+    # Wait for a rebuild under way, which would put its index back afterwards
+    with _build_lock:
+        _index = None
+
+
+def invalidate_index():
+    """Have every process rebuild its index, after bulk changes that send no signals"""
+    shared = caches['shared']
+    try:
+        shared.incr(SUGGEST_VERSION_KEY)
+    except ValueError:
+        shared.add(SUGGEST_VERSION_KEY, int(time.time()), None)
+    reset_index()
+
+
+def _edit(method, *args):
+    # Nothing to update until the first suggestion builds the index
+    with _pending_lock:
+        if _index is not None:
+            getattr(_index, method)(*args)
+        if _pending is not None:
+            _pending.append((method, args))
+
+
+def index_product(product):
+    if product.is_active:
+        _edit('add', ('product', product.pk), product.name, product.slug, int(product.is_featured))
+    else:
+        _edit('remove', ('product', product.pk))
+
+
+def index_category(category):
+    if category.is_active:
+        _edit('add', ('category', category.pk), category.name, category.slug, 2)
+    else:
+        _edit('remove', ('category', category.pk))
+
+
+def remove_from_index(kind, pk):
+    _edit('remove', (kind, pk))
+
+
+def get_suggestions(query, limit=8):
+    """Suggestions ready for JSON: type, label and a link"""
+    suggestions = []
+    for (kind, pk), entry in get_index().suggest(query, limit):
+        if kind == 'product':
+            url = reverse('product-desc', args=[entry['slug']])
+        else:
+            url = f"{reverse('search')}?{urlencode({'q': entry['label']})}"
+        suggestions.append({'type': kind, 'label': entry['label'], 'url': url})
+    return suggestions
@@ -0,0 +1,18 @@
+# store/tasks.py
+"""Work queued with jobs.queue.enqueue() to run outside the request"""
+from .models import ProductImage
+from .page_cache import purge_page_tags
+from .promotions import bump_promotions_version
+from .renditions import generate_renditions, needs_renditions
+
+
+def make_renditions(image_id):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    # Deleted, or replaced by another upload with its own job
+    if image is None or not needs_renditions(image):
+        return
+    if generate_renditions(image):
+        # Saved with update(), so drop the pages and combo cards showing the upload;
+        # the purge and the bump go through the 'shared' cache, which the web processes read
+        purge_page_tags(['productimage', f'product:{image.product_id}'])
+        bump_promotions_version()
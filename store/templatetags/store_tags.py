@@ -0,0 +1,69 @@
+# store/templatetags/store_tags.py
+from django import template
+from django.template.loader import render_to_string
+from django.utils.html import format_html, format_html_join
+
+from ..fragments import render_cards
+from ..page_cache import hole, is_capturing
+from ..renditions import rendition, srcset
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products):
+    """Render product cards, reusing cached markup for cards that haven't changed"""
+    return render_cards('product', products, context.get('csrf_token'))
+
+
+@register.simple_tag(takes_context=True)
+def combo_cards(context, combos):
+    return render_cards('combo', combos, context.get('csrf_token'))
+
+
+@register.simple_tag(takes_context=True)
+def page_hole(context, template_name, **kwargs):
+    """
+    A fragment that differs per visitor. Pages rendered for the anonymous
+    page cache get a marker instead, filled in for each visitor.
+    """
+    request = context.get('request')
+    if request is not None and is_capturing(request):
+        return hole(template_name, **kwargs)
+    return render_to_string(template_name, dict(context.flatten(), **kwargs))
+
+
+@register.simple_tag
+def responsive_image(image, preset='card', sizes='100vw', **attrs):
+    """
+    A lazily loaded <img> for a ProductImage. Once its renditions exist it is
+    wrapped in a <picture> offering WebP, and both formats get a srcset so
+    the browser downloads the width it will show; ``preset`` picks the
+    fallback src. Extra keyword arguments become attributes.
+    """
+    if image is None or not image.image:
+        return ''
+    attrs = dict({'loading': 'lazy', 'alt': image.alt_text}, **attrs)
+    fallback = rendition(image, preset)
+    if not fallback:
+        return format_html('<img src="{}"{}>', image.image.url, _attributes(attrs))
+
+    entry = image.renditions['presets'][preset]
+    attrs.update(width=entry['width'], height=entry['height'])
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        srcset(image, 'webp'), sizes,
+        image.image.storage.url(fallback), srcset(image, 'jpeg'), sizes, _attributes(attrs),
+    )
+
+
+@register.filter
+def rendition_url(image, preset):
+    """URL of an image's JPEG rendition, or of the upload until there is one"""
+    name = rendition(image, preset)
+    return image.image.storage.url(name) if name else image.image.url
+
+
+def _attributes(attrs):
+    return format_html_join('', ' {}="{}"', ((name.replace('_', '-'), value) for name, value in attrs.items()))
@@ -1,3 +1,1590 @@
-from django.test import TestCase
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.template import Context, Template
+from django.contrib.auth.models import User
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+
+from jobs.models import Job
+from jobs.queue import run_pending
+
+from .cart_utils import Cart
+from .catalog import CatalogFilters, compute_facets, get_facets
+from .discounts import evaluate_cart
+from .fragments import CSRF_PLACEHOLDER, get_card_stats, render_cards, reset_card_stats
+from .metrics import MetricsStore, paused
+from .models import (
+    Category, ComboOffer, ComboProduct, Offer, Order, OrderItem, Product, ProductImage, ProductReview, ProductSize,
+    SiteSettings,
+)
+from .order_utils import mark_orders_paid, next_order_number, place_order
+from .page_cache import CSRF_PLACEHOLDER as CSRF_PAGE_PLACEHOLDER, page_cache_key
+from .promotions import get_active_promotions, get_promotions_version
+from .ratings import recompute_ratings
+from .seeding import seed_catalog
+from .search import search_page, search_product_ids
+from .singletons import bump_singletons_version, clear_singletons, get_singleton, get_singletons
+from . import suggest
+from .suggest import SuggestIndex, reset_index
+from .stock import OutOfStock, release_expired_reservations, release_stock
+
+
+def create_products(count, category=None, **extra):
+    category = category or Category.objects.create(name='Sneakers', slug='sneakers')
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f'Runner {i}',
+            slug=f'runner-{category.slug}-{i}',
+            description='<p>Light running shoe</p>',
+            category=category,
+            price=Decimal('1500.00'),
+            stock_quantity=10,
+            **extra
+        )
+        ProductImage.objects.create(product=product, image=f'products/runner-{i}.jpg', is_primary=True)
+        ProductImage.objects.create(product=product, image=f'products/runner-{i}-side.jpg')
+        for size in ['40', '41', '42']:
+            ProductSize.objects.create(product=product, size=size, stock_quantity=0 if size == '40' else 5)
+        products.append(product)
+    return products
+
+
+class StoreTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['shared'].clear()
+        # Singletons are cached per process, so drop rows left over from other tests
+        clear_singletons()
+        get_singletons()
+
+
+class ProductCardQueryTests(StoreTestCase):
+    def assertListingQueries(self, url, num):
+        for count in (8, 50):
+            with self.subTest(url=url, products=count):
+                Product.objects.all().delete()
+                Category.objects.all().delete()
+                create_products(count, is_featured=True)
+                self.client.get(url)
+                with self.assertNumQueries(num):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_product_list_queries(self):
+        # page, sizes; the product count is cached
+        self.assertListingQueries(reverse('products'), 2)
+
+    def test_search_queries(self):
+        # page of the index, match count, results, sizes
+        self.assertListingQueries(reverse('search') + '?q=runner', 4)
+
+    @override_settings(PAGE_CACHE_SECONDS=0)
+    def test_homepage_queries(self):
+        # validators, featured, sizes, rotating showcase; promotions are cached
+        self.assertListingQueries(reverse('home'), 4)
+
+    def test_for_cards_annotations(self):
+        product = create_products(1)[0]
+        card = Product.objects.for_cards().get(pk=product.pk)
+        self.assertEqual(card.primary_image_url, '/media/products/runner-0.jpg')
+        self.assertEqual(card.first_available_size, '41')
+
+    def test_card_sizes_are_in_number_order(self):
+        product = create_products(1)[0]
+        product.sizes.all().delete()
+        for size in ['10', 'M', '9', '9.5', '11']:
+            ProductSize.objects.create(product=product, size=size, stock_quantity=3)
+        card = Product.objects.for_cards().get(pk=product.pk)
+        self.assertEqual(card.first_available_size, '9')
+        self.assertEqual([size.size for size in card.sizes.all()], ['9', '9.5', '10', '11', 'M'])
+
+
+
+class CardFragmentCacheTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_card_stats()
+        self.products = create_products(3)
+
+    def render(self, kind='product'):
+        if kind == 'combo':
+            combos = ComboOffer.objects.prefetch_related('comboproduct_set__product__images')
+            return render_cards('combo', combos, 'token-1')
+        return render_cards('product', Product.objects.for_cards(), 'token-1')
+
+    def test_cards_are_rendered_once(self):
+        first = self.render()
+        with self.assertNumQueries(2):
+            second = self.render()
+        self.assertEqual(first, second)
+        self.assertEqual(get_card_stats()['product'], {'hits': 3, 'misses': 3})
+
+    def test_each_visitor_gets_their_own_csrf_token(self):
+        self.render()
+        html = render_cards('product', Product.objects.for_cards(), 'token-2')
+        self.assertIn('value="token-2"', html)
+        self.assertNotIn('token-1', html)
+        self.assertNotIn(CSRF_PLACEHOLDER, html)
+
+    def test_changes_to_a_card_re_render_only_that_card(self):
+        self.render()
+        product = self.products[0]
+        product.name = 'Trail 0'
+        product.save()
+        self.assertIn('Trail 0', self.render())
+        self.assertEqual(get_card_stats()['product'], {'hits': 2, 'misses': 4})
+
+    def test_size_and_image_changes_re_render(self):
+        self.render()
+        # Stock updates don't touch the product row
+        ProductSize.objects.filter(product=self.products[0], size='41').update(stock_quantity=0)
+        ProductImage.objects.filter(product=self.products[1], is_primary=True).update(image='products/new.jpg')
+        html = self.render()
+        self.assertIn('/media/products/new.jpg', html)
+        self.assertEqual(get_card_stats()['product'], {'hits': 1, 'misses': 5})
+
+    def test_combo_cards(self):
+        now = timezone.now()
+        combo = ComboOffer.objects.create(
+            name='Pair deal', slug='pair-deal', description='Two pairs',
+            original_price=Decimal('3000'), discount_price=Decimal('2500'), discount_percentage=17,
+            stock_quantity=5, start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+        )
+        for product in self.products[:2]:
+            ComboProduct.objects.create(combo_offer=combo, product=product)
+        self.assertIn('Runner 1', self.render('combo'))
+        self.products[1].name = 'Trail 1'
+        self.products[1].save()
+        self.assertIn('Trail 1', self.render('combo'))
+        self.render('combo')
+        self.assertEqual(get_card_stats()['combo'], {'hits': 1, 'misses': 2})
+
+    def test_pages_use_the_cached_cards(self):
+        Product.objects.update(is_featured=True)
+        for url in (reverse('home'), reverse('products'), reverse('search') + '?q=runner'):
+            response = self.client.get(url)
+            self.assertContains(response, 'name="csrfmiddlewaretoken"', count=3)
+        self.assertEqual(get_card_stats()['product'], {'hits': 6, 'misses': 3})
+
+
+def make_upload(name='shoe.jpg', size=(1000, 750)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'teal').save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class RenditionTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.product = create_products(1)[0]
+        self.image = ProductImage.objects.create(product=self.product, image=make_upload(), is_primary=True)
+        # The upload is resized by a queued job
+        self.assertEqual(self.image.renditions, {})
+        run_pending()
+        self.image.refresh_from_db()
+
+    def test_saving_an_upload_makes_its_renditions(self):
+        presets = self.image.renditions['presets']
+        self.assertEqual({preset: entry['width'] for preset, entry in presets.items()},
+                         {'admin': 160, 'card': 480, 'detail': 960, 'zoom': 1000})
+        self.assertEqual(presets['card']['height'], 360)
+        storage = self.image.image.storage
+        for entry in presets.values():
+            self.assertRegex(entry['webp'], r'^renditions/shoe-\d+w-[0-9a-f]{12}\.webp$')
+            self.assertTrue(storage.exists(entry['webp']) and storage.exists(entry['jpeg']))
+        self.assertLess(storage.size(presets['card']['webp']), self.image.image.size)
+
+        self.image.alt_text = 'Teal runner'
+        self.image.save()
+        self.assertFalse(Job.objects.filter(status='queued').exists())
+
+    def test_responsive_image_tag(self):
+        render = Template("{% load store_tags %}{% responsive_image image 'card' sizes='50vw' class='w-full' %}").render
+        html = render(Context({'image': self.image}))
+        self.assertIn('<source type="image/webp" srcset="/media/renditions/shoe-160w-', html)
+        self.assertIn(' 960w, /media/renditions/shoe-1000w-', html)
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn('width="480" height="360"', html)
+        self.assertIn('class="w-full"', html)
+
+        self.image.renditions = {}
+        self.assertEqual(render(Context({'image': self.image})),
+                         f'<img src="{self.image.image.url}" loading="lazy" alt="" class="w-full">')
+
+    def test_product_cards_use_the_renditions(self):
+        self.product.images.exclude(pk=self.image.pk).delete()
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, '<picture><source type="image/webp"', count=1)
+
+    def test_generate_renditions_command(self):
+        ProductImage.objects.update(renditions={})
+        version = get_promotions_version()
+        out = StringIO()
+        call_command('generate_renditions', workers=2, stdout=out, stderr=StringIO())
+        # The purge and the promotions bump go to the cache every process reads
+        self.assertEqual(caches['shared'].get('store:promotions_version'), version + 1)
+        self.assertTrue(caches['shared'].get(f'store:page-tag:product:{self.product.pk}'))
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.renditions['source'], self.image.image.name)
+        # The test products point at files that don't exist
+        self.assertIn('Made renditions for 1 image(s)', out.getvalue())
+        self.assertIn('2 failed', out.getvalue())
+        self.assertIn('product list page of 8 cards', out.getvalue())
+
+
+class AnonymousPageCacheTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product, self.other = create_products(2, is_featured=True)
+
+    def detail_url(self, product):
+        return reverse('product-desc', args=[product.slug])
+
+    def test_second_visit_is_served_without_queries(self):
+        first = self.client.get(reverse('home'))
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = Client().get(reverse('home'))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Runner 0')
+
+    def test_logged_in_visitors_bypass_the_cache(self):
+        user = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.get(reverse('home'))
+        self.client.force_login(user)
+        self.assertNotIn('X-Page-Cache', self.client.get(reverse('home')))
+
+    def test_each_visitor_gets_a_working_csrf_token(self):
+        self.client.get(self.detail_url(self.product))
+        visitor = Client(enforce_csrf_checks=True)
+        response = visitor.get(self.detail_url(self.product))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, CSRF_PAGE_PLACEHOLDER)
+        token = re.search(rb'name="csrfmiddlewaretoken" value="([^"]+)"', response.content).group(1).decode()
+        response = visitor.post(reverse('add_review', args=[self.product.slug]), {
+            'csrfmiddlewaretoken': token, 'customer_name': 'Rina', 'comment': 'Comfy', 'rating': 5,
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_messages_and_cart_are_per_visitor(self):
+        Client().get(reverse('contact'))
+        Client().get(reverse('home'))
+        response = self.client.post(reverse('contact'), {
+            'name': 'Rina', 'email': 'rina@example.com', 'phone': '01700000000', 'subject': 'general',
+            'message': 'Hello',
+        }, follow=True)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Your message has been sent successfully!')
+        self.assertNotContains(self.client.get(reverse('contact')), 'Your message has been sent successfully!')
+
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': 1, 'size': '41'})
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertRegex(response.content.decode(), r'cart-count">\s*1\s*</span>')
+        self.assertRegex(Client().get(reverse('home')).content.decode(), r'cart-count">\s*0\s*</span>')
+
+    def test_a_change_purges_only_the_pages_showing_it(self):
+        for product in (self.product, self.other):
+            self.client.get(self.detail_url(product))
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.create(product=self.product, size='43', stock_quantity=2)
+        self.assertEqual(self.client.get(self.detail_url(self.product))['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(self.detail_url(self.other))['X-Page-Cache'], 'hit')
+
+        self.client.get(reverse('about'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.name = 'Trail 1'
+            self.other.save()
+        self.assertEqual(self.client.get(reverse('about'))['X-Page-Cache'], 'hit')
+        self.assertContains(self.client.get(self.detail_url(self.other)), 'Trail 1')
+
+    def test_related_category_and_combo_changes_purge_detail_pages(self):
+        self.client.get(self.detail_url(self.product))
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Sandals', slug='sandals')
+        self.assertEqual(self.client.get(self.detail_url(self.product))['X-Page-Cache'], 'hit')
+        with self.captureOnCommitCallbacks(execute=True):
+            category = self.product.category
+            category.is_active = False
+            category.save()
+        self.assertEqual(self.client.get(self.detail_url(self.product))['X-Page-Cache'], 'miss')
+
+        combo = ComboOffer.objects.create(
+            name='Pair deal', slug='pair-deal', description='Two pairs',
+            original_price=Decimal('3000'), discount_price=Decimal('2500'), discount_percentage=17,
+            stock_quantity=5, start_date=timezone.now(), end_date=timezone.now() + timedelta(days=5),
+        )
+        self.client.get(self.detail_url(self.product))
+        with self.captureOnCommitCallbacks(execute=True):
+            ComboProduct.objects.create(combo_offer=combo, product=self.product)
+        self.assertEqual(self.client.get(self.detail_url(self.product))['X-Page-Cache'], 'miss')
+
+    def test_purges_from_other_processes_are_seen(self):
+        self.client.get(self.detail_url(self.product))
+        # What purge_page_tags() in a worker or another web process leaves behind
+        caches['shared'].set(f'store:page-tag:product:{self.product.pk}', time.time(), None)
+        self.assertEqual(self.client.get(self.detail_url(self.product))['X-Page-Cache'], 'miss')
+
+    def test_only_whitelisted_query_params_make_new_entries(self):
+        self.client.get(reverse('home'))
+        for query in ({'utm_source': 'fb'}, {'x': '1'}, {'x': '2'}):
+            self.assertEqual(self.client.get(reverse('home'), query)['X-Page-Cache'], 'hit')
+
+        factory = RequestFactory()
+        key = page_cache_key(factory.get('/products/', {'sort': 'new', 'page': '2'}), ('page', 'sort'))
+        self.assertEqual(key, page_cache_key(factory.get('/products/?utm=1&page=2&sort=new'), ('page', 'sort')))
+        self.assertNotEqual(key, page_cache_key(factory.get('/products/', {'sort': 'new', 'page': '3'}), ('page', 'sort')))
+        self.assertEqual(page_cache_key(factory.get('/products/?page=2')), page_cache_key(factory.get('/products/')))
+
+    def test_pages_showing_offers_expire_when_one_starts(self):
+        starts = timezone.now() + timedelta(minutes=5)
+        Offer.objects.create(
+            title='Eid sale', slug='eid-sale', offer_type='summer_sale',
+            start_date=starts, end_date=starts + timedelta(days=10),
+        )
+        self.client.get(reverse('home'))
+        self.client.get(self.detail_url(self.product))
+        home = cache.get(page_cache_key(RequestFactory().get(reverse('home'))))
+        detail = cache.get(page_cache_key(RequestFactory().get(self.detail_url(self.product))))
+        self.assertEqual(home['expires_at'], starts.timestamp())
+        self.assertGreater(detail['expires_at'], starts.timestamp())
+
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=1, REQUEST_METRICS_SERVER_TIMING=True)
+class RequestMetricsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        create_products(3)
+
+    def timing(self, response):
+        """Server-Timing as {name: (dur, desc)}"""
+        return {
+            name: (dur, desc)
+            for name, dur, desc in re.findall(r'(\w+)(?:;dur=([\d.]+))?(?:;desc="([^"]*)")?', response['Server-Timing'])
+        }
+
+    def test_queries_templates_and_cache_are_reported(self):
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('store.requests', 'INFO') as logs:
+            response = self.client.get(reverse('home'))
+        timing = self.timing(response)
+        self.assertEqual(timing['db'][1], f'{len(queries)} queries')
+        self.assertGreater(float(timing['tpl'][0]), 0)
+        self.assertGreater(float(timing['total'][0]), float(timing['db'][0]))
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['view'], line['status'], line['queries']), ('home', 200, len(queries)))
+        self.assertGreater(line['cache_misses'], 0)
+
+        with self.assertLogs('store.requests', 'INFO') as logs:
+            response = Client().get(reverse('home'))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['page_cache'], line['queries']), ('hit', 0))
+        self.assertGreater(line['cache_hits'], 0)
+        self.assertIn(f'{line["cache_hits"]} hits', response['Server-Timing'])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_requests_outside_the_sample_are_not_measured(self):
+        with self.assertNoLogs('store.requests', 'INFO'):
+            response = self.client.get(reverse('home'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REQUEST_METRICS_SERVER_TIMING=False)
+    def test_server_timing_header_can_be_left_out(self):
+        with self.assertLogs('store.requests', 'INFO'):
+            response = self.client.get(reverse('home'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class PrometheusMetricsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_products(1)[0]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(METRICS_DIR=self.directory, METRICS_TOKEN='s3cret'))
+        self.enterContext(mock.patch('store.metrics._store', MetricsStore()))
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return dict(
+            line.rsplit(' ', 1) for line in response.content.decode().splitlines() if not line.startswith('#')
+        )
+
+    def test_storefront_and_checkout_are_counted(self):
+        Client().get(reverse('home'))
+        Client().get(reverse('home'))
+        self.client.get(reverse('search'), {'q': 'runner'})
+        self.client.get(reverse('search_suggest'), {'q': 'run'})
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': 1, 'size': '41'})
+        self.client.get(reverse('remove_from_cart_with_size', args=[self.product.id, '41']))
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(make_cart(self.product), shipping_cost=60, payment_method='bkash', **ORDER_FIELDS)
+
+        metrics = self.scrape()
+        self.assertEqual(metrics['store_request_duration_seconds_count{view="home"}'], '2')
+        self.assertEqual(metrics['store_request_duration_seconds_bucket{view="home",le="+Inf"}'], '2')
+        self.assertEqual(metrics['store_search_queries_total{kind="search"}'], '1')
+        self.assertEqual(metrics['store_search_queries_total{kind="suggest"}'], '1')
+        self.assertEqual(metrics['store_cart_changes_total{action="add"}'], '2')
+        self.assertEqual(metrics['store_cart_changes_total{action="remove"}'], '1')
+        self.assertEqual(metrics['store_orders_created_total{payment_method="bkash"}'], '1')
+        self.assertEqual(metrics['store_cache_requests_total{cache="page",result="hit"}'], '1')
+        self.assertEqual(metrics['store_cache_hit_ratio{cache="page"}'], '0.5')
+
+    def test_other_processes_are_added_in(self):
+        self.client.get(reverse('search'), {'q': 'runner'})
+        other_worker = MetricsStore()
+        other_worker.inc('store_search_queries_total', 2, (('kind', 'search'),))
+        other_worker.observe('store_request_duration_seconds', 0.2, (('view', 'search'),))
+        other_worker.flush()
+
+        metrics = self.scrape()
+        self.assertEqual(metrics['store_search_queries_total{kind="search"}'], '3')
+        self.assertEqual(metrics['store_request_duration_seconds_count{view="search"}'], '2')
+        self.assertEqual(metrics['store_request_duration_seconds_bucket{view="search",le="0.25"}'], '2')
+
+    def test_files_of_exited_processes_are_retired(self):
+        exited = MetricsStore()
+        exited.inc('store_search_queries_total', 2, (('kind', 'search'),))
+        exited.flush()
+        MetricsStore().flush()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        with mock.patch('store.metrics._pid_alive', return_value=False):
+            self.assertEqual(self.scrape()['store_search_queries_total{kind="search"}'], '2')
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.json')], ['retired.json'])
+        self.client.get(reverse('search'), {'q': 'runner'})
+        self.assertEqual(self.scrape()['store_search_queries_total{kind="search"}'], '3')
+
+    def test_scrapes_without_fcntl_keep_every_file(self):
+        exited = MetricsStore()
+        exited.inc('store_search_queries_total', 2, (('kind', 'search'),))
+        exited.flush()
+        # As on Windows: no flock, and no pid checks, since os.kill() there ends the process
+        with mock.patch.dict('sys.modules', {'fcntl': None}), \
+                mock.patch('store.metrics._pid_alive', side_effect=AssertionError):
+            self.assertEqual(self.scrape()['store_search_queries_total{kind="search"}'], '2')
+        self.assertNotIn('retired.json', os.listdir(self.directory))
+
+    def test_paused_recording(self):
+        with paused():
+            self.client.get(reverse('search'), {'q': 'runner'})
+        self.assertNotIn('store_search_queries_total{kind="search"}', self.scrape())
+
+    def test_forked_children_get_a_new_lock(self):
+        store = MetricsStore()
+        with store.lock:
+            # What os.fork() runs in the child
+            store._reset()
+        with store.lock:
+            self.assertEqual(store.counters, {})
+
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer nope'}).status_code, 403)
+        self.assertIn('# TYPE store_orders_created_total counter', self.client.get(
+            reverse('metrics'), headers={'Authorization': 'Bearer s3cret'},
+        ).content.decode())
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+@override_settings(PAGE_CACHE_SECONDS=0)
+class ConditionalGetTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_products(1, is_featured=True)[0]
+        self.url = reverse('product-desc', args=[self.product.slug])
+
+    def etag(self, url=None):
+        return self.client.get(url or self.url)['ETag']
+
+    def test_unchanged_pages_get_a_304_from_one_query(self):
+        urls = [reverse(name) for name in ('home', 'offers', 'about', 'contact', 'return')] + [self.url]
+        # The first visit sets the CSRF cookie, which the ETag covers
+        self.client.get(self.url)
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(1):
+                    response = self.client.get(url, headers={'if-none-match': response['ETag']})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+
+    def test_if_modified_since_alone_never_gets_a_304(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('Last-Modified', response)
+        since = http_date(time.time() + 60)
+        # Deleting a row leaves the newest updated_at where it was
+        ProductImage.objects.filter(product=self.product, is_primary=False).delete()
+        response = self.client.get(self.url, headers={'if-modified-since': since})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'runner-0-side.jpg')
+
+    def test_changes_that_skip_updated_at_still_change_the_etag(self):
+        etag = self.etag()
+        ProductSize.objects.filter(product=self.product, size='41').update(stock_quantity=0)
+        self.assertNotEqual(self.etag(), etag)
+
+        etag = self.etag()
+        ProductReview.objects.create(product=self.product, customer_name='Rina', comment='Comfy', rating=5)
+        self.assertEqual(self.etag(), etag)
+        ProductReview.objects.update(is_approved=True)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_an_offer_starting_changes_the_home_page(self):
+        now = timezone.now()
+        offer = Offer.objects.create(
+            title='Eid sale', slug='eid-sale', offer_type='summer_sale',
+            start_date=now + timedelta(hours=1), end_date=now + timedelta(days=10),
+        )
+        etag = self.etag(reverse('home'))
+        # As if an hour had passed
+        Offer.objects.filter(pk=offer.pk).update(start_date=now - timedelta(minutes=1))
+        self.assertNotEqual(self.etag(reverse('home')), etag)
+
+    def test_visitor_state_is_part_of_the_etag(self):
+        etag = self.etag()
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': 1, 'size': '41'})
+        self.assertNotEqual(self.etag(), etag)
+
+        etag = self.etag(reverse('contact'))
+        self.client.post(reverse('contact'), {
+            'name': 'Rina', 'email': 'rina@example.com', 'phone': '01700000000', 'subject': 'general',
+            'message': 'Hello',
+        })
+        response = self.client.get(reverse('contact'), headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    @override_settings(PAGE_CACHE_SECONDS=600)
+    def test_cached_pages_revalidate_without_queries(self):
+        etag = self.etag()
+        with self.assertNumQueries(0):
+            response = Client().get(self.url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+
+class SingletonCacheTests(StoreTestCase):
+    def test_rows_are_loaded_once_per_version(self):
+        SiteSettings.objects.create(site_name='Mayaj')
+        clear_singletons()
+        get_singleton('sitesettings')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_singleton('sitesettings').site_name, 'Mayaj')
+
+    def test_change_saved_elsewhere_reaches_this_process(self):
+        settings_row = SiteSettings.objects.create(site_name='Mayaj')
+        clear_singletons()
+        self.assertEqual(get_singleton('sitesettings').site_name, 'Mayaj')
+        # Another process saves the row: no signal runs here, only the
+        # shared version moves
+        SiteSettings.objects.filter(pk=settings_row.pk).update(site_name='Mayaj Shoes')
+        bump_singletons_version()
+        self.assertEqual(get_singleton('sitesettings').site_name, 'Mayaj Shoes')
+
+    def test_save_bumps_shared_version_on_commit(self):
+        settings_row = SiteSettings.objects.create(site_name='Mayaj')
+        clear_singletons()
+        get_singleton('sitesettings')
+        settings_row.site_name = 'Mayaj Shoes'
+        with self.captureOnCommitCallbacks(execute=True):
+            settings_row.save()
+        self.assertEqual(get_singleton('sitesettings').site_name, 'Mayaj Shoes')
+
+
+class PromotionCacheTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.offer = Offer.objects.create(
+            title='Eid sale', slug='eid-sale', offer_type='summer_sale',
+            start_date=self.now - timedelta(days=1), end_date=self.now + timedelta(days=10),
+        )
+        self.upcoming = Offer.objects.create(
+            title='Winter sale', slug='winter-sale', offer_type='winter_sale',
+            start_date=self.now + timedelta(days=2), end_date=self.now + timedelta(days=3),
+        )
+        self.combo = ComboOffer.objects.create(
+            name='Pair deal', slug='pair-deal', description='Two pairs',
+            original_price=Decimal('3000'), discount_price=Decimal('2500'), discount_percentage=17,
+            stock_quantity=5, start_date=self.now - timedelta(days=1), end_date=self.now + timedelta(days=20),
+        )
+        self.products = create_products(2)
+        for product in self.products:
+            ComboProduct.objects.create(combo_offer=self.combo, product=product)
+
+    def at(self, moment):
+        return mock.patch('store.promotions.timezone.now', return_value=moment)
+
+    def test_cached_until_the_next_boundary(self):
+        with self.at(self.now):
+            promotions = get_active_promotions()
+        self.assertEqual(promotions.offers, [self.offer])
+        self.assertEqual(promotions.combos, [self.combo])
+        self.assertEqual(promotions.valid_until, self.upcoming.start_date)
+
+        with self.at(self.now + timedelta(days=1)), self.assertNumQueries(0):
+            promotions = get_active_promotions()
+            self.assertEqual(len(promotions.combos[0].comboproduct_set.all()[0].product.images.all()), 2)
+
+        with self.at(self.upcoming.start_date + timedelta(seconds=1)):
+            promotions = get_active_promotions()
+        # Latest start first
+        self.assertEqual(promotions.offers, [self.upcoming, self.offer])
+        self.assertEqual(promotions.offers[0].badge_text, 'Ending Soon')
+        self.assertEqual(promotions.valid_until, self.upcoming.end_date)
+
+    def test_cached_combos_are_active_without_reading_the_clock(self):
+        with self.at(self.now):
+            promotions = get_active_promotions()
+        with mock.patch('store.models.timezone.now') as now:
+            self.assertTrue(promotions.combos[0].is_active_now)
+        now.assert_not_called()
+        self.assertFalse(self.combo.is_currently_active(self.combo.end_date + timedelta(seconds=1)))
+        self.assertTrue(self.offer.is_currently_active(self.now))
+
+    def test_an_offer_is_shown_until_its_end(self):
+        with self.at(self.upcoming.end_date - timedelta(hours=1)):
+            self.assertIn(self.upcoming, get_active_promotions().offers)
+        with self.at(self.upcoming.end_date + timedelta(seconds=1)):
+            self.assertNotIn(self.upcoming, get_active_promotions().offers)
+
+    def test_edits_start_a_new_version(self):
+        get_active_promotions()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].stock_quantity = 0
+            self.products[0].save()
+        self.assertEqual(get_active_promotions().combos, [])
+
+
+class SearchTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Sneakers', slug='sneakers')
+        self.loafer = self.make('Leather Loafer', '<p class="lead">Hand <strong>stitched</strong> &amp; polished</p>')
+        self.runner = self.make('Trail Runner', '<p>Grippy sole for a leather-free loafer alternative</p>')
+
+    def make(self, name, description, **extra):
+        return Product.objects.create(
+            name=name, slug=name.lower().replace(' ', '-'), description=description,
+            category=self.category, price=Decimal('1500.00'), **extra
+        )
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(search_product_ids('loafer'), [self.loafer.pk, self.runner.pk])
+
+    def test_description_markup_is_not_indexed(self):
+        self.assertEqual(search_product_ids('stitched polished'), [self.loafer.pk])
+        self.assertEqual(search_product_ids('lead'), [])
+        self.assertEqual(search_product_ids('strong'), [])
+
+    def test_last_word_matches_as_a_prefix(self):
+        self.assertEqual(search_product_ids('trail run'), [self.runner.pk])
+        self.assertEqual(search_product_ids('"run*('), [self.runner.pk])
+
+    def test_index_follows_product_and_category_changes(self):
+        self.runner.is_active = False
+        self.runner.save()
+        self.assertEqual(search_product_ids('loafer'), [self.loafer.pk])
+
+        self.category.name = 'Formal Shoes'
+        self.category.save()
+        self.assertEqual(search_product_ids('formal'), [self.loafer.pk])
+
+        self.loafer.delete()
+        self.assertEqual(search_product_ids('loafer'), [])
+
+    def test_empty_query_returns_nothing(self):
+        self.make('Hidden Boot', '<p>Boot</p>', is_active=False)
+        response = self.client.get(reverse('search'), {'q': '  '})
+        self.assertEqual(response.context['products'], [])
+        self.assertEqual(response.context['results_count'], 0)
+
+    def test_results_are_paginated(self):
+        for i in range(15):
+            self.make(f'Canvas Loafer {i}', '<p>Canvas</p>')
+        first = self.client.get(reverse('search'), {'q': 'loafer'}).context['page_obj']
+        response = self.client.get(reverse('search'), {'q': 'loafer', 'after': first.next_cursor})
+        self.assertEqual(response.context['results_count'], 17)
+        self.assertEqual(len(response.context['products']), 5)
+
+    def test_pages_walk_the_ranking_both_ways(self):
+        # Equal scores are ordered by id, so ties don't repeat or skip across pages
+        for i in range(25):
+            self.make(f'Canvas Loafer {i:02}', '<p>Canvas</p>')
+        ranked = search_product_ids('loafer')
+        pages = [search_page('loafer', 10)]
+        while pages[-1].has_next:
+            pages.append(search_page('loafer', 10, after=pages[-1].next_cursor))
+        self.assertEqual([pk for page in pages for pk in page], ranked)
+        self.assertEqual([len(page) for page in pages], [10, 10, 7])
+
+        back = search_page('loafer', 10, before=pages[-1].previous_cursor)
+        self.assertEqual(back.object_list, pages[1].object_list)
+        first = search_page('loafer', 10, before=back.previous_cursor)
+        self.assertEqual(first.object_list, pages[0].object_list)
+        self.assertFalse(first.has_previous)
+
+    def test_rebuild_command(self):
+        Product.objects.filter(pk=self.runner.pk).update(name='Road Racer')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search_product_ids('racer'), [self.runner.pk])
+
+
+
+class SuggestTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_index()
+        self.category = Category.objects.create(name='Chappals', slug='chappals')
+        self.product = Product.objects.create(
+            name='Kolhapuri Chappal', slug='kolhapuri-chappal', description='<p>Leather</p>',
+            category=self.category, price=Decimal('900.00'),
+        )
+
+    def suggest(self, query):
+        return self.client.get(reverse('search_suggest'), {'q': query}).json()['suggestions']
+
+    def test_prefix_suggestions_without_queries(self):
+        self.suggest('warm up')
+        with self.assertNumQueries(0):
+            suggestions = self.suggest('kolh')
+        self.assertEqual(suggestions, [
+            {'type': 'product', 'label': 'Kolhapuri Chappal', 'url': reverse('product-desc', args=['kolhapuri-chappal'])},
+        ])
+        self.assertEqual([s['label'] for s in self.suggest('chap')], ['Chappals', 'Kolhapuri Chappal'])
+
+    def test_misspellings_fall_back_to_similar_words(self):
+        self.assertEqual([s['label'] for s in self.suggest('kolapuri')], ['Kolhapuri Chappal'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.suggest('warm up')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Peshawari Chappal'
+            self.product.slug = 'peshawari-chappal'
+            self.product.save()
+        self.assertEqual(self.suggest('kolh'), [])
+        self.assertEqual([s['label'] for s in self.suggest('pesh')], ['Peshawari Chappal'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.is_active = False
+            self.product.save()
+        self.assertEqual(self.suggest('pesh'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.delete()
+        self.assertEqual(self.suggest('chap'), [])
+
+    def test_stale_index_is_served_while_it_rebuilds(self):
+        self.suggest('warm up')
+        stale = suggest.get_index()
+        stale.built_at -= suggest.MAX_INDEX_AGE + 1
+        building = threading.Event()
+        release = threading.Event()
+
+        def slow_build():
+            index = SuggestIndex()
+            index.add(('product', self.product.pk), 'Kolhapuri Chappal', 'kolhapuri-chappal')
+            index.built_at = time.monotonic()
+            building.set()
+            release.wait(5)
+            return index
+
+        with mock.patch('store.suggest.build_index', slow_build):
+            self.assertEqual([s['label'] for s in self.suggest('kolh')], ['Kolhapuri Chappal'])
+            self.assertTrue(building.wait(5))
+            # Requests don't wait, and changes made meanwhile reach the new index
+            self.assertIs(suggest.get_index(), stale)
+            self.product.name = 'Peshawari Chappal'
+            self.product.slug = 'peshawari-chappal'
+            suggest.index_product(self.product)
+            release.set()
+            with suggest._build_lock:
+                pass
+        self.assertIsNot(suggest.get_index(), stale)
+        self.assertEqual(self.suggest('kolh'), [])
+        self.assertEqual([s['label'] for s in self.suggest('pesh')], ['Peshawari Chappal'])
+
+    def test_invalidation_from_another_process_is_picked_up(self):
+        stale = suggest.get_index()
+        # What invalidate_index() in a command or another web process leaves behind
+        caches['shared'].incr(suggest.SUGGEST_VERSION_KEY)
+        with mock.patch('store.suggest.build_index', SuggestIndex):
+            self.assertIs(suggest.get_index(), stale)
+            with suggest._build_lock:
+                pass
+        self.assertIsNot(suggest.get_index(), stale)
+
+    def test_index_ranks_weight_then_length(self):
+        index = SuggestIndex()
+        index.add(('product', 1), 'Runner Lite Extra', weight=0)
+        index.add(('product', 2), 'Runner', weight=0)
+        index.add(('product', 3), 'Trail Runner Pro', weight=1)
+        self.assertEqual([key for key, entry in index.suggest('run')], [('product', 3), ('product', 2), ('product', 1)])
+        index.remove(('product', 3))
+        self.assertEqual([key for key, entry in index.suggest('run')], [('product', 2), ('product', 1)])
+
+
+
+class RatingTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_products(1)[0]
+
+    def review(self, rating, is_approved=True):
+        return ProductReview.objects.create(
+            product=self.product, customer_name='Karim', title='Nice', comment='Fits well',
+            rating=rating, is_approved=is_approved,
+        )
+
+    def totals(self):
+        self.product.refresh_from_db()
+        return self.product.rating_count, self.product.rating_sum, self.product.average_rating
+
+    def test_totals_follow_approval_edits_and_deletes(self):
+        self.review(5)
+        pending = self.review(2, is_approved=False)
+        self.assertEqual(self.totals(), (1, 5, Decimal('5.00')))
+
+        pending = ProductReview.objects.get(pk=pending.pk)
+        pending.is_approved = True
+        pending.save()
+        self.assertEqual(self.totals(), (2, 7, Decimal('3.50')))
+
+        pending.rating = 3
+        pending.save()
+        self.assertEqual(self.totals(), (2, 8, Decimal('4.00')))
+        self.assertEqual(self.product.rating_histogram, {5: 1, 4: 0, 3: 1, 2: 0, 1: 0})
+
+        pending.delete()
+        ProductReview.objects.filter(is_approved=False).delete()
+        self.assertEqual(self.totals(), (1, 5, Decimal('5.00')))
+
+        ProductReview.objects.all().delete()
+        self.assertEqual(self.totals(), (0, 0, Decimal('0.00')))
+
+    def test_saving_a_stale_product_keeps_new_reviews(self):
+        review = self.review(4, is_approved=False)
+        product = Product.objects.get(pk=self.product.pk)
+        review.is_approved = True
+        review.save()
+        product.price = Decimal('1400.00')
+        product.save()
+        self.assertEqual(self.totals(), (1, 4, Decimal('4.00')))
+        self.assertEqual(self.product.price, Decimal('1400.00'))
+
+    def test_unchanged_save_skips_the_update(self):
+        review = ProductReview.objects.get(pk=self.review(4).pk)
+        review.title = 'Very nice'
+        with self.assertNumQueries(1):
+            review.save()
+
+    def test_recompute_repairs_bulk_updates(self):
+        self.review(4, is_approved=False)
+        self.review(1, is_approved=False)
+        ProductReview.objects.update(is_approved=True)
+        self.assertEqual(self.totals(), (0, 0, Decimal('0.00')))
+
+        call_command('recompute_ratings', stdout=StringIO())
+        self.assertEqual(self.totals(), (2, 5, Decimal('2.50')))
+        self.assertEqual(self.product.rating_1_count, 1)
+        self.assertEqual(self.product.get_average_rating(), Decimal('2.5'))
+
+
+
+class ReviewFeedTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_products(1)[0]
+
+    def add_reviews(self, count, is_approved=True):
+        ProductReview.objects.bulk_create([
+            ProductReview(
+                product=self.product, customer_name=f'Customer {i}', title='', comment='Good',
+                rating=4, is_approved=is_approved,
+            )
+            for i in range(count)
+        ])
+
+    def test_load_more_walks_every_review_once(self):
+        self.add_reviews(25)
+        # Identical timestamps make the id tie-breaker do the work
+        ProductReview.objects.update(created_at=timezone.now())
+        self.add_reviews(3, is_approved=False)
+
+        url = reverse('product_reviews', args=[self.product.slug])
+        names, after, pages = [], '', 0
+        while True:
+            data = self.client.get(url, {'after': after} if after else {}).json()
+            names += [review['customer_name'] for review in data['reviews']]
+            pages += 1
+            if not data['next']:
+                break
+            after = data['next']
+        self.assertEqual(pages, 3)
+        self.assertEqual(names, [f'Customer {i}' for i in range(24, -1, -1)])
+
+    @override_settings(PAGE_CACHE_SECONDS=0)
+    def test_product_page_renders_a_bounded_first_page(self):
+        url = reverse('product-desc', args=[self.product.slug])
+        self.add_reviews(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.add_reviews(40)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.context['approved_reviews']), 10)
+        self.assertIsNotNone(response.context['next_reviews_cursor'])
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(reverse('product_reviews', args=[self.product.slug]), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+
+class CursorPaginationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        create_products(20)
+        # Shared timestamps make the id tie-breaker do the work
+        Product.objects.filter(pk__lte=10).update(created_at=timezone.now())
+
+    def walk(self, url, params, key):
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(url, dict(params, **({'after': cursor} if cursor else {})))
+            page = response.context['page_obj']
+            pages.append([product.pk for product in response.context[key]])
+            if not page.has_next:
+                return pages, page
+            cursor = page.next_cursor
+
+    def test_product_list_pages_forward_and_back(self):
+        pages, last = self.walk(reverse('products'), {}, 'page_obj')
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [8, 8, 4])
+
+        response = self.client.get(reverse('products'), {'before': last.previous_cursor})
+        self.assertEqual([product.pk for product in response.context['page_obj']], pages[1])
+        self.assertEqual(response.context['product_count'], 20)
+
+    def test_search_results_page_forward_and_back(self):
+        pages, last = self.walk(reverse('search'), {'q': 'runner'}, 'products')
+        self.assertEqual([len(page) for page in pages], [12, 8])
+        response = self.client.get(reverse('search'), {'q': 'runner', 'before': last.previous_cursor})
+        self.assertEqual([product.pk for product in response.context['products']], pages[0])
+
+    def test_bad_cursor_shows_the_first_page(self):
+        response = self.client.get(reverse('products'), {'after': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page_obj'].has_previous)
+
+    def test_product_count_is_cached(self):
+        self.client.get(reverse('products'))
+        create_products(1, category=Category.objects.create(name='Boots', slug='boots'))
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.context['product_count'], 20)
+
+
+
+class FacetTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sneakers = create_products(3)
+        boots = Category.objects.create(name='Boots', slug='boots')
+        self.boots = create_products(2, category=boots, gender='M', is_new=True)
+        Product.objects.filter(pk=self.boots[0].pk).update(discount_price=Decimal('900.00'))
+        ProductSize.objects.filter(product=self.boots[1], size='41').update(stock_quantity=0)
+
+    def facets(self, query=''):
+        return compute_facets(CatalogFilters(QueryDict(query)))
+
+    def counts(self, facets, family):
+        return {option['value']: option['count'] for option in facets[family]}
+
+    def test_counts_ignore_their_own_family(self):
+        facets = self.facets('category=boots&price=under-1000')
+        self.assertEqual(self.counts(facets, 'category'), {'boots': 1, 'sneakers': 0})
+        self.assertEqual(self.counts(facets, 'price')['under-1000'], 1)
+        self.assertEqual(self.counts(facets, 'price')['1000-2500'], 1)
+        self.assertEqual(self.counts(facets, 'gender'), {'M': 1, 'F': 0, 'U': 0})
+        self.assertEqual(self.counts(facets, 'size'), {'41': 1, '42': 1})
+        self.assertEqual(facets['new'], {'count': 1, 'selected': False})
+
+    def test_filtered_listing(self):
+        response = self.client.get(reverse('products'), {'size': '41', 'gender': 'M'})
+        self.assertEqual([product.pk for product in response.context['page_obj']], [self.boots[0].pk])
+        response = self.client.get(reverse('products'), {'category': ['boots', 'sneakers'], 'discount': '1'})
+        self.assertEqual([product.pk for product in response.context['page_obj']], [self.boots[0].pk])
+
+    def test_one_query_per_family_then_cached(self):
+        filters = CatalogFilters(QueryDict('size=41&new=1'))
+        # category, category names, gender, price, size, new + discount
+        with self.assertNumQueries(6):
+            get_facets(filters)
+        with self.assertNumQueries(0):
+            get_facets(filters)
+
+    def test_catalogue_changes_invalidate_cached_counts(self):
+        filters = CatalogFilters(QueryDict(''))
+        self.assertEqual(self.counts(get_facets(filters), 'gender')['M'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boots[1].gender = 'F'
+            self.boots[1].save()
+        self.assertEqual(self.counts(get_facets(filters), 'gender')['M'], 1)
+
+        self.assertEqual(self.counts(get_facets(filters), 'size')['41'], 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(make_cart(self.boots[0], quantity=5), shipping_cost=60, **ORDER_FIELDS)
+        self.assertEqual(self.counts(get_facets(filters), 'size')['41'], 3)
+
+
+class CartTests(StoreTestCase):
+    def fill_cart(self, products):
+        for product in products:
+            self.client.post(reverse('add_to_cart', args=[product.id]), {'quantity': 2, 'size': '41'})
+
+    def test_cart_detail_queries_do_not_grow_with_lines(self):
+        for count in (1, 20):
+            with self.subTest(lines=count):
+                self.client.session.flush()
+                Product.objects.all().delete()
+                Category.objects.all().delete()
+                self.fill_cart(create_products(count))
+                get_active_promotions()
+                # session, products, sizes; the live offers are cached
+                with self.assertNumQueries(3):
+                    response = self.client.get(reverse('cart_detail'))
+                self.assertEqual(len(response.context['cart'].get_lines()), count)
+                self.assertEqual(response.context['subtotal'], Decimal('3000.00') * count)
+
+    def test_deleted_products_leave_the_cart(self):
+        kept, deleted = create_products(2)
+        self.fill_cart([kept, deleted])
+        deleted.delete()
+        response = self.client.get(reverse('cart_detail'))
+        self.assertEqual(response.context['subtotal'], Decimal('3000.00'))
+        self.assertEqual(len(response.context['cart']), 2)
+        self.assertEqual(self.client.session[settings.CART_TOTAL_SESSION_ID], 300000)
+
+    def test_update_cart_returns_totals(self):
+        product = create_products(1)[0]
+        self.fill_cart([product])
+        response = self.client.post(
+            reverse('update_cart_with_size', args=[product.id, '41']),
+            {'quantity': 3},
+            headers={'x-requested-with': 'XMLHttpRequest'},
+        )
+        self.assertEqual(response.json(), {
+            'success': True, 'cart_count': 3, 'item_total': 4500.0, 'cart_total': 4500.0,
+        })
+
+    def test_totals_are_exact_and_kept_incrementally(self):
+        product = create_products(1)[0]
+        product.discount_price = Decimal('33.33')
+        product.save()
+        self.client.post(reverse('add_to_cart', args=[product.id]), {'quantity': 3, 'size': '41'})
+        self.client.post(reverse('add_to_cart', args=[product.id]), {'quantity': 1, 'size': '42'})
+        session = self.client.session
+        self.assertEqual(session[settings.CART_TOTAL_SESSION_ID], 13332)
+
+        self.client.post(reverse('remove_from_cart_with_size', args=[product.id, '41']))
+        self.assertEqual(self.client.session[settings.CART_TOTAL_SESSION_ID], 3333)
+
+    def test_legacy_session_prices_are_converted(self):
+        product = create_products(1)[0]
+        session = self.client.session
+        session[settings.CART_SESSION_ID] = {
+            f'{product.id}_41': {'quantity': 3, 'price': '0.10', 'size': '41', 'product_id': str(product.id)},
+        }
+        session.save()
+        response = self.client.get(reverse('cart_detail'))
+        self.assertEqual(response.context['subtotal'], Decimal('0.30'))
+
+
+CHECKOUT_DATA = {
+    'shipping_full_name': 'Rahim Uddin',
+    'shipping_email': 'rahim@example.com',
+    'shipping_phone': '01700000000',
+    'shipping_address': 'House 1, Road 2',
+    'shipping_city': 'Dhaka',
+    'delivery_area': 'inside',
+    'payment_method': 'cash_on_delivery',
+}
+
+
+class CheckoutTests(StoreTestCase):
+    def checkout(self, products):
+        for product in products:
+            self.client.post(reverse('add_to_cart', args=[product.id]), {'quantity': 1, 'size': '41'})
+        get_active_promotions()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        return response, len(queries)
+
+    def test_order_queries_do_not_grow_with_lines(self):
+        category = Category.objects.create(name='Boots', slug='boots')
+        response, small = self.checkout(create_products(1, category=category))
+        self.assertEqual(response.status_code, 302)
+        response, large = self.checkout(create_products(20))
+        self.assertEqual(small, large)
+
+        order = Order.objects.latest('id')
+        self.assertEqual(order.items.count(), 20)
+        self.assertEqual(order.subtotal, Decimal('30000.00'))
+        self.assertEqual(order.total, Decimal('30060.00'))
+        self.assertEqual(order.items.first().product_image.name, 'products/runner-0.jpg')
+
+    def test_failed_order_leaves_nothing_behind(self):
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            response, queries = self.checkout(create_products(3))
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class ComboDerivedFieldsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = create_products(2)
+        now = timezone.now()
+        self.combo = ComboOffer.objects.create(
+            name='Pair deal', slug='pair-deal', description='Two pairs', discount_price=Decimal('2500'),
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+        )
+        ComboProduct.objects.create(combo_offer=self.combo, product=self.products[0])
+        ComboProduct.objects.create(combo_offer=self.combo, product=self.products[1], quantity=3)
+
+    def assertCombo(self, original_price, percentage, stock):
+        self.combo.refresh_from_db()
+        self.assertEqual(
+            (self.combo.original_price, self.combo.discount_percentage, self.combo.stock_quantity),
+            (Decimal(original_price), percentage, stock),
+        )
+        self.assertEqual(self.combo.savings_badge_text, f'SAVE {percentage}%')
+
+    def test_follows_products_and_combo_rows(self):
+        # 1500 + 3 × 1500; stock 10 and 10 // 3
+        self.assertCombo('6000.00', 58, 3)
+        self.products[1].discount_price = Decimal('1000')
+        self.products[1].save()
+        self.assertCombo('4500.00', 44, 3)
+        ComboProduct.objects.filter(product=self.products[1]).get().delete()
+        self.assertCombo('1500.00', 0, 10)
+        self.products[0].is_active = False
+        self.products[0].save()
+        self.assertCombo('1500.00', 0, 0)
+
+    def test_checkout_updates_combo_stock(self):
+        for product in self.products:
+            self.client.post(reverse('add_to_cart', args=[product.id]), {'quantity': 2, 'size': '41'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        # 8 // 3
+        self.assertCombo('6000.00', 58, 2)
+        release_stock(Order.objects.get())
+        self.assertCombo('6000.00', 58, 3)
+
+
+class DiscountTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = create_products(3)
+        self.now = timezone.now()
+        self.window = {'start_date': self.now - timedelta(days=1), 'end_date': self.now + timedelta(days=10)}
+
+    def add(self, *products, quantity=1):
+        for product in products:
+            self.client.post(reverse('add_to_cart', args=[product.id]), {'quantity': quantity, 'size': '41'})
+
+    def apply(self, code):
+        return self.client.post(reverse('apply_discount_code'), {'code': code}, follow=True)
+
+    def test_code_is_checked_and_written_to_the_order(self):
+        Offer.objects.create(
+            title='Eid code', slug='eid-code', offer_type='discount_code', discount_code='EID10',
+            discount_percentage=10, min_order_amount=Decimal('2000'), **self.window,
+        )
+        self.add(self.products[0])
+        self.assertContains(self.apply('nope'), 'This code is not valid.')
+        self.assertContains(self.apply(' eid10 '), 'needs an order of at least')
+        self.assertEqual(self.client.get(reverse('cart_detail')).context['discount'], 0)
+
+        self.add(self.products[1])
+        self.assertEqual(self.client.get(reverse('cart_detail')).context['discount'], Decimal('300.00'))
+        self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        order = Order.objects.get()
+        self.assertEqual(order.discount, Decimal('300.00'))
+        self.assertEqual(order.total, Decimal('2760.00'))
+
+    def test_combos_then_the_best_automatic_offer(self):
+        combo = ComboOffer.objects.create(
+            name='Pair deal', slug='pair-deal', description='Two pairs', original_price=Decimal('3000'),
+            discount_price=Decimal('2500'), **self.window,
+        )
+        for product in self.products[:2]:
+            ComboProduct.objects.create(combo_offer=combo, product=product)
+        Offer.objects.create(
+            title='Summer', slug='summer', offer_type='summer_sale', discount_percentage=5, **self.window,
+        )
+        Offer.objects.create(
+            title='Clearance', slug='clearance', offer_type='clearance', discount_percentage=10, **self.window,
+        )
+        Offer.objects.create(
+            title='Free shipping', slug='free-shipping', offer_type='free_shipping',
+            min_order_amount=Decimal('5000'), **self.window,
+        )
+        # Two sets in the cart, but stock for only one
+        self.products[0].stock_quantity = 1
+        self.products[0].save()
+        self.add(*self.products[:2], quantity=2)
+        response = self.client.get(reverse('cart_detail'))
+        # 500 off one set, then 10% of the remaining 5500
+        self.assertEqual(response.context['discount'], Decimal('1050.00'))
+        self.assertEqual(response.context['shipping'], 0)
+        self.assertEqual(response.context['cart_discount'].applied, ['Pair deal', 'Free shipping', 'Clearance'])
+
+    def test_evaluated_once_per_cart_version(self):
+        self.add(self.products[0])
+        with mock.patch('store.discounts.evaluate_cart', wraps=evaluate_cart) as evaluate:
+            self.client.get(reverse('cart_detail'))
+            self.client.get(reverse('checkout'))
+            self.assertEqual(evaluate.call_count, 1)
+            self.add(self.products[0])
+            self.client.get(reverse('checkout'))
+            self.assertEqual(evaluate.call_count, 2)
+            with self.captureOnCommitCallbacks(execute=True):
+                Offer.objects.create(
+                    title='Summer', slug='summer', offer_type='summer_sale', discount_percentage=5,
+                    **self.window,
+                )
+            self.assertEqual(self.client.get(reverse('cart_detail')).context['discount'], Decimal('150.00'))
+            self.assertEqual(evaluate.call_count, 3)
+
+
+def make_cart(*products, quantity=1, size='41'):
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    cart = Cart(SimpleNamespace(session=session))
+    for product in products:
+        cart.add(product, quantity, size)
+    return cart
+
+
+ORDER_FIELDS = {
+    'shipping_full_name': 'Rahim Uddin',
+    'shipping_email': 'rahim@example.com',
+    'shipping_phone': '01700000000',
+    'shipping_address': 'House 1, Road 2',
+    'shipping_city': 'Dhaka',
+}
+
+
+class StockReservationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_products(1)[0]
+
+    def stock(self, size='41'):
+        self.product.refresh_from_db()
+        return self.product.stock_quantity, self.product.sizes.get(size=size).stock_quantity
+
+    def test_order_decrements_product_and_size_stock(self):
+        place_order(make_cart(self.product, quantity=2), shipping_cost=60, **ORDER_FIELDS)
+        self.assertEqual(self.stock(), (8, 3))
+
+    def test_sized_lines_only_need_the_size_in_stock(self):
+        # A total entered by hand that doesn't match the sizes
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=0)
+        response = self.client.post(reverse('buy_now', args=[self.product.id]), {'quantity': 2, 'size': '41'})
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        response = self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Order.objects.exists())
+        self.assertEqual(self.stock(), (8, 3))
+
+    def test_product_total_follows_size_edits_and_unsized_lines(self):
+        size = self.product.sizes.get(size='42')
+        size.stock_quantity = 1
+        size.save()
+        self.assertEqual(self.stock(), (6, 5))
+
+        plain = create_products(1, category=Category.objects.create(name='Socks', slug='socks'))[0]
+        plain.sizes.all().delete()
+        Product.objects.filter(pk=plain.pk).update(stock_quantity=4)
+        plain.refresh_from_db()
+        order = place_order(make_cart(plain, quantity=3, size=None), shipping_cost=60, **ORDER_FIELDS)
+        self.assertEqual(Product.objects.get(pk=plain.pk).stock_quantity, 1)
+        order.cancel()
+        self.assertEqual(Product.objects.get(pk=plain.pk).stock_quantity, 4)
+
+    def test_oversell_rolls_back_every_line(self):
+        other = create_products(1, category=Category.objects.create(name='Boots', slug='boots'))[0]
+        cart = make_cart(self.product, quantity=5)
+        cart.add(other, 6, '41')
+        with self.assertRaisesMessage(OutOfStock, 'Runner 0 in size 41 is out of stock'):
+            place_order(cart, shipping_cost=60, **ORDER_FIELDS)
+        self.assertEqual(self.stock(), (10, 5))
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_releases_stock_once(self):
+        order = place_order(make_cart(self.product, quantity=2), shipping_cost=60, **ORDER_FIELDS)
+        order.cancel()
+        order.cancel()
+        self.assertEqual(self.stock(), (10, 5))
+        self.assertTrue(Order.objects.get(pk=order.pk).stock_released)
+
+    def test_expired_mobile_payment_reservations_are_released(self):
+        order = place_order(make_cart(self.product), shipping_cost=60, payment_method='bkash', **ORDER_FIELDS)
+        self.assertIsNotNone(order.reservation_expires_at)
+        cod = place_order(make_cart(self.product), shipping_cost=60, **ORDER_FIELDS)
+        self.assertIsNone(cod.reservation_expires_at)
+
+        Order.objects.filter(pk=order.pk).update(reservation_expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+        self.assertEqual(self.stock(), (9, 4))
+
+    def test_a_job_releases_the_reservation_when_it_expires(self):
+        order = place_order(make_cart(self.product), shipping_cost=60, payment_method='bkash', **ORDER_FIELDS)
+        job = Job.objects.get(task='store.stock.release_expired_reservations')
+        self.assertGreater(job.run_at, order.reservation_expires_at)
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        Order.objects.filter(pk=order.pk).update(reservation_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    buyers = 8
+
+    def test_only_one_buyer_gets_the_last_unit(self):
+        product = create_products(1)[0]
+        Product.objects.filter(pk=product.pk).update(stock_quantity=1)
+        ProductSize.objects.filter(product=product, size='41').update(stock_quantity=1)
+
+        barrier = threading.Barrier(self.buyers)
+        results = []
+
+        def buy():
+            try:
+                cart = make_cart(product)
+                cart.get_lines()
+                barrier.wait()
+                place_order(cart, shipping_cost=60, **ORDER_FIELDS)
+                results.append('ok')
+            except OutOfStock:
+                results.append('out of stock')
+            except Exception as e:
+                results.append(repr(e))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for i in range(self.buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('ok'), 1)
+        self.assertEqual(results.count('out of stock'), self.buyers - 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(ProductSize.objects.get(product=product, size='41').stock_quantity, 0)
+
+
+class OrderNumberTests(StoreTestCase):
+    def test_numbers_keep_the_prefix_and_increase(self):
+        first, second = next_order_number(), next_order_number()
+        self.assertRegex(first, r'^ORD\d{8}\d{8}$')
+        self.assertLess(first, second)
+        order = Order.objects.create(total=0, **ORDER_FIELDS)
+        self.assertGreater(order.order_number, second)
+
+
+
+class OrderPaymentTrackingTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = Order.objects.create(total=0, payment_method='bkash', **ORDER_FIELDS)
+
+    def test_status_change_is_detected_without_reloading(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.payment_status = 'paid'
+        with self.assertNumQueries(1):
+            order.save()
+        self.assertIsNotNone(order.paid_at)
+        self.assertEqual(order.get_original('payment_status'), 'paid')
+
+    def test_paid_at_is_only_stamped_on_the_transition(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.mark_as_paid(transaction_id='TX1')
+        paid_at = order.paid_at
+        order.notes = 'Called the customer'
+        order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).paid_at, paid_at)
+
+    def test_missing_snapshot_falls_back_to_the_database(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.__dict__.pop('_original')
+        order.payment_status = 'paid'
+        order.save()
+        self.assertIsNotNone(order.paid_at)
+
+    def test_bulk_mark_paid_is_one_update(self):
+        Order.objects.create(total=0, payment_status='paid', **ORDER_FIELDS)
+        with self.assertNumQueries(1):
+            count = mark_orders_paid(Order.objects.all())
+        self.assertEqual(count, 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertIsNotNone(self.order.paid_at)
+        self.assertIsNone(self.order.reservation_expires_at)
+
+    def test_bulk_mark_paid_skips_cancelled_and_released_orders(self):
+        cancelled = Order.objects.create(total=0, status='cancelled', **ORDER_FIELDS)
+        released = Order.objects.create(total=0, stock_released=True, **ORDER_FIELDS)
+        self.assertEqual(mark_orders_paid(Order.objects.all()), 1)
+        for order in (cancelled, released):
+            order.refresh_from_db()
+            self.assertEqual(order.payment_status, 'pending')
+            self.assertIsNone(order.paid_at)
+
+    def test_refresh_from_db_updates_the_snapshot(self):
+        order = Order.objects.get(pk=self.order.pk)
+        mark_orders_paid(Order.objects.filter(pk=order.pk))
+        order.refresh_from_db()
+        self.assertEqual(order.get_original('payment_status'), 'paid')
+        paid_at = order.paid_at
+        order.notes = 'Reconciled'
+        order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).paid_at, paid_at)
+
+
+class OrderNumberConcurrencyTests(TransactionTestCase):
+    threads = 8
+    orders_per_thread = 250
+
+    def test_parallel_orders_get_unique_increasing_numbers(self):
+        numbers = {}
+        errors = []
+
+        def create_orders(index):
+            try:
+                numbers[index] = [
+                    Order.objects.create(total=0, **ORDER_FIELDS).order_number
+                    for i in range(self.orders_per_thread)
+                ]
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create_orders, args=(i,)) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        created = [number for thread_numbers in numbers.values() for number in thread_numbers]
+        self.assertEqual(len(set(created)), self.threads * self.orders_per_thread)
+        for thread_numbers in numbers.values():
+            self.assertEqual(thread_numbers, sorted(thread_numbers))
+
+
+class SeedCatalogTests(StoreTestCase):
+    def seed(self, **options):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('seed_catalog', categories=3, products=40, orders=30, offers=5, combos=4, stdout=out, **options)
+        return out.getvalue()
+
+    def test_seeded_catalogue_is_consistent(self):
+        self.assertIn('Seeded 3 categories, 40 products', self.seed())
+        self.assertEqual(Product.objects.filter(slug__startswith='seed-product-').count(), 40)
+
+        ratings = {product.pk: (product.rating_count, product.average_rating) for product in Product.objects.all()}
+        recompute_ratings()
+        self.assertEqual(ratings, {
+            product.pk: (product.rating_count, product.average_rating) for product in Product.objects.all()
+        })
+
+        numbers = list(Order.objects.values_list('order_number', flat=True))
+        self.assertEqual(len(set(numbers)), 30)
+        self.assertNotIn(Order.objects.create(total=0, **ORDER_FIELDS).order_number, numbers)
+        self.assertTrue(all(combo.original_price > combo.discount_price for combo in ComboOffer.objects.all()))
+        self.assertTrue(search_product_ids(Product.objects.filter(is_active=True).first().name.split()[0]))
+
+    def test_reseeding_needs_clear(self):
+        self.seed()
+        with self.assertRaisesMessage(CommandError, "A catalogue with prefix 'seed' already exists"):
+            self.seed()
+        self.assertIn('Seeded 3 categories', self.seed(clear=True))
+        self.assertEqual(Product.objects.count(), 40)
+
+
+class BenchmarkStoreTests(StoreTestCase):
+    def test_views_are_measured_and_compared_with_a_baseline(self):
+        seed_catalog(categories=2, products=12, orders=5, offers=3, combos=2)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = f'{directory.name}/baseline.json'
+
+        with mock.patch('store.stock.purge_product_pages') as purge:
+            call_command('benchmark_store', requests=2, warmup=0, save=baseline, stdout=StringIO())
+        # The orders' on-commit work ran, though nothing was committed
+        self.assertEqual(purge.call_count, 2)
+        with open(baseline) as f:
+            results = json.load(f)
+        self.assertEqual(results['catalog']['products'], 12)
+        self.assertEqual(results['views']['place_order']['requests'], 2)
+        for view in results['views'].values():
+            self.assertGreaterEqual(view['p99_ms'], view['p50_ms'])
+            self.assertGreater(view['throughput_rps'], 0)
+        self.assertGreater(results['views']['product_detail']['queries'], 0)
+        self.assertFalse(Order.objects.filter(shipping_email='load-test@example.com').exists())
+
+        results['views']['product_detail']['queries'] -= 1
+        with open(baseline, 'w') as f:
+            json.dump(results, f)
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, '1 regression(s)'):
+            call_command('benchmark_store', requests=2, warmup=0, only=['product_detail'], compare=baseline,
+                         tolerance=100, stdout=out)
+        self.assertIn('product_detail: ', out.getvalue())
@@ -5,9 +5,11 @@ from .views import *
 urlpatterns = [
     path('',homepageview,name='home'),
     path('search/', search_view, name='search'),
+    path('search/suggest/', search_suggest, name='search_suggest'),
     path('products-list/',productpageview,name='products'),
     path('products/<slug:slug>/',productdetailview,name='product-desc'),
     path('product/<slug:slug>/review/', add_review, name='add_review'),
+    path('product/<slug:slug>/reviews/', product_reviews, name='product_reviews'),
     path('offers/',offerspageview,name='offers'),
     path('about/',aboutpageview,name='about'),
     path('contact/',contactpageview,name='contact'),
@@ -16,6 +18,7 @@ urlpatterns = [
     path('cart/add/<int:product_id>/', add_to_cart, name='add_to_cart'),
     path('cart/remove/<int:product_id>/', remove_from_cart, name='remove_from_cart'),
     path('cart/remove/<int:product_id>/<str:size>/', remove_from_cart, name='remove_from_cart_with_size'),
+    path('cart/discount/', apply_discount_code, name='apply_discount_code'),
     path('cart/update/<int:product_id>/', update_cart, name='update_cart'),
     path('cart/update/<int:product_id>/<str:size>/', update_cart, name='update_cart_with_size'),
     path('checkout/', checkout, name='checkout'),
@@ -23,4 +26,6 @@ urlpatterns = [
     path('order/success/<int:order_id>/', order_success, name='order_success'),
     path('orders/<int:order_id>/', order_details, name='order_details'),
     path('buy-now/<int:product_id>/', buy_now, name='buy_now'),
+    path('cache-stats/cards/', card_cache_stats, name='card_cache_stats'),
+    path('metrics', metrics, name='metrics'),
 ]
\ No newline at end of file
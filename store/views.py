@@ -1,126 +1,231 @@
+from django.conf import settings
 from django.shortcuts import render,get_object_or_404,redirect
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Count, Sum
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.formats import date_format
 from .cart_utils import Cart
+from .catalog import CatalogFilters, get_active_product_count, get_facets
+from .conditional import changes, conditional_page
+from .discounts import get_cart_discount, set_discount_code
+from .fragments import get_card_stats
+from .metrics import inc, render_metrics
+from .order_utils import place_order
+from .page_cache import add_page_tags, cache_anonymous_page
+from .pagination import InvalidCursor, paginate_by_created
+from .promotions import ENDING_SOON, get_active_promotions, live_combos, live_offers
+from .reviews import get_review_page
+from .search import count_matches, products_for_ids, search_page
+from .suggest import get_suggestions
+from .stock import OutOfStock
 from .models import *
 from .forms import *
 
 # search functionality
 def search_view(request):
-    query = request.GET.get('q', '')
-    sitesettings = SiteSettings.objects.first()
-    
-    if query:
-        # Search in product name, description, and category
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(short_description__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query),
-            is_active=True
-        ).distinct()
-    else:
-        products = Product.objects.all()
+    query = request.GET.get('q', '').strip()
+    inc('store_search_queries_total', kind='search')
+    
+    # The search index ranks and pages the results; only the current page is loaded
+    try:
+        page_obj = search_page(query, 12, after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        page_obj = search_page(query, 12)
     
     context = {
-        'sitesettings':sitesettings,
-        'products': products,
+        'products': products_for_ids(page_obj.object_list),
+        'page_obj': page_obj,
         'query': query,
-        'results_count': products.count(),
+        'results_count': count_matches(query),
     }
     return render(request, 'store/search_results.html', context)
 
+def search_suggest(request):
+    # Served from the in-memory suggestion index, without touching the database
+    query = request.GET.get('q', '')[:100]
+    inc('store_search_queries_total', kind='suggest')
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    return JsonResponse({'query': query, 'suggestions': get_suggestions(query, limit)})
+
+# Conditional GET: everything each cacheable page shows, as aggregates that
+# change with it. Stock and combo membership have no updated_at, so they are
+# summed and counted instead.
+def site_dependencies():
+    return changes(SiteSettings.objects.all())
+
+def promotion_dependencies():
+    now = timezone.now()
+    combo_products = ComboProduct.objects.filter(combo_offer__in=live_combos(now))
+    return [
+        *changes(Offer.objects.all()),
+        *changes(live_offers(now)),
+        # Offer.badge_text turns to "Ending Soon"
+        (live_offers(now).filter(end_date__lt=now + ENDING_SOON), Count('pk')),
+        *changes(ComboOffer.objects.all()),
+        *changes(live_combos(now)),
+        (combo_products, Count('pk')),
+        *changes(Product.objects.filter(comboproduct__in=combo_products)),
+        *changes(ProductImage.objects.filter(product__comboproduct__in=combo_products)),
+    ]
+
+def home_dependencies(request):
+    featured = Product.objects.filter(is_active=True, is_featured=True)
+    featured_sizes = ProductSize.objects.filter(product__in=featured)
+    showcase = RotatingShowcaseProduct.objects.filter(is_active=True)
+    return [
+        *site_dependencies(),
+        *changes(HeroSection.objects.all()),
+        *changes(featured),
+        *changes(ProductImage.objects.filter(product__in=featured)),
+        (featured_sizes, Count('pk')),
+        (featured_sizes, Sum('stock_quantity')),
+        *changes(showcase),
+        *changes(Product.objects.filter(rotatingshowcaseproduct__in=showcase)),
+        *changes(ProductImage.objects.filter(product__rotatingshowcaseproduct__in=showcase)),
+        *promotion_dependencies(),
+    ]
+
+def product_dependencies(request, slug):
+    sizes = ProductSize.objects.filter(product__slug=slug)
+    return [
+        *site_dependencies(),
+        *changes(Product.objects.filter(slug=slug)),
+        *changes(ProductImage.objects.filter(product__slug=slug)),
+        (sizes, Count('pk')),
+        (sizes, Sum('stock_quantity')),
+        *changes(ProductReview.objects.filter(product__slug=slug, is_approved=True)),
+    ]
+
+def offers_dependencies(request):
+    return [*site_dependencies(), *promotion_dependencies()]
+
+def about_dependencies(request):
+    return [*site_dependencies(), *changes(AboutSection.objects.all()), *changes(TeamMember.objects.all())]
+
+def contact_dependencies(request):
+    return [
+        *site_dependencies(),
+        *changes(ContactPageSettings.objects.all()),
+        *changes(ContactInfo.objects.all()),
+        *changes(SocialMedia.objects.all()),
+    ]
+
+def return_dependencies(request):
+    return [
+        *site_dependencies(),
+        *changes(ReturnsPageSettings.objects.all()),
+        *changes(PolicyPoint.objects.all()),
+        *changes(ReturnStep.objects.all()),
+        *changes(EligibilityItem.objects.all()),
+        *changes(RefundMethod.objects.all()),
+        *changes(ReturnReason.objects.all()),
+    ]
+
 # home page logic
+@cache_anonymous_page(
+    'product', 'productimage', 'productsize', 'rotatingshowcaseproduct',
+    'combooffer', 'comboproduct', 'offer', 'herosection',
+)
+@conditional_page(home_dependencies)
 def homepageview(request):
-    sitesettings = SiteSettings.objects.first()
-    herosection = HeroSection.objects.last()
-    featured_products = Product.objects.filter(is_active=True,is_featured=True)[:8]
-    rotating_image = RotatingShowcaseProduct.objects.filter(is_active=True)[:6]
-    combo_offers = ComboOffer.objects.filter(
-        is_active=True,
-        start_date__lte=timezone.now(),
-        end_date__gte=timezone.now(),
-        stock_quantity__gt=0
-    ).order_by('-is_featured', '-created_at')[:2]
-
-    active_offers = Offer.objects.filter(
-        Q(is_active=True) &
-        Q(start_date__lte=timezone.now()) &
-        Q(end_date__gte=timezone.now())
-    ).order_by('-is_featured', '-start_date')[:3]
-    combo_offers = combo_offers.prefetch_related(
-        'comboproduct_set__product__images'
-    )
+    featured_products = Product.objects.filter(is_active=True,is_featured=True).for_cards()[:8]
+    rotating_image = RotatingShowcaseProduct.objects.filter(is_active=True).select_related('product').prefetch_related('product__images')[:6]
+    promotions = get_active_promotions()
     context = {
-        'sitesettings':sitesettings,
-        'herosection':herosection,
         'featured_products': featured_products,
         'rotating_images':rotating_image,
-        'combo_offers': combo_offers,
-        'active_offers': active_offers,
+        'combo_offers': promotions.combos[:2],
+        'active_offers': promotions.offers[:3],
         
     }
     return render(request, 'store/index.html', context)
 
 # product page logic
 def productpageview(request):
-    sitesettings = SiteSettings.objects.first()
-    products = Product.objects.filter(is_active=True)
+    filters = CatalogFilters(request.GET)
+    products = filters.apply(Product.objects.filter(is_active=True)).for_cards()
 
-    # Pagination
-    paginator = Paginator(products, 8)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    # Cursor pagination: deep pages cost the same as the first one
+    try:
+        page_obj = paginate_by_created(products, 8, after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        page_obj = paginate_by_created(products, 8)
 
     context = {
-        'sitesettings':sitesettings,
         "page_obj": page_obj,  # paginated products
+        "product_count": None if filters else get_active_product_count(),
+        "filters": filters,
+        "filter_query": filters.querystring(),
+        "facets": get_facets(filters),
     }
     return render(request, "store/products.html", context)
 
 # product details page
+@cache_anonymous_page()
+@conditional_page(product_dependencies)
 def productdetailview(request, slug):
-    sitesettings = SiteSettings.objects.first()
     product = get_object_or_404(Product, slug=slug, is_active=True)
+    # Combo membership changes purge product:<pk> too, through ComboProduct.product_id
+    add_page_tags(request, f'product:{product.pk}', f'category:{product.category_id}')
     
     # Get primary image or first available image
     primary_image = product.images.filter(is_primary=True).first()
     if not primary_image:
         primary_image = product.images.first()
     
-    # Get approved reviews count and average rating
-    approved_reviews = product.reviews.filter(is_approved=True)
-    review_count = approved_reviews.count()
-    
-    # Calculate average rating
-    if review_count > 0:
-        total_rating = sum(review.rating for review in approved_reviews)
-        average_rating = round(total_rating / review_count, 1)
-    else:
-        average_rating = 0
+    # Approved review count and average rating are stored on the product;
+    # only the first page of reviews is rendered, the rest load on demand
+    approved_reviews, next_reviews_cursor = get_review_page(product.pk)
+    review_count = product.rating_count
+    average_rating = product.get_average_rating()
     
     # Get featured products
     featured_products = Product.objects.filter(is_featured=True, is_active=True)[:4]
     
     # Add is_out_of_stock property to each size
-    sizes = list(product.sizes.all())
+    sizes = list(product.sizes.in_size_order())
     for size in sizes:
         size.is_out_of_stock = size.stock_quantity == 0
     
     context = {
-        'sitesettings':sitesettings,
         'product': product,
         'primary_image': primary_image,
         'featured_products': featured_products,
         'review_count': review_count,
         'average_rating': average_rating,
         'approved_reviews': approved_reviews,
+        'next_reviews_cursor': next_reviews_cursor,
         'sizes': sizes,  # Pass the modified sizes list
     }
     return render(request, 'store/productdetails.html', context)
 
+# more reviews for the product page's "load more" button
+def product_reviews(request, slug):
+    product_id = get_object_or_404(Product.objects.values_list('pk', flat=True), slug=slug, is_active=True)
+    try:
+        reviews, next_cursor = get_review_page(product_id, request.GET.get('after'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    return JsonResponse({
+        'reviews': [
+            {
+                'customer_name': review.customer_name,
+                'rating': review.rating,
+                'title': review.title,
+                'comment': review.comment,
+                'created_at': date_format(timezone.localtime(review.created_at), 'M d, Y'),
+            }
+            for review in reviews
+        ],
+        'next': next_cursor,
+    })
+
 # add review to product
 def add_review(request, slug):
     if request.method == 'POST':
@@ -139,51 +244,33 @@ def add_review(request, slug):
     return redirect('product-desc', slug=slug)
 
 # offer page logic 
+@cache_anonymous_page('offer', 'combooffer', 'comboproduct', 'product', 'productimage')
+@conditional_page(offers_dependencies)
 def offerspageview(request):
-    sitesettings = SiteSettings.objects.first()
-    combo_offers = ComboOffer.objects.filter(
-        is_active=True,
-        start_date__lte=timezone.now(),
-        end_date__gte=timezone.now(),
-        stock_quantity__gt=0
-    ).order_by('-is_featured', '-created_at')
-
-    active_offers = Offer.objects.filter(
-        Q(is_active=True) &
-        Q(start_date__lte=timezone.now()) &
-        Q(end_date__gte=timezone.now())
-    ).order_by('-is_featured', '-start_date')
-
-    combo_offers = combo_offers.prefetch_related(
-        'comboproduct_set__product__images'
-    )
-    
+    promotions = get_active_promotions()
     context = {
-        'sitesettings':sitesettings,
-        'combo_offers': combo_offers,
-        'active_offers': active_offers,
+        'combo_offers': promotions.combos,
+        'active_offers': promotions.offers,
     }
     return render(request, 'store/offers.html', context)
 
 # about page logic  
+@cache_anonymous_page('aboutsection', 'teammember')
+@conditional_page(about_dependencies)
 def aboutpageview(request):
-    sitesettings = SiteSettings.objects.first()
-    about_section = AboutSection.objects.filter(is_active=True).first()
     founders = TeamMember.objects.filter(is_active=True, is_founder=True)
     team_members = TeamMember.objects.filter(is_active=True, is_founder=False)
     
     context = {
-        'sitesettings':sitesettings,
-        'about_section': about_section,
         'founders': founders,
         'team_members': team_members,
     }
     return render(request, 'store/about.html', context)
 
 # contact page logic
+@cache_anonymous_page('contactpagesettings', 'contactinfo', 'socialmedia')
+@conditional_page(contact_dependencies)
 def contactpageview(request):
-    sitesettings = SiteSettings.objects.first()
-    contact_section = ContactPageSettings.objects.filter(is_active=True).first()
     contact_info = ContactInfo.objects.filter(is_active=True)
     social_media = SocialMedia.objects.filter(is_active=True)
     
@@ -212,8 +299,6 @@ def contactpageview(request):
         return redirect('contact')
     
     context = {
-        'sitesettings':sitesettings,
-        'contact_section': contact_section,
         'contact_info': contact_info,
         'social_media': social_media,
         'subject_choices': subject_choices,
@@ -221,9 +306,11 @@ def contactpageview(request):
     return render(request, 'store/contact.html', context)
 
 # return page logic 
+@cache_anonymous_page(
+    'returnspagesettings', 'policypoint', 'returnstep', 'eligibilityitem', 'refundmethod', 'returnreason',
+)
+@conditional_page(return_dependencies)
 def returnpageview(request):
-    sitesettings = SiteSettings.objects.first()
-    page_settings = ReturnsPageSettings.objects.first()
     policy_points = PolicyPoint.objects.filter(is_active=True).order_by("order")
     steps = ReturnStep.objects.filter(is_active=True).order_by("step_number", "order")
     eligibility_items = EligibilityItem.objects.filter(is_active=True).order_by("type", "order")
@@ -251,8 +338,6 @@ def returnpageview(request):
             return redirect('return')  # redirect to return page after succesfull form submit
     
     context = {
-        'sitesettings':sitesettings,
-        "page_settings": page_settings,
         "policy_points": policy_points,
         "steps": steps,
         "eligibility_items": eligibility_items,
@@ -298,23 +383,37 @@ def remove_from_cart(request, product_id, size=None):
 
 def cart_detail(request):
     cart = Cart(request)
-    sitesettings = SiteSettings.objects.first()
     
     # Calculate totals
     subtotal = cart.get_total_price()
-    discount = 0  # You can implement discount logic later
-    shipping = 120 if subtotal > 0 else 0  # Free shipping over certain amount?
+    cart_discount = get_cart_discount(request, cart)
+    discount = cart_discount.total
+    shipping = cart_discount.shipping(120 if subtotal > 0 else 0)
     
     context = {
-        'sitesettings': sitesettings,
         'cart': cart,
         'subtotal': subtotal,
         'discount': discount,
+        'cart_discount': cart_discount,
         'shipping': shipping,
         'total': subtotal - discount + shipping,
     }
     return render(request, 'store/cart.html', context)
 
+def apply_discount_code(request):
+    if request.method == 'POST':
+        cart = Cart(request)
+        code = request.POST.get('code', '')
+        set_discount_code(request, code)
+        cart_discount = get_cart_discount(request, cart)
+        if not cart_discount.code:
+            messages.info(request, 'Discount code removed.')
+        elif cart_discount.code_error:
+            messages.error(request, cart_discount.code_error)
+        else:
+            messages.success(request, f'Discount code {code.strip()} applied.')
+    return redirect('cart_detail')
+
 def update_cart(request, product_id, size=None):
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
@@ -323,19 +422,15 @@ def update_cart(request, product_id, size=None):
         product = get_object_or_404(Product, id=product_id)
         
         # For update, we need to find the exact item in cart
-        size_key = size or 'no_size'
-        item_key = f"{product_id}_{size_key}"
+        item_key = cart.update(product.id, quantity, size)
         
-        if item_key in cart.cart:
-            cart.cart[item_key]['quantity'] = quantity
-            cart.save()
-            
+        if item_key:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                 return JsonResponse({
                     'success': True,
                     'cart_count': len(cart),
-                    'item_total': float(cart.cart[item_key]['price']) * quantity,
-                    'cart_total': cart.get_total_price()
+                    'item_total': float(cart.get_item_total(item_key)),
+                    'cart_total': float(cart.get_total_price())
                 })
     
     return redirect('cart_detail')   
@@ -356,8 +451,8 @@ def buy_now(request, product_id):
         # Validate stock
         if size:
             product_size = product.sizes.filter(size=size).first()
-            if product_size and product.stock_quantity < quantity:
-                messages.error(request, f'Only {product.stock_quantity} items available in size {size}.')
+            if product_size and product_size.stock_quantity < quantity:
+                messages.error(request, f'Only {product_size.stock_quantity} items available in size {size}.')
                 return redirect('product-desc', slug=product.slug)
         elif product.stock_quantity < quantity:
             messages.error(request, f'Only {product.stock_quantity} items available.')
@@ -381,12 +476,12 @@ def checkout(request):
         messages.warning(request, "Your cart is empty. Add some items before checkout.")
         return redirect('cart_detail')
     
-    sitesettings = SiteSettings.objects.first()
     
     # Calculate totals
     subtotal = cart.get_total_price()
-    discount = 0
-    shipping = 60
+    cart_discount = get_cart_discount(request, cart)
+    discount = cart_discount.total
+    shipping = cart_discount.shipping(60)
     total = subtotal - discount + shipping
     
     # Pre-fill form for authenticated users
@@ -408,16 +503,14 @@ def checkout(request):
             try:
                 # Calculate shipping based on delivery area
                 delivery_area = form.cleaned_data.get('delivery_area', 'inside')
-                shipping_cost = 60 if delivery_area == 'inside' else 120
-                total = subtotal - discount + shipping_cost 
+                shipping_cost = cart_discount.shipping(60 if delivery_area == 'inside' else 120)
                 
-                # Create order with single full name field
-                order = Order.objects.create(
-                    user=request.user if request.user.is_authenticated else None,
-                    subtotal=subtotal,
-                    discount=discount,
+                # Create order and its items with single full name field
+                order = place_order(
+                    cart,
                     shipping_cost=shipping_cost,
-                    total=total,
+                    discount=discount,
+                    user=request.user if request.user.is_authenticated else None,
                     shipping_full_name=form.cleaned_data['shipping_full_name'],  # Changed to full_name
                     shipping_email=form.cleaned_data['shipping_email'],
                     shipping_phone=form.cleaned_data['shipping_phone'],
@@ -433,23 +526,15 @@ def checkout(request):
                     payment_status='pending',
                 )
                 
-                # Create order items
-                for item_key, item in cart:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=item['product'],
-                        product_name=item['product'].name,
-                        size=item.get('size'),
-                        quantity=item['quantity'],
-                        price=item['price']
-                    )
-                
                 # Clear the cart
                 cart.clear()
                 
                 # Redirect to order success page
                 return redirect('order_success', order_id=order.id)
                 
+            except OutOfStock as e:
+                messages.error(request, str(e))
+                return redirect('cart_detail')
             except Exception as e:
                 messages.error(request, f"There was an error processing your order: {str(e)}")
                 return redirect('checkout')
@@ -457,10 +542,10 @@ def checkout(request):
         form = CheckoutForm(initial=initial_data)
     
     context = {
-        'sitesettings': sitesettings,
         'cart': cart,
         'subtotal': subtotal,
         'discount': discount,
+        'cart_discount': cart_discount,
         'shipping': shipping,
         'total': total,
         'form': form,
@@ -476,14 +561,15 @@ def process_order(request):
             return redirect('cart_detail')
         
         try:
-            # Create order
-            order = Order.objects.create(
+            # Create order and its items
+            full_name = f"{request.POST.get('first_name', '')} {request.POST.get('last_name', '')}".strip()
+            cart_discount = get_cart_discount(request, cart)
+            order = place_order(
+                cart,
+                shipping_cost=cart_discount.shipping(120),  # Fixed shipping cost for now
+                discount=cart_discount.total,
                 user=request.user if request.user.is_authenticated else None,
-                subtotal=cart.get_total_price(),
-                shipping_cost=120,  # Fixed shipping cost for now
-                total=cart.get_total_price() + 120,
-                shipping_first_name=request.POST.get('first_name'),
-                shipping_last_name=request.POST.get('last_name'),
+                shipping_full_name=full_name,
                 shipping_email=request.POST.get('email'),
                 shipping_phone=request.POST.get('phone'),
                 shipping_address=request.POST.get('address'),
@@ -492,23 +578,15 @@ def process_order(request):
                 payment_method=request.POST.get('payment_method', 'cash_on_delivery')
             )
             
-            # Create order items
-            for item_key, item in cart:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item['product'],
-                    product_name=item['product'].name,
-                    size=item.get('size'),
-                    quantity=item['quantity'],
-                    price=item['price']
-                )
-            
             # Clear the cart
             cart.clear()
             
             # Redirect to order success page WITH order_id parameter
             return redirect('order_success', order_id=order.id)  # Fixed - added order_id
             
+        except OutOfStock as e:
+            messages.error(request, str(e))
+            return redirect('cart_detail')
         except Exception as e:
             messages.error(request, f"There was an error processing your order: {str(e)}")
             return redirect('checkout')
@@ -517,10 +595,8 @@ def process_order(request):
 
 def order_success(request, order_id):
     order = get_object_or_404(Order, id=order_id)
-    sitesettings = SiteSettings.objects.first()
     
     context = {
-        'sitesettings': sitesettings,
         'order': order,
     }
     return render(request, 'store/order_success.html', context)
@@ -534,11 +610,26 @@ def order_details(request, order_id):
         messages.error(request, "You don't have permission to view this order.")
         return redirect('home')
     
-    sitesettings = SiteSettings.objects.first()
     
     context = {
-        'sitesettings': sitesettings,
         'order': order,
     }
     return render(request, 'store/order_details.html', context)
-    
\ No newline at end of file
+
+
+# card cache hit/miss counts for this process, for tuning CARD_CACHE_SECONDS and the cache size
+@staff_member_required
+def card_cache_stats(request):
+    return JsonResponse(get_card_stats())
+
+
+# every worker process's counters and latency histograms, for Prometheus to scrape;
+# without METRICS_TOKEN they are only served with DEBUG on
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')